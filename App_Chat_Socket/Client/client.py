@@ -110,6 +110,14 @@ class ChatClient:
             users = data.get("users", [])
             print(f"\n👥 User online ({len(users)}): {', '.join(users)}\n")
         
+        elif msg_type in ("presence_join", "presence_leave"):
+            # Format: {"type": "presence_join", "users": ["C"], "version": 7}
+            users = ", ".join(data.get("users", []))
+            if msg_type == "presence_join":
+                print(f"🟢 {users} vừa online")
+            else:
+                print(f"⚪ {users} đã offline")
+        
         elif msg_type == "error":
             # Lỗi từ server
             # Format: {"type": "error", "msg": "Username đã tồn tại"}
@@ -1,20 +1,65 @@
-﻿import socket
+﻿import os
+import socket
 import threading
 from typing import Callable, Optional
+from framing import FrameReader
+from file_transfer import FileSender, FileReceiver
+from blob_store import BlobStore
 from protocol import (
-    encode_message, decode_message, encode_file,
-    build_login, build_logout,
+    PROTO_V1, PROTO_V2, CAP_BLOBS, CAP_PRESENCE, CAP_ROOM_DELTA, CAP_DEFLATE, CAP_HEARTBEAT,
+    MAX_STREAM_FILE_SIZE,
+    encode_frame, decode_frame, encode_file, payload_bytes,
+    build_login, build_logout, build_blob_get, build_presence_sync, build_room_sync,
     build_create_room, build_join_room, build_leave_room,
-    build_private, build_group
+    build_private, build_group, build_history_request, build_pong
 )
 
+FILE_STREAM_TYPES = ("file_begin", "file_chunk", "file_end", "file_abort")
+# gói có version: type -> (luồng, là snapshot?)
+VERSIONED_TYPES = {
+    "user_list": ("presence", True),
+    "presence_join": ("presence", False),
+    "presence_leave": ("presence", False),
+    "room_list": ("rooms", True),
+    "room_delta": ("rooms", False),
+    "room_counts": ("rooms", False),  # snapshot khi có "full"
+}
+SYNC_BUILDERS = {"presence": build_presence_sync, "rooms": build_room_sync}
+CLIENT_CAPS = (CAP_BLOBS, CAP_PRESENCE, CAP_ROOM_DELTA, CAP_DEFLATE, CAP_HEARTBEAT)
+
+BLOB_CACHE_DIR = os.path.join("downloads", ".blobs")
+BLOB_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
 class ClientNetwork:
-    def __init__(self, host="127.0.0.1", port=5555):
+    def __init__(self, host="127.0.0.1", port=5555, proto: int = PROTO_V2, caps=CLIENT_CAPS):
         self.host = host
         self.port = port
         self.socket: Optional[socket.socket] = None
         self.connected = False
         self.running = False
+
+        # proto: version muốn dùng (gửi kèm login), self.proto: version đang dùng
+        self.preferred_proto = proto
+        self.proto = PROTO_V1
+        self._reader: Optional[FrameReader] = None
+        self._send_lock = threading.Lock()
+        # != None khi đang chờ server trả lời version -> giữ lại các gói gửi
+        self._pending: Optional[list] = None
+
+        # file gửi/nhận theo chunk
+        self.file_receiver = FileReceiver()
+        self._senders: dict[str, FileSender] = {}
+
+        # attachment server gửi dạng hash -> lấy từ cache, chưa có thì blob_get
+        self.blob_cache = BlobStore(BLOB_CACHE_DIR, BLOB_CACHE_MAX_BYTES)
+        # hash -> các message đang chờ blob về mới chuyển cho UI
+        self._waiting_blobs: dict[str, list[dict]] = {}
+
+        # tính năng gửi kèm login (vd CAP_ROOM_COUNTS thay cho CAP_ROOM_DELTA nếu chỉ cần số người)
+        self.caps = tuple(caps)
+        # version đã áp dụng của từng luồng delta (None = đang chờ snapshot)
+        self.versions: dict[str, Optional[int]] = {"presence": None, "rooms": None}
         self.on_message: Optional[Callable[[dict], None]] = None
         self.on_disconnect: Optional[Callable[[], None]] = None
 
@@ -28,6 +73,11 @@ class ClientNetwork:
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.host, self.port))
+            self.proto = PROTO_V1
+            self._pending = None
+            self._waiting_blobs = {}
+            self.versions = dict.fromkeys(self.versions)
+            self._reader = FrameReader(on_oversize=lambda size: print(f"Frame quá lớn ({size} bytes), bỏ qua"))
             self.connected = True
             self.running = True
             threading.Thread(target=self._recv_loop, daemon=True).start()
@@ -51,27 +101,60 @@ class ClientNetwork:
         if not self.connected or not self.socket:
             return False
         try:
-            self.socket.sendall(encode_message(data) + b"\n")
+            with self._send_lock:
+                if self._pending is not None:
+                    self._pending.append(data)
+                    return True
+                self.socket.sendall(encode_frame(data, self.proto))
             return True
         except Exception as e:
             print(f"Send error: {e}")
             self._handle_disconnect()
             return False
 
+    def _finish_negotiation(self, proto: int):
+        """Chốt version (gọi trên recv thread) rồi gửi các gói đang giữ"""
+        with self._send_lock:
+            self.proto = proto
+            self._reader.length_prefixed = proto == PROTO_V2
+            pending, self._pending = self._pending or [], None
+            for data in pending:
+                self.socket.sendall(encode_frame(data, proto))
+
     # ===== API =====
     def send_login(self, user: str) -> bool:
-        return self.send_raw(build_login(user))
+        if not self.connected or not self.socket:
+            return False
+        try:
+            with self._send_lock:
+                # login luôn gửi bằng v1, kèm version muốn dùng
+                self.socket.sendall(encode_frame(build_login(user, self.preferred_proto, self.caps)))
+                if self.preferred_proto != PROTO_V1:
+                    self._pending = []
+            return True
+        except Exception as e:
+            print(f"Send error: {e}")
+            self._handle_disconnect()
+            return False
 
     def send_logout(self, user: str) -> bool:
         return self.send_raw(build_logout(user))
 
+    def _encode_attachment(self, file_path: str) -> dict | None:
+        file_data = encode_file(file_path, raw=True)
+        if not file_data:
+            print(f"Failed to encode file: {file_path}")
+            return None
+        # server echo lại dạng hash -> hiển thị ngay từ cache, không tải lại
+        self.blob_cache.put(file_data["data"])
+        return file_data
+
     def send_private(self, from_user: str, to_user: str, msg: str, file_path: str = None) -> bool:
         """Gửi tin nhắn riêng, có thể kèm file"""
         file_data = None
         if file_path:
-            file_data = encode_file(file_path)
+            file_data = self._encode_attachment(file_path)
             if not file_data:
-                print(f"Failed to encode file: {file_path}")
                 return False
         
         return self.send_raw(build_private(from_user, to_user, msg, file_data))
@@ -89,28 +172,143 @@ class ClientNetwork:
         """Gửi tin nhắn nhóm, có thể kèm file"""
         file_data = None
         if file_path:
-            file_data = encode_file(file_path)
+            file_data = self._encode_attachment(file_path)
             if not file_data:
-                print(f"Failed to encode file: {file_path}")
                 return False
         
         return self.send_raw(build_group(room, user, msg, file_data))
 
+    def request_history(self, room: str = None, with_user: str = None, before: int = None) -> bool:
+        """Xin 1 trang lịch sử (trước message id before, None = mới nhất)"""
+        return self.send_raw(build_history_request(room, with_user, before))
+
+    def send_file_stream(self, from_user: str, file_path: str,
+                         to_user: str = None, room: str = None) -> Optional[str]:
+        """
+        Gửi file lớn theo chunk (file_begin/file_chunk/file_end) trên thread riêng.
+        Kết quả báo qua on_message: {"type": "file_sent", "ok": ...}
+        Return: transfer id, hoặc None nếu file không hợp lệ
+        """
+        try:
+            if os.path.getsize(file_path) > MAX_STREAM_FILE_SIZE:
+                return None
+        except OSError:
+            return None
+        sender = FileSender(self.send_raw, from_user, file_path, to_user, room,
+                            on_done=self._on_file_sent)
+        self._senders[sender.transfer_id] = sender
+        sender.start()
+        return sender.transfer_id
+
+    def _on_file_sent(self, result: dict):
+        self._senders.pop(result.get("id"), None)
+        if self.on_message:
+            self.on_message(result)
+
+    def _handle_file_frame(self, data: dict):
+        if data.get("type") == "file_abort":
+            sender = self._senders.get(data.get("id"))
+            if sender:
+                sender.cancel(data.get("reason", ""))
+                return
+        event = self.file_receiver.handle(data)
+        if event and self.on_message:
+            self.on_message(event)
+
+    # ===== Delta có version (presence, room) =====
+    def _track_version(self, data: dict) -> bool:
+        """
+        Kiểm tra version của snapshot / delta.
+        Return False nếu gói phải bỏ qua (chưa có snapshot hoặc lệch version -> xin lại snapshot).
+        """
+        stream, snapshot = VERSIONED_TYPES[data["type"]]
+        if snapshot or data.get("full"):
+            self.versions[stream] = data.get("version")  # server cũ không có version
+            return True
+        current = self.versions[stream]
+        if current is None:
+            return False
+        if data.get("version") != current + 1:
+            self.versions[stream] = None
+            self.send_raw(SYNC_BUILDERS[stream]())
+            return False
+        self.versions[stream] = current + 1
+        return True
+
+    # ===== Attachment theo hash =====
+    def _resolve_attachment(self, data: dict) -> bool:
+        """
+        Điền file["data"] cho message chỉ có hash.
+        Return False nếu phải chờ blob từ server (message được giữ lại tới khi blob về).
+        """
+        file_data = data.get("file")
+        if not isinstance(file_data, dict) or file_data.get("data") or not file_data.get("hash"):
+            return True
+        digest = file_data["hash"]
+        raw = self.blob_cache.get(digest)
+        if raw is not None:
+            file_data["data"] = raw
+            return True
+        waiting = self._waiting_blobs.setdefault(digest, [])
+        waiting.append(data)
+        if len(waiting) == 1:
+            self.send_raw(build_blob_get(digest))
+        return False
+
+    def _on_blob(self, data: dict):
+        digest = data.get("hash", "")
+        raw = None
+        if data.get("data"):
+            raw = payload_bytes(data["data"])
+            if BlobStore.hash_bytes(raw) != digest:
+                raw = None
+            else:
+                self.blob_cache.put(raw)
+        self._release_waiting(digest, raw)
+
+    def _release_waiting(self, digest: str, raw: bytes | None):
+        for msg in self._waiting_blobs.pop(digest, []):
+            if raw is None:
+                msg["file"]["missing"] = True
+            else:
+                msg["file"]["data"] = raw
+            if self.on_message:
+                self.on_message(msg)
+
     # ===== Receive =====
     def _recv_loop(self):
-        buffer = b""
+        reader = self._reader
         try:
             while self.running and self.connected:
-                chunk = self.socket.recv(4096)
-                if not chunk:
+                if not reader.recv_from(self.socket):
                     break
-                buffer += chunk
-                while b"\n" in buffer:
-                    line, buffer = buffer.split(b"\n", 1)
-                    if not line:
+                for line in reader.frames():
+                    data = decode_frame(line, self.proto)
+                    if data is None:
+                        continue
+                    if data.get("type") == "hello":
+                        self._finish_negotiation(data.get("proto", PROTO_V1))
+                        continue
+                    if self._pending is not None:
+                        # server cũ không gửi hello -> giữ v1
+                        self._finish_negotiation(PROTO_V1)
+                    if data.get("type") == "ping":
+                        # server kiểm tra connection còn sống (caps heartbeat)
+                        self.send_raw(build_pong())
+                        continue
+                    if data.get("type") == "pong":
+                        continue
+                    if data.get("type") in FILE_STREAM_TYPES:
+                        self._handle_file_frame(data)
+                        continue
+                    if data.get("type") == "blob":
+                        self._on_blob(data)
+                        continue
+                    if data.get("type") in VERSIONED_TYPES and not self._track_version(data):
+                        continue
+                    if not self._resolve_attachment(data):
                         continue
-                    data = decode_message(line)
-                    if data is not None and self.on_message:
+                    if self.on_message:
                         self.on_message(data)
         except Exception as e:
             print(f"Receive error: {e}")
@@ -120,5 +318,10 @@ class ClientNetwork:
         if self.connected:
             self.connected = False
             self.running = False
+            self.file_receiver.abort_all()
+            for digest in list(self._waiting_blobs):
+                self._release_waiting(digest, None)
+            for sender in list(self._senders.values()):
+                sender.cancel("Mất kết nối")
             if self.on_disconnect:
                 self.on_disconnect()
\ No newline at end of file
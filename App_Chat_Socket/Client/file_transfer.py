@@ -0,0 +1,191 @@
+import os
+import uuid
+import base64
+import hashlib
+import tempfile
+import mimetypes
+import threading
+from typing import Callable, Optional
+
+from protocol import (
+    MAX_STREAM_FILE_SIZE, iter_file_chunks, chunk_checksum, valid_transfer_id,
+    build_file_begin, build_file_chunk, build_file_end, build_file_abort,
+)
+
+
+class FileSender(threading.Thread):
+    """
+    Gửi 1 file theo chunk trên thread riêng.
+    Mỗi chunk là 1 frame -> chat vẫn gửi/nhận xen kẽ, RAM không phụ thuộc kích thước file.
+    """
+
+    def __init__(self, send: Callable[[dict], bool], sender: str, file_path: str,
+                 to_user: str | None = None, room: str | None = None,
+                 on_done: Optional[Callable[[dict], None]] = None):
+        super().__init__(daemon=True)
+        self.send = send
+        self.sender = sender
+        self.file_path = file_path
+        self.to_user = to_user
+        self.room = room
+        self.on_done = on_done
+        self.transfer_id = uuid.uuid4().hex
+        self.abort_reason: str | None = None
+        self._cancelled = threading.Event()
+
+    def cancel(self, reason: str):
+        """Server/người nhận từ chối -> dừng gửi các chunk còn lại"""
+        self.abort_reason = reason
+        self._cancelled.set()
+
+    def run(self):
+        name = os.path.basename(self.file_path)
+        size = os.path.getsize(self.file_path)
+        mime = mimetypes.guess_type(self.file_path)[0] or "application/octet-stream"
+        result = {"type": "file_sent", "id": self.transfer_id, "name": name, "size": size,
+                  "to": self.to_user, "room": self.room, "ok": False}
+        try:
+            ok = self.send(build_file_begin(self.sender, self.transfer_id, name, mime, size,
+                                            self.to_user, self.room))
+            digest = hashlib.sha256()
+            chunks = 0
+            for index, chunk in iter_file_chunks(self.file_path):
+                if not ok or self._cancelled.is_set():
+                    ok = False
+                    break
+                digest.update(chunk)
+                ok = self.send(build_file_chunk(self.sender, self.transfer_id, index, chunk,
+                                                self.to_user, self.room))
+                chunks += 1
+            if ok:
+                ok = self.send(build_file_end(self.sender, self.transfer_id, chunks,
+                                              digest.hexdigest(), self.to_user, self.room))
+            result["ok"] = ok
+            if self.abort_reason:
+                result["error"] = self.abort_reason
+        except OSError as e:
+            self.send(build_file_abort(self.sender, self.transfer_id, str(e), self.to_user, self.room))
+            result["error"] = str(e)
+        if self.on_done:
+            self.on_done(result)
+
+
+class _Incoming:
+    __slots__ = ("info", "fh", "part_path", "next_index", "received", "digest")
+
+    def __init__(self, info: dict, fh, part_path: str):
+        self.info = info
+        self.fh = fh
+        self.part_path = part_path
+        self.next_index = 0
+        self.received = 0
+        self.digest = hashlib.sha256()
+
+
+class FileReceiver:
+    """
+    Nhận file_begin/file_chunk/file_end: ghi thẳng từng chunk xuống đĩa (file .part),
+    kiểm tra crc32 từng chunk + thứ tự + sha256 cuối cùng.
+    handle() trả về event cho UI khi transfer kết thúc:
+      {"type": "file_received", ...} hoặc {"type": "file_failed", ...}
+    """
+
+    def __init__(self, save_dir: str = "downloads"):
+        self.save_dir = save_dir
+        self._incoming: dict[str, _Incoming] = {}
+
+    def handle(self, data: dict) -> dict | None:
+        t = data.get("type")
+        tid = data.get("id")
+        if not valid_transfer_id(tid):
+            return None
+        if t == "file_begin":
+            return self._begin(tid, data)
+
+        inc = self._incoming.get(tid)
+        if inc is None:
+            return None
+        if t == "file_chunk":
+            return self._chunk(tid, inc, data)
+        if t == "file_end":
+            return self._end(tid, inc, data)
+        if t == "file_abort":
+            return self._fail(tid, inc, data.get("reason", "Người gửi hủy"))
+        return None
+
+    def _begin(self, tid: str, data: dict) -> dict | None:
+        size = data.get("size", 0)
+        if tid in self._incoming or not isinstance(size, int) or size > MAX_STREAM_FILE_SIZE:
+            return None
+        part_dir = os.path.join(self.save_dir, ".partial")
+        os.makedirs(part_dir, exist_ok=True)
+        # tên file .part do mkstemp sinh, không chứa gì từ người gửi
+        fd, part_path = tempfile.mkstemp(prefix="recv-", suffix=".part", dir=part_dir)
+        self._incoming[tid] = _Incoming(data, os.fdopen(fd, "wb"), part_path)
+        return None
+
+    def _chunk(self, tid: str, inc: _Incoming, data: dict) -> dict | None:
+        try:
+            chunk = data.get("data", b"")
+            if isinstance(chunk, str):  # nhận bằng protocol v1
+                chunk = base64.b64decode(chunk)
+            checksum = chunk_checksum(chunk)
+        except (TypeError, ValueError):  # data sai kiểu / base64 hỏng (binascii.Error)
+            return self._fail(tid, inc, f"Chunk {inc.next_index} không hợp lệ")
+        if data.get("index") != inc.next_index:
+            return self._fail(tid, inc, f"Mất chunk {inc.next_index}")
+        if checksum != data.get("crc"):
+            return self._fail(tid, inc, f"Sai checksum chunk {inc.next_index}")
+        inc.received += len(chunk)
+        if inc.received > inc.info.get("size", 0):
+            return self._fail(tid, inc, "Nhận nhiều hơn kích thước khai báo")
+        inc.fh.write(chunk)
+        inc.digest.update(chunk)
+        inc.next_index += 1
+        return None
+
+    def _end(self, tid: str, inc: _Incoming, data: dict) -> dict | None:
+        if data.get("chunks") != inc.next_index or inc.received != inc.info.get("size"):
+            return self._fail(tid, inc, "Thiếu dữ liệu")
+        if data.get("sha256") != inc.digest.hexdigest():
+            return self._fail(tid, inc, "Sai sha256")
+        inc.fh.close()
+        del self._incoming[tid]
+
+        save_path = self._unique_path(inc.info.get("name", "unknown"))
+        os.replace(inc.part_path, save_path)
+        return self._event("file_received", inc.info, path=save_path)
+
+    def _fail(self, tid: str, inc: _Incoming, reason: str) -> dict:
+        inc.fh.close()
+        self._incoming.pop(tid, None)
+        try:
+            os.remove(inc.part_path)
+        except OSError:
+            pass
+        return self._event("file_failed", inc.info, reason=reason)
+
+    def abort_all(self, reason: str = "Mất kết nối"):
+        for tid, inc in list(self._incoming.items()):
+            self._fail(tid, inc, reason)
+
+    def _unique_path(self, file_name: str) -> str:
+        file_name = os.path.basename(file_name if isinstance(file_name, str) else "") or "unknown"
+        save_path = os.path.join(self.save_dir, file_name)
+        base_name, ext = os.path.splitext(file_name)
+        counter = 1
+        while os.path.exists(save_path):
+            save_path = os.path.join(self.save_dir, f"{base_name}_{counter}{ext}")
+            counter += 1
+        return save_path
+
+    @staticmethod
+    def _event(t: str, info: dict, **extra) -> dict:
+        event = {
+            "type": t, "id": info.get("id"), "from": info.get("from"),
+            "to": info.get("to"), "room": info.get("room"),
+            "name": info.get("name"), "mime": info.get("mime"), "size": info.get("size"),
+            "timestamp": info.get("timestamp", ""),
+        }
+        event.update(extra)
+        return event
@@ -0,0 +1,120 @@
+import struct
+from typing import Callable, Iterator, Optional
+
+# Frame lớn nhất được nhận (attachment 5MB base64 ~ 7MB + JSON)
+DEFAULT_MAX_FRAME = 8 * 1024 * 1024
+RECV_SIZE = 64 * 1024
+
+_LENGTH = struct.Struct("!I")  # giống protocol.V2_LENGTH
+
+
+class FrameReader:
+    """
+    Tách frame (JSON + \\n) từ luồng byte TCP trong thời gian tuyến tính.
+    - buffer là bytearray: thêm vào cuối / cắt ở đầu không copy lại cả buffer
+    - _scan nhớ vị trí đã quét -> mỗi byte chỉ tìm \\n đúng 1 lần
+    - frame vượt max_frame bị bỏ dần khi đang nhận, không giữ trọn trong RAM
+    - length_prefixed=True: chế độ protocol v2 (u32 length + body), không cần quét byte;
+      có thể chuyển chế độ giữa chừng (sau gói hello) vì frames() đọc cờ ở từng frame
+
+    Dùng chung cho server và client (file này giống nhau ở 2 bên).
+    """
+
+    def __init__(self, max_frame: int = DEFAULT_MAX_FRAME, recv_size: int = RECV_SIZE,
+                 on_oversize: Optional[Callable[[int], None]] = None):
+        self.max_frame = max_frame
+        self.on_oversize = on_oversize
+        self.oversized = 0
+        self.length_prefixed = False
+
+        self._buf = bytearray()
+        self._scan = 0
+        self._discarding = False
+        self._skip = 0  # số byte còn phải bỏ của frame v2 quá lớn
+        self._chunk = bytearray(recv_size)
+        self._view = memoryview(self._chunk)
+
+    def __len__(self):
+        return len(self._buf)
+
+    def recv_from(self, sock) -> int:
+        """recv_into buffer tạm rồi nối vào buffer chính. Trả về 0 khi socket đóng."""
+        n = sock.recv_into(self._chunk)
+        if n:
+            self._buf += self._view[:n]
+        return n
+
+    def feed(self, data: bytes):
+        self._buf += data
+
+    def frames(self) -> Iterator[bytes]:
+        """Lần lượt trả về các frame hoàn chỉnh đang có trong buffer (bỏ dòng rỗng)"""
+        while True:
+            frame = self._next_sized() if self.length_prefixed else self._next_line()
+            if frame is None:
+                return
+            if frame:
+                yield frame
+
+    def _next_line(self) -> Optional[bytes]:
+        buf = self._buf
+        idx = buf.find(b"\n", self._scan)
+
+        if idx < 0:
+            if self._discarding:
+                # vẫn đang trong frame quá lớn -> bỏ luôn phần vừa nhận
+                del buf[:]
+                self._scan = 0
+            elif len(buf) > self.max_frame:
+                self._reject(len(buf))
+                del buf[:]
+                self._scan = 0
+            else:
+                self._scan = len(buf)
+            return None
+
+        if self._discarding or idx > self.max_frame:
+            # kết thúc của frame quá lớn
+            if not self._discarding:
+                self._reject(idx)
+            self._discarding = False
+            del buf[:idx + 1]
+            self._scan = 0
+            return b""
+
+        frame = bytes(buf[:idx])
+        del buf[:idx + 1]
+        self._scan = 0
+        return frame
+
+    def _next_sized(self) -> Optional[bytes]:
+        buf = self._buf
+        if self._skip:
+            n = min(self._skip, len(buf))
+            del buf[:n]
+            self._skip -= n
+            if self._skip:
+                return None
+
+        if len(buf) < _LENGTH.size:
+            return None
+        (size,) = _LENGTH.unpack_from(buf, 0)
+        if size > self.max_frame:
+            self._reject(size)
+            self._discarding = False
+            del buf[:_LENGTH.size]
+            self._skip = size
+            return b""
+
+        end = _LENGTH.size + size
+        if len(buf) < end:
+            return None
+        frame = bytes(buf[_LENGTH.size:end])
+        del buf[:end]
+        return frame
+
+    def _reject(self, size: int):
+        self._discarding = True
+        self.oversized += 1
+        if self.on_oversize:
+            self.on_oversize(size)
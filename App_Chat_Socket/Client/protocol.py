@@ -1,30 +1,426 @@
 ﻿import json
+import zlib
 import base64
 import os
+import re
+import struct
 import mimetypes
 from datetime import datetime
 
 ENCODING = "utf-8"
 
+# v1: JSON + \n (mặc định) | v2: length-prefixed binary, thỏa thuận lúc login
+PROTO_V1 = 1
+PROTO_V2 = 2
+SUPPORTED_PROTOS = (PROTO_V1, PROTO_V2)
+
+def _json_default(obj):
+    # payload nhị phân (từ client v2) -> base64 khi gửi cho client v1
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return base64.b64encode(obj).decode("ascii")
+    raise TypeError(f"Không encode được {type(obj).__name__}")
+
+# ===== JSON codec =====
+# Mọi frame JSON (v1 và phần meta của v2) đi qua CODEC. Dùng orjson nếu đã cài
+# (nhanh hơn nhiều, nhận/trả bytes trực tiếp), không có thì dùng json của stdlib.
+# Chọn cụ thể: biến môi trường CHAT_JSON_CODEC=stdlib|orjson hoặc set_codec().
+class StdlibCodec:
+    name = "stdlib"
+
+    @staticmethod
+    def dumps(data) -> bytes:
+        return json.dumps(data, ensure_ascii=False, default=_json_default).encode(ENCODING)
+
+    @staticmethod
+    def loads(raw):
+        return json.loads(str(raw, ENCODING))  # bytes / memoryview (meta của v2)
+
+
+class OrjsonCodec:
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._dumps = orjson.dumps
+        self.loads = orjson.loads
+        self._option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, data) -> bytes:
+        try:
+            return self._dumps(data, default=_json_default, option=self._option)
+        except TypeError:
+            # giá trị orjson không hỗ trợ (vd số nguyên > 64 bit): để stdlib xử lý
+            return StdlibCodec.dumps(data)
+
+
+def _load_codecs() -> dict:
+    codecs = {StdlibCodec.name: StdlibCodec()}
+    try:
+        codecs[OrjsonCodec.name] = OrjsonCodec()
+    except ImportError:
+        pass
+    return codecs
+
+JSON_CODECS = _load_codecs()
+CODEC = JSON_CODECS.get(os.environ.get("CHAT_JSON_CODEC", ""), JSON_CODECS.get("orjson", JSON_CODECS["stdlib"]))
+
+def set_codec(name: str):
+    """Đổi JSON codec cho cả process (KeyError nếu codec chưa cài)"""
+    global CODEC
+    CODEC = JSON_CODECS[name]
+
 def encode_message(data: dict) -> bytes:
-    text = json.dumps(data, ensure_ascii=False)
-    return text.encode(ENCODING)
+    return CODEC.dumps(data)
+
+def encode_frame(data: dict, proto: int = PROTO_V1) -> bytes:
+    """
+    Encode 1 frame hoàn chỉnh theo version đã thỏa thuận
+    (v1: JSON + delimiter \\n, v2: length prefix + header nhị phân).
+    bytes là immutable -> broadcast có thể dùng chung 1 frame cho mọi socket.
+    """
+    if proto == PROTO_V2:
+        return encode_message_v2(data)
+    return encode_message(data) + b"\n"
 
 def decode_message(raw: bytes) -> dict | None:
     try:
-        text = raw.decode(ENCODING)
-        return json.loads(text)
+        data = CODEC.loads(raw)
     except Exception:
         return None
+    return data if isinstance(data, dict) else None
+
+def decode_frame(raw: bytes, proto: int = PROTO_V1) -> dict | None:
+    """Decode 1 frame (đã tách bởi FrameReader) theo version"""
+    if proto == PROTO_V2:
+        return decode_message_v2(raw)
+    return decode_message(raw)
+
+# builder / codec nào cũng đặt "type" là key đầu tiên
+_V1_TYPE_PREFIXES = (b'{"type":"', b'{"type": "')
+
+def peek_type(raw: bytes, proto: int = PROTO_V1) -> str | None:
+    """
+    Đọc type của frame mà không decode (vd để rate limit trước khi parse JSON).
+    None nếu không đọc nhanh được: v1 có key khác đứng trước "type", v2 type không có mã.
+    Chỉ là gợi ý: JSON có thể lặp key, type thật là type sau khi decode.
+    """
+    if proto == PROTO_V2:
+        code = raw[0] if raw else 0
+        return V2_TYPES[code] if code < len(V2_TYPES) else None
+    for prefix in _V1_TYPE_PREFIXES:
+        if raw.startswith(prefix):
+            start = len(prefix)
+            end = raw.find(b'"', start, start + 32)
+            if end < 0:
+                return None
+            try:
+                return raw[start:end].decode("ascii")
+            except UnicodeDecodeError:
+                return None
+    return None
+
+def decode_typed(raw: bytes, proto: int = PROTO_V1):
+    """
+    Như decode_frame nhưng login / private / group / thao tác phòng trả về
+    object có kiểu (xem TYPED_MESSAGES), type khác vẫn là dict.
+    v2: object được tạo thẳng từ header, không qua dict trung gian.
+    """
+    if proto == PROTO_V2:
+        return _decode_v2(raw, True)
+    data = decode_message(raw)
+    return typed_message(data) if data is not None else None
+
+# ===== Protocol v2 =====
+# frame  = u32 body_len | body
+# body   = header | from | to | room | meta (JSON) | payload (raw bytes)
+# header = u8 type | u8 flags | u32 seq | u16 len(from) | u16 len(to) | u16 len(room) | u32 len(meta)
+V2_LENGTH = struct.Struct("!I")
+V2_HEADER = struct.Struct("!BBIHHHI")
+
+V2_TYPES = (
+    None, "login", "logout", "private", "group",
+    "create_room", "join_room", "leave_room",
+    "user_list", "room_list", "system", "error", "hello",
+    "file_begin", "file_chunk", "file_end", "file_abort",
+    "blob_get", "blob",
+    "presence_join", "presence_leave", "presence_sync",
+    "room_delta", "room_counts", "room_sync",
+    "history",
+    "ping", "pong",
+)
+V2_TYPE_CODES = {t: i for i, t in enumerate(V2_TYPES) if t}
+V2_TYPE_UNKNOWN = 0  # type không có mã -> nằm trong meta
+
+# Các type dùng key "user" thay cho "from" cho ô người gửi
+_V2_USER_KEY_TYPES = {"login", "logout", "create_room", "join_room", "leave_room"}
+
+V2_FLAG_FILE_PAYLOAD = 0x01  # payload = file["data"]
+V2_FLAG_DATA_PAYLOAD = 0x02  # payload = data["data"]
+V2_FLAG_DEFLATE = 0x04       # phần sau header (from|to|room|meta|payload) được nén deflate
+
+# ===== Nén frame v2 =====
+# Client login với caps ["deflate"] + proto v2: server nén frame >= ngưỡng (room_list,
+# trang history, attachment inline...), chat ngắn gửi nguyên. Mỗi frame nén độc lập
+# (raw deflate, không giữ dictionary giữa các frame) nên 1 frame nén dùng chung được
+# cho mọi người nhận của 1 broadcast. Bên nhận chỉ cần nhìn cờ V2_FLAG_DEFLATE.
+CAP_DEFLATE = "deflate"
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+MAX_INFLATED_SIZE = 32 * 1024 * 1024  # chặn "zip bomb"
+
+def compress_frame_v2(frame: bytes, level: int = COMPRESS_LEVEL) -> bytes:
+    """Frame v2 (có u32 length) -> bản nén; trả lại frame gốc nếu nén không nhỏ hơn"""
+    start = V2_LENGTH.size + V2_HEADER.size
+    deflater = zlib.compressobj(level, zlib.DEFLATED, -15)
+    packed = deflater.compress(memoryview(frame)[start:]) + deflater.flush()
+    if len(packed) >= len(frame) - start:
+        return frame
+    code, flags, *lengths = V2_HEADER.unpack_from(frame, V2_LENGTH.size)
+    header = V2_HEADER.pack(code, flags | V2_FLAG_DEFLATE, *lengths)
+    return b"".join((V2_LENGTH.pack(len(header) + len(packed)), header, packed))
+
+def _inflate(data) -> bytes:
+    inflater = zlib.decompressobj(wbits=-15)
+    out = inflater.decompress(data, MAX_INFLATED_SIZE)
+    if inflater.unconsumed_tail or not inflater.eof:
+        raise ValueError("Frame nén quá lớn hoặc hỏng")
+    return out
+
+def payload_bytes(value) -> bytes:
+    if isinstance(value, str):
+        return base64.b64decode(value)
+    return bytes(value)
+
+def encode_message_v2(data: dict) -> bytes:
+    meta = dict(data)
+    t = meta.pop("type", None)
+    code = V2_TYPE_CODES.get(t, V2_TYPE_UNKNOWN)
+    if code == V2_TYPE_UNKNOWN and t is not None:
+        meta["type"] = t
+
+    sender_key = "user" if t in _V2_USER_KEY_TYPES else "from"
+    sender = str(meta.pop(sender_key, "") or "").encode(ENCODING)
+    to_user = str(meta.pop("to", "") or "").encode(ENCODING)
+    room = str(meta.pop("room", "") or "").encode(ENCODING)
+    seq = int(meta.pop("seq", 0) or 0)
+
+    flags = 0
+    payload = b""
+    file_data = meta.get("file")
+    if isinstance(file_data, dict) and file_data.get("data"):
+        file_meta = dict(file_data)
+        payload = payload_bytes(file_meta.pop("data"))
+        meta["file"] = file_meta
+        flags |= V2_FLAG_FILE_PAYLOAD
+    elif isinstance(meta.get("data"), (bytes, bytearray, memoryview)):
+        payload = bytes(meta.pop("data"))
+        flags |= V2_FLAG_DATA_PAYLOAD
+
+    meta_raw = CODEC.dumps(meta) if meta else b""
+    header = V2_HEADER.pack(code, flags, seq, len(sender), len(to_user), len(room), len(meta_raw))
+    body_len = len(header) + len(sender) + len(to_user) + len(room) + len(meta_raw) + len(payload)
+    return b"".join((V2_LENGTH.pack(body_len), header, sender, to_user, room, meta_raw, payload))
+
+def decode_message_v2(raw: bytes) -> dict | None:
+    """raw = body (không gồm 4 byte length, FrameReader đã bỏ)"""
+    return _decode_v2(raw, False)
+
+def _decode_v2(raw: bytes, typed: bool):
+    try:
+        code, flags, seq, n_from, n_to, n_room, n_meta = V2_HEADER.unpack_from(raw, 0)
+        pos = V2_HEADER.size
+        if flags & V2_FLAG_DEFLATE:
+            raw = _inflate(memoryview(raw)[pos:])
+            pos = 0
+        sender = raw[pos:pos + n_from].decode(ENCODING)
+        pos += n_from
+        to_user = raw[pos:pos + n_to].decode(ENCODING)
+        pos += n_to
+        room = raw[pos:pos + n_room].decode(ENCODING)
+        pos += n_room
+        data = CODEC.loads(raw[pos:pos + n_meta]) if n_meta else {}
+        pos += n_meta
+
+        t = V2_TYPES[code] if code else data.get("type")
+        if not isinstance(t, str):
+            return None
+        if flags & V2_FLAG_FILE_PAYLOAD:
+            data.setdefault("file", {})["data"] = bytes(raw[pos:])
+        elif flags & V2_FLAG_DATA_PAYLOAD:
+            data["data"] = bytes(raw[pos:])
+        if typed:
+            cls = TYPED_MESSAGES.get(t)
+            if cls is not None:
+                return cls.from_v2(sender.strip(), to_user.strip(), room.strip(), data)
+
+        data["type"] = t
+        if sender:
+            data["user" if t in _V2_USER_KEY_TYPES else "from"] = sender
+        if to_user:
+            data["to"] = to_user
+        if room:
+            data["room"] = room
+        if seq:
+            data["seq"] = seq
+        return data
+    except Exception:
+        return None
+
+# ===== Typed messages (server nhận) =====
+# Các type client gửi nhiều nhất được decode thành object __slots__: trường chuỗi đã
+# strip, sai kiểu thì thành "" -> handler đọc thuộc tính thay vì data.get(...).strip()
+# lặp lại. to_dict() trả về dạng dict như decode_frame (để log / chuyển tiếp).
+def text_field(value, strip: bool = True) -> str:
+    """Trường chuỗi từ client: sai kiểu -> ""; nội dung message giữ nguyên khoảng trắng (strip=False)"""
+    if not isinstance(value, str):
+        return ""
+    return value.strip() if strip else value
+
+class Message:
+    __slots__ = ()
+    type = ""
+    fields: tuple = ()  # tên thuộc tính (lớp con của RoomOp có __slots__ rỗng)
+
+    def to_dict(self) -> dict:
+        data = {"type": self.type}
+        for key in self.fields:
+            data[key] = getattr(self, key)
+        return data
+
+    def __eq__(self, other):
+        return type(other) is type(self) and all(
+            getattr(self, k) == getattr(other, k) for k in self.fields)
+
+    def __repr__(self):
+        values = ", ".join(f"{k}={getattr(self, k)!r}" for k in self.fields)
+        return f"{type(self).__name__}({values})"
+
+class Login(Message):
+    __slots__ = fields = ("user", "proto", "caps")
+    type = "login"
+
+    def __init__(self, user: str, proto=None, caps: frozenset = frozenset()):
+        self.user = user
+        self.proto = proto
+        self.caps = caps
+
+    def to_dict(self) -> dict:
+        return build_login(self.user, self.proto or PROTO_V1, self.caps)
+
+    @staticmethod
+    def _caps(caps) -> frozenset:
+        if isinstance(caps, list):
+            return frozenset(c for c in caps if isinstance(c, str))
+        return frozenset()
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Login":
+        return cls(text_field(data.get("user")), data.get("proto"), cls._caps(data.get("caps")))
+
+    @classmethod
+    def from_v2(cls, sender: str, to_user: str, room: str, meta: dict) -> "Login":
+        return cls(sender, meta.get("proto"), cls._caps(meta.get("caps")))
+
+class Private(Message):
+    __slots__ = fields = ("sender", "to", "msg", "file")
+    type = "private"
+
+    def __init__(self, sender: str, to: str, msg="", file: dict | None = None):
+        self.sender = sender
+        self.to = to
+        self.msg = msg
+        self.file = file
+
+    def to_dict(self) -> dict:
+        data = {"type": self.type, "from": self.sender, "to": self.to, "msg": self.msg}
+        if self.file:
+            data["file"] = self.file
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Private":
+        return cls(text_field(data.get("from")), text_field(data.get("to")), text_field(data.get("msg"), False),
+                   data.get("file"))
+
+    @classmethod
+    def from_v2(cls, sender: str, to_user: str, room: str, meta: dict) -> "Private":
+        return cls(sender, to_user, text_field(meta.get("msg"), False), meta.get("file"))
+
+class Group(Message):
+    __slots__ = fields = ("room", "sender", "msg", "file")
+    type = "group"
+
+    def __init__(self, room: str, sender: str, msg="", file: dict | None = None):
+        self.room = room
+        self.sender = sender
+        self.msg = msg
+        self.file = file
+
+    def to_dict(self) -> dict:
+        data = {"type": self.type, "room": self.room, "from": self.sender, "msg": self.msg}
+        if self.file:
+            data["file"] = self.file
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Group":
+        return cls(text_field(data.get("room")), text_field(data.get("from")), text_field(data.get("msg"), False),
+                   data.get("file"))
+
+    @classmethod
+    def from_v2(cls, sender: str, to_user: str, room: str, meta: dict) -> "Group":
+        return cls(room, sender, text_field(meta.get("msg"), False), meta.get("file"))
+
+class RoomOp(Message):
+    """create_room / join_room / leave_room: cùng 2 trường user + room"""
+    __slots__ = fields = ("user", "room")
+
+    def __init__(self, user: str, room: str):
+        self.user = user
+        self.room = room
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RoomOp":
+        return cls(text_field(data.get("user")), text_field(data.get("room")))
+
+    @classmethod
+    def from_v2(cls, sender: str, to_user: str, room: str, meta: dict) -> "RoomOp":
+        return cls(sender, room)
+
+class CreateRoom(RoomOp):
+    __slots__ = ()
+    type = "create_room"
+
+class JoinRoom(RoomOp):
+    __slots__ = ()
+    type = "join_room"
+
+class LeaveRoom(RoomOp):
+    __slots__ = ()
+    type = "leave_room"
+
+TYPED_MESSAGES = {cls.type: cls for cls in (Login, Private, Group, CreateRoom, JoinRoom, LeaveRoom)}
+
+def typed_message(data: dict):
+    """
+    dict đã decode -> object có kiểu nếu type nằm trong TYPED_MESSAGES, ngược lại giữ nguyên;
+    None nếu type không phải chuỗi (vd ["group"], không dùng làm key tra bảng được)
+    """
+    t = data.get("type")
+    if not isinstance(t, str):
+        return None
+    cls = TYPED_MESSAGES.get(t)
+    return cls.from_dict(data) if cls is not None else data
 
 def now_ts() -> str:
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
 # ===== File handling =====
-def encode_file(file_path: str) -> dict | None:
+def encode_file(file_path: str, raw: bool = False) -> dict | None:
     """
     Đọc file và encode thành base64
     Return: {"name": "filename.ext", "data": "base64...", "type": "image/png", "size": 12345}
+    raw=True: "data" giữ bytes gốc (v2 gửi thẳng, v1 tự base64 khi encode_message)
     """
     try:
         if not os.path.exists(file_path):
@@ -33,8 +429,8 @@ def encode_file(file_path: str) -> dict | None:
         file_name = os.path.basename(file_path)
         file_size = os.path.getsize(file_path)
         
-        # Giới hạn 5MB
-        if file_size > 5 * 1024 * 1024:
+        # Giới hạn 5MB (file lớn hơn gửi theo chunk, xem file_begin)
+        if file_size > INLINE_FILE_LIMIT:
             return None
         
         # Đọc file
@@ -42,7 +438,7 @@ def encode_file(file_path: str) -> dict | None:
             file_data = f.read()
         
         # Encode base64
-        b64_data = base64.b64encode(file_data).decode('ascii')
+        b64_data = file_data if raw else base64.b64encode(file_data).decode('ascii')
         
         # Xác định MIME type
         mime_type, _ = mimetypes.guess_type(file_path)
@@ -59,6 +455,91 @@ def encode_file(file_path: str) -> dict | None:
         print(f"Error encoding file: {e}")
         return None
 
+# ===== Streaming file transfer =====
+# file_begin -> N x file_chunk (kèm crc32 từng chunk) -> file_end (kèm sha256)
+# Chunk là frame riêng nên tin nhắn chat vẫn chen được vào giữa.
+INLINE_FILE_LIMIT = 5 * 1024 * 1024        # gửi kèm message (encode_file)
+MAX_STREAM_FILE_SIZE = 512 * 1024 * 1024   # gửi theo chunk
+FILE_CHUNK_SIZE = 64 * 1024
+# id do người gửi tạo (uuid4().hex); kiểm tra ở cả server lẫn bên nhận trước khi dùng
+TRANSFER_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+def valid_transfer_id(tid) -> bool:
+    return isinstance(tid, str) and TRANSFER_ID_RE.fullmatch(tid) is not None
+
+def iter_file_chunks(file_path: str, chunk_size: int = FILE_CHUNK_SIZE):
+    """Đọc file từng chunk (bộ nhớ không đổi theo kích thước file)"""
+    with open(file_path, "rb") as f:
+        index = 0
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield index, chunk
+            index += 1
+
+def chunk_checksum(data: bytes) -> int:
+    return zlib.crc32(data) & 0xFFFFFFFF
+
+def _file_target(data: dict, to_user: str | None, room: str | None) -> dict:
+    if room:
+        data["room"] = room
+    else:
+        data["to"] = to_user
+    return data
+
+def build_file_begin(sender: str, transfer_id: str, name: str, mime: str, size: int,
+                     to_user: str | None = None, room: str | None = None) -> dict:
+    return _file_target({
+        "type": "file_begin", "from": sender, "id": transfer_id,
+        "name": name, "mime": mime, "size": size,
+        "chunk_size": FILE_CHUNK_SIZE, "timestamp": now_ts(),
+    }, to_user, room)
+
+def build_file_chunk(sender: str, transfer_id: str, index: int, chunk: bytes | str,
+                     to_user: str | None = None, room: str | None = None, crc: int | None = None) -> dict:
+    """crc: giữ crc của người gửi khi server chuyển tiếp (chunk có thể là base64 của v1)"""
+    return _file_target({
+        "type": "file_chunk", "from": sender, "id": transfer_id,
+        "index": index, "crc": chunk_checksum(chunk) if crc is None else crc, "data": chunk,
+    }, to_user, room)
+
+def build_file_end(sender: str, transfer_id: str, chunks: int, sha256: str,
+                   to_user: str | None = None, room: str | None = None) -> dict:
+    return _file_target({
+        "type": "file_end", "from": sender, "id": transfer_id,
+        "chunks": chunks, "sha256": sha256,
+    }, to_user, room)
+
+def build_file_abort(sender: str, transfer_id: str, reason: str,
+                     to_user: str | None = None, room: str | None = None) -> dict:
+    return _file_target({
+        "type": "file_abort", "from": sender, "id": transfer_id, "reason": reason,
+    }, to_user, room)
+
+# ===== Attachment theo hash (blob store) =====
+# Server lưu data của attachment inline theo sha256, message chỉ mang
+# {"hash", "name", "type", "size"}. Client nào login với caps ["blobs"] tự lấy
+# data bằng blob_get (hoặc dùng bản đã cache); client cũ vẫn nhận data inline.
+CAP_BLOBS = "blobs"
+
+def build_file_ref(file_data: dict, digest: str, size: int) -> dict:
+    return {
+        "hash": digest,
+        "name": file_data.get("name", "unknown"),
+        "type": file_data.get("type", "application/octet-stream"),
+        "size": size,
+    }
+
+def build_blob_get(digest: str) -> dict:
+    return {"type": "blob_get", "hash": digest}
+
+def build_blob(digest: str, data: bytes | None) -> dict:
+    """data=None: server không còn blob này (đã bị evict)"""
+    if data is None:
+        return {"type": "blob", "hash": digest, "missing": True}
+    return {"type": "blob", "hash": digest, "data": data}
+
 def decode_file(file_dict: dict, save_dir: str = "downloads") -> str | None:
     """
     Decode base64 và lưu file (chỉ khi được gọi)
@@ -74,8 +555,8 @@ def decode_file(file_dict: dict, save_dir: str = "downloads") -> str | None:
         # Tạo thư mục downloads nếu chưa có
         os.makedirs(save_dir, exist_ok=True)
         
-        # Decode base64
-        file_data = base64.b64decode(b64_data)
+        # Decode base64 (v2 đã là bytes)
+        file_data = payload_bytes(b64_data)
         
         # Tạo tên file unique nếu đã tồn tại
         save_path = os.path.join(save_dir, file_name)
@@ -103,20 +584,62 @@ def get_file_preview_data(file_dict: dict) -> bytes | None:
         b64_data = file_dict.get("data", "")
         if not b64_data:
             return None
-        return base64.b64decode(b64_data)
+        return payload_bytes(b64_data)
     except Exception as e:
         print(f"Error getting preview data: {e}")
         return None
 
 # ===== Basic =====
-def build_login(user: str) -> dict:
-    return {"type": "login", "user": user}
+def build_login(user: str, proto: int = PROTO_V1, caps=None) -> dict:
+    data = {"type": "login", "user": user}
+    if proto != PROTO_V1:
+        data["proto"] = proto
+    if caps:
+        data["caps"] = list(caps)
+    return data
+
+def build_hello(proto: int, compress: str | None = None) -> dict:
+    """Server xác nhận version (+ kiểu nén nếu bật); các frame sau gói này dùng version mới"""
+    data = {"type": "hello", "proto": proto}
+    if compress:
+        data["compress"] = compress
+    return data
 
 def build_logout(user: str) -> dict:
     return {"type": "logout", "user": user}
 
-def build_user_list(users: list[str]) -> dict:
-    return {"type": "user_list", "users": users}
+def build_user_list(users: list[str], version: int | None = None) -> dict:
+    data = {"type": "user_list", "users": users}
+    if version is not None:
+        data["version"] = version
+    return data
+
+# ===== Presence delta =====
+# Client login với caps ["presence_delta"] chỉ nhận user_list (snapshot + version)
+# lúc login, sau đó là presence_join / presence_leave (version tăng đúng 1 mỗi gói).
+# Thấy version nhảy cóc -> gửi presence_sync để xin lại snapshot.
+CAP_PRESENCE = "presence_delta"
+
+def build_presence_join(users: list[str]) -> dict:
+    return {"type": "presence_join", "users": users}
+
+def build_presence_leave(users: list[str]) -> dict:
+    return {"type": "presence_leave", "users": users}
+
+def build_presence_sync(version: int | None = None) -> dict:
+    return {"type": "presence_sync", "version": version}
+
+# ===== Heartbeat =====
+# Client login với caps ["heartbeat"]: server gửi ping khi connection im lặng lâu,
+# client trả pong ngay; im lặng quá idle timeout thì server đóng connection.
+# Client cũng có thể tự gửi ping, server trả pong.
+CAP_HEARTBEAT = "heartbeat"
+
+def build_ping() -> dict:
+    return {"type": "ping"}
+
+def build_pong() -> dict:
+    return {"type": "pong"}
 
 def build_system(msg: str, room: str | None = None) -> dict:
     data = {
@@ -145,8 +668,32 @@ def build_private(sender: str, to_user: str, msg: str, file_data: dict = None) -
     return data
 
 # ===== Rooms =====
-def build_room_list(rooms_snapshot: list[dict]) -> dict:
-    return {"type": "room_list", "rooms": rooms_snapshot}
+def build_room_list(rooms_snapshot: list[dict], version: int | None = None) -> dict:
+    data = {"type": "room_list", "rooms": rooms_snapshot}
+    if version is not None:
+        data["version"] = version
+    return data
+
+# ===== Room delta =====
+# caps "room_delta": room_list (snapshot + version) lúc login, sau đó room_delta:
+#   {"changes": [{"room": r, "created": true, "add": [...], "remove": [...], "count": n}], "version": v}
+# caps "room_counts": chỉ cần số người mỗi phòng -> room_counts {"counts": {room: n}, "version": v},
+#   gói snapshot có "full": true
+# Lệch version -> room_sync để xin lại snapshot.
+CAP_ROOM_DELTA = "room_delta"
+CAP_ROOM_COUNTS = "room_counts"
+
+def build_room_delta(changes: list[dict]) -> dict:
+    return {"type": "room_delta", "changes": changes}
+
+def build_room_counts(counts: dict, version: int, full: bool = False) -> dict:
+    data = {"type": "room_counts", "counts": counts, "version": version}
+    if full:
+        data["full"] = True
+    return data
+
+def build_room_sync(version: int | None = None) -> dict:
+    return {"type": "room_sync", "version": version}
 
 def build_create_room(user: str, room: str) -> dict:
     return {"type": "create_room", "user": user, "room": room}
@@ -167,4 +714,29 @@ def build_group(room: str, sender: str, msg: str, file_data: dict = None) -> dic
     }
     if file_data:
         data["file"] = file_data
-    return data
\ No newline at end of file
+    return data
+
+# ===== History =====
+# Server lưu private/group (message có "id" tăng dần). Client xin từng trang:
+#   {"type": "history", "room": r | "with": user, "before": id | None, "limit": n}
+# Server trả {"type": "history", "room"/"with", "messages": [cũ -> mới], "more": bool}
+HISTORY_PAGE = 50
+HISTORY_MAX_PAGE = 200
+
+def build_history_request(room: str | None = None, with_user: str | None = None,
+                          before: int | None = None, limit: int = HISTORY_PAGE) -> dict:
+    data = {"type": "history", "before": before, "limit": limit}
+    if room:
+        data["room"] = room
+    else:
+        data["with"] = with_user
+    return data
+
+def build_history(messages: list[dict], more: bool, room: str | None = None,
+                  with_user: str | None = None) -> dict:
+    data = {"type": "history", "messages": messages, "more": more}
+    if room:
+        data["room"] = room
+    else:
+        data["with"] = with_user
+    return data
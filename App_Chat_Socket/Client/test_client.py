@@ -1,40 +1,495 @@
-import threading
+"""
+Load generator: mô phỏng hàng nghìn client asyncio trong 1 process.
+
+- mỗi bot login (lần lượt trong --ramp giây), join --rooms-per-client phòng, rồi
+  mỗi giây làm trung bình --rate hành động, chọn ngẫu nhiên theo --mix:
+    group   gửi tin vào 1 phòng đã join
+    dm      private tới 1 bot khác
+    attach  private kèm file nhỏ (--attach-bytes)
+    join    rời 1 phòng, join 1 phòng khác
+    relogin logout, kết nối + login lại
+- tin nhắn mang thời điểm gửi (perf_counter_ns, cùng process) -> bot nhận đo được
+  độ trễ end-to-end; in p50/p95/p99/max, msg/s, bytes/s theo từng pha (ramp / steady)
+- --json: ghi kết quả ra file (hoặc "-" = stdout) để so sánh giữa các lần chạy
+
+Chạy: python test_client.py --clients 2000 --ramp 20 --duration 60 --rate 0.5 \\
+          --mix group=60,dm=30,attach=5,join=4,relogin=1 --json result.json
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import platform
 import random
+import sys
 import time
-from client_network import ClientNetwork
 
+from framing import FrameReader, RECV_SIZE
+from protocol import (
+    PROTO_V1, PROTO_V2, CAP_BLOBS, CAP_PRESENCE, CAP_ROOM_DELTA, CAP_DEFLATE, CAP_HEARTBEAT,
+    encode_frame, decode_frame,
+    build_login, build_logout, build_create_room, build_join_room, build_leave_room,
+    build_private, build_group, build_pong,
+)
 
-def run_bot(name: str, duration_sec: int = 10):
-    net = ClientNetwork()
-    if not net.connect():
-        return
+ACTIONS = ("group", "dm", "attach", "join", "relogin")
+DEFAULT_MIX = "group=60,dm=30,attach=5,join=4,relogin=1"
+# kiểu message có đo độ trễ
+LATENCY_KINDS = ("group", "dm", "attach")
+# tiền tố nội dung tin: "lt <perf_counter_ns> <kind>"
+MARK = "lt "
+ATTACH_POOL = 16   # số nội dung file khác nhau (server dedup theo hash)
+LOGIN_TIMEOUT = 10.0
+# server giới hạn create/join_room theo connection (mặc định burst 10) -> mỗi admin tạo tối đa chừng này phòng
+ROOMS_PER_ADMIN = 8
 
-    net.send_login(name)
 
-    start = time.time()
-    i = 0
-    while time.time() - start < duration_sec:
-        i += 1
-        net.send_message(name, f"bot-msg-{i} from {name}")
-        time.sleep(random.uniform(0.2, 0.8))
+class LatencyHistogram:
+    """
+    Histogram bucket theo log (sai số ~1%), bộ nhớ cố định dù có hàng triệu mẫu.
+    max giữ giá trị chính xác.
+    """
 
-    net.send_logout(name)
-    net.disconnect()
+    GROWTH = 1.02
+    _LOG = math.log(GROWTH)
 
+    def __init__(self):
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
 
-def stress_test(num_clients: int = 10, duration_sec: int = 10):
-    threads = []
-    for i in range(num_clients):
-        name = f"Bot{i+1}"
-        t = threading.Thread(target=run_bot, args=(name, duration_sec), daemon=True)
-        threads.append(t)
-        t.start()
-        time.sleep(0.1)
+    def record(self, seconds: float):
+        us = max(seconds * 1e6, 1.0)
+        idx = int(math.log(us) / self._LOG)
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
 
-    for t in threads:
-        t.join()
+    def percentile(self, p: float) -> float:
+        """Giây; giá trị giữa của bucket chứa phân vị p (0..100)"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen >= rank:
+                return min(self.GROWTH ** (idx + 0.5) / 1e6, self.max)
+        return self.max
 
+    def to_dict(self) -> dict:
+        ms = lambda s: round(s * 1e3, 3)
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.total / self.count) if self.count else 0.0,
+            "p50_ms": ms(self.percentile(50)),
+            "p95_ms": ms(self.percentile(95)),
+            "p99_ms": ms(self.percentile(99)),
+            "max_ms": ms(self.max),
+        }
 
-if __name__ == "__main__":
-    stress_test(num_clients=15, duration_sec=12)
 
+class PhaseStats:
+    """Bộ đếm của 1 pha (ramp / steady); chỉ event loop ghi nên không cần lock"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.ended = None
+        self.sent = dict.fromkeys(ACTIONS, 0)
+        self.received = dict.fromkeys(LATENCY_KINDS, 0)
+        self.frames_in = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.errors = 0
+        self.error_samples: list[str] = []
+        self.logins = 0
+        self.login_failures = 0
+        self.latency = {kind: LatencyHistogram() for kind in LATENCY_KINDS}
+        self.login_latency = LatencyHistogram()
+
+    def error(self, msg: str):
+        self.errors += 1
+        if len(self.error_samples) < 10:
+            self.error_samples.append(msg)
+
+    def to_dict(self) -> dict:
+        elapsed = (self.ended or time.perf_counter()) - self.started
+        per_sec = lambda n: round(n / elapsed, 1) if elapsed > 0 else 0.0
+        delivered = sum(self.received.values())
+        return {
+            "seconds": round(elapsed, 3),
+            "sent": self.sent,
+            "received": self.received,
+            "msgs_out_per_sec": per_sec(sum(self.sent[k] for k in LATENCY_KINDS)),
+            "msgs_in_per_sec": per_sec(delivered),
+            "frames_in_per_sec": per_sec(self.frames_in),
+            "bytes_out_per_sec": per_sec(self.bytes_out),
+            "bytes_in_per_sec": per_sec(self.bytes_in),
+            "logins": self.logins,
+            "login_failures": self.login_failures,
+            "login_latency": self.login_latency.to_dict(),
+            "errors": self.errors,
+            "error_samples": self.error_samples,
+            "latency": {kind: h.to_dict() for kind, h in self.latency.items()},
+        }
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"Hành động không hợp lệ: {name} (có: {', '.join(ACTIONS)})")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Trọng số không hợp lệ: {part}")
+    if sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("Mix phải có ít nhất 1 trọng số > 0")
+    return mix
+
+
+class Bot:
+    """1 client mô phỏng: 1 connection, 1 task đọc, 1 task gửi theo mix"""
+
+    def __init__(self, runner: "LoadRunner", name: str, rnd: random.Random):
+        self.runner = runner
+        self.name = name
+        self.rnd = rnd
+        self.rooms: list[str] = []
+        self.proto = PROTO_V1
+        self.reader = self.writer = None
+        self.framer = None
+        self.logged_in = asyncio.Event()
+        self.online = False
+        self._read_task = None
+
+    # ===== Connection =====
+    async def connect(self) -> bool:
+        stats = self.runner.stats
+        t0 = time.perf_counter()
+        try:
+            self.reader, self.writer = await asyncio.open_connection(self.runner.host, self.runner.port,
+                                                                     limit=RECV_SIZE)
+        except OSError as e:
+            stats.login_failures += 1
+            stats.error(f"connect: {e}")
+            return False
+        self.proto = PROTO_V1
+        self.framer = FrameReader()
+        self.logged_in = asyncio.Event()
+        self._read_task = asyncio.create_task(self._read_loop())
+        self.send(build_login(self.name, self.runner.proto, self.runner.caps or None))
+        try:
+            await asyncio.wait_for(self.logged_in.wait(), LOGIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            stats.login_failures += 1
+            stats.error(f"{self.name}: login timeout")
+            await self.close()
+            return False
+        if not self.online:
+            stats.login_failures += 1
+            await self.close()
+            return False
+        stats.logins += 1
+        stats.login_latency.record(time.perf_counter() - t0)
+        for room in self.rooms:
+            self.send(build_join_room(self.name, room))
+        return True
+
+    async def close(self):
+        self.online = False
+        self.runner.online.discard(self.name)
+        if self.writer is not None:
+            try:
+                self.writer.close()
+            except Exception:
+                pass
+        if self._read_task is not None:
+            self._read_task.cancel()
+            try:
+                await self._read_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._read_task = None
+
+    def send(self, data: dict):
+        frame = encode_frame(data, self.proto)
+        self.runner.stats.bytes_out += len(frame)
+        self.writer.write(frame)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                chunk = await self.reader.read(RECV_SIZE)
+                if not chunk:
+                    break
+                self.runner.stats.bytes_in += len(chunk)
+                self.framer.feed(chunk)
+                for frame in self.framer.frames():
+                    data = decode_frame(frame, self.proto)
+                    if data:
+                        self._on_message(data)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if self.online:
+                self.runner.stats.error(f"{self.name}: mất kết nối")
+            self.online = False
+            self.runner.online.discard(self.name)
+            self.logged_in.set()
+
+    def _on_message(self, data: dict):
+        stats = self.runner.stats
+        stats.frames_in += 1
+        t = data.get("type")
+        if t == "hello":
+            # từ frame sau: v2 length-prefixed
+            self.proto = data.get("proto", PROTO_V1)
+            self.framer.length_prefixed = self.proto != PROTO_V1
+        elif t == "ping":
+            self.send(build_pong())
+        elif t in ("private", "group"):
+            msg = data.get("msg") or ""
+            if data.get("from") == self.name or not msg.startswith(MARK):
+                return
+            try:
+                _, sent_ns, kind = msg.split(" ", 3)[:3]
+                latency = (time.perf_counter_ns() - int(sent_ns)) / 1e9
+            except ValueError:
+                return
+            if kind in stats.latency:
+                stats.received[kind] += 1
+                stats.latency[kind].record(latency)
+        elif t == "system" and not self.online and not data.get("room"):
+            # "Chào mừng ..." = login thành công
+            self.online = True
+            self.runner.online.add(self.name)
+            self.logged_in.set()
+        elif t == "error":
+            stats.error(f"{self.name}: {data.get('msg')}")
+            if not self.online:
+                self.logged_in.set()
+
+    # ===== Hành động =====
+    def _text(self, kind: str) -> str:
+        text = f"{MARK}{time.perf_counter_ns()} {kind} {self.name}"
+        pad = self.runner.msg_bytes - len(text)
+        return text + " " + "x" * pad if pad > 1 else text
+
+    def _peer(self) -> str | None:
+        online = self.runner.online_list()
+        for _ in range(3):
+            peer = self.rnd.choice(online) if online else None
+            if peer != self.name:
+                return peer
+        return None
+
+    async def act(self, action: str):
+        runner = self.runner
+        if action == "group" and self.rooms:
+            self.send(build_group(self.rnd.choice(self.rooms), self.name, self._text("group")))
+        elif action in ("dm", "attach"):
+            peer = self._peer()
+            if peer is None:
+                return
+            file_data = None
+            if action == "attach":
+                payload = self.rnd.choice(runner.attach_pool)
+                # v2 gửi bytes thẳng trong payload, v1 phải là base64
+                data = payload if self.proto == PROTO_V2 else base64.b64encode(payload).decode("ascii")
+                file_data = {"name": "load.bin", "type": "application/octet-stream",
+                             "size": len(payload), "data": data}
+            self.send(build_private(self.name, peer, self._text(action), file_data))
+        elif action == "join" and runner.rooms:
+            if self.rooms:
+                self.send(build_leave_room(self.name, self.rooms.pop(self.rnd.randrange(len(self.rooms)))))
+            room = self.rnd.choice(runner.rooms)
+            if room not in self.rooms:
+                self.rooms.append(room)
+                self.send(build_join_room(self.name, room))
+        elif action == "relogin":
+            self.send(build_logout(self.name))
+            await self.close()
+            if not await self.connect():
+                return
+        else:
+            return
+        runner.stats.sent[action] += 1
+        if self.writer.transport.get_write_buffer_size() > RECV_SIZE:
+            await self.writer.drain()
+
+    async def run(self):
+        runner = self.runner
+        self.rooms = self.rnd.sample(runner.rooms, min(runner.rooms_per_client, len(runner.rooms)))
+        if not await self.connect():
+            return
+        actions, weights = zip(*runner.mix.items())
+        try:
+            while not runner.stopping:
+                await asyncio.sleep(self.rnd.expovariate(runner.rate) if runner.rate > 0 else 3600)
+                if runner.stopping:
+                    break
+                if not self.online:
+                    if not await self.connect():
+                        return
+                    continue
+                await self.act(self.rnd.choices(actions, weights)[0])
+        except (ConnectionError, OSError) as e:
+            runner.stats.error(f"{self.name}: {e}")
+        finally:
+            if self.online:
+                try:
+                    self.send(build_logout(self.name))
+                except Exception:
+                    pass
+            await self.close()
+
+
+class LoadRunner:
+    def __init__(self, args):
+        self.host = args.host
+        self.port = args.port
+        self.clients = args.clients
+        self.ramp = args.ramp
+        self.duration = args.duration
+        self.rate = args.rate
+        self.mix = args.mix
+        self.proto = args.proto
+        self.caps = [CAP_BLOBS, CAP_PRESENCE, CAP_ROOM_DELTA, CAP_HEARTBEAT] if args.caps else []
+        if args.deflate:
+            self.caps.append(CAP_DEFLATE)
+        self.rooms = [f"load{i}" for i in range(args.rooms)]
+        self.rooms_per_client = args.rooms_per_client
+        self.msg_bytes = args.msg_bytes
+        self.prefix = args.prefix
+        rnd = random.Random(args.seed)
+        self.rnd = rnd
+        self.attach_pool = [rnd.randbytes(args.attach_bytes) for _ in range(ATTACH_POOL)]
+
+        self.online: set[str] = set()
+        self._online_list: list[str] = []
+        self._online_size = -1
+        self.stopping = False
+        self.phases = [PhaseStats("ramp")]
+
+    @property
+    def stats(self) -> PhaseStats:
+        return self.phases[-1]
+
+    def online_list(self) -> list[str]:
+        # cache list cho random.choice, dựng lại khi số bot online thay đổi
+        if len(self.online) != self._online_size:
+            self._online_list = list(self.online)
+            self._online_size = len(self.online)
+        return self._online_list
+
+    async def _setup_rooms(self):
+        for i in range(0, len(self.rooms), ROOMS_PER_ADMIN):
+            admin = Bot(self, f"{self.prefix}admin{i // ROOMS_PER_ADMIN}", random.Random(0))
+            if not await admin.connect():
+                raise SystemExit(f"Không login được vào {self.host}:{self.port}")
+            for room in self.rooms[i:i + ROOMS_PER_ADMIN]:
+                admin.send(build_create_room(admin.name, room))
+            await admin.writer.drain()
+            await asyncio.sleep(0.2)
+            admin.send(build_logout(admin.name))
+            await admin.close()
+
+    async def run(self) -> dict:
+        await self._setup_rooms()
+        self.phases = [PhaseStats("ramp")]
+        tasks = []
+        delay = self.ramp / self.clients if self.clients else 0
+        for i in range(self.clients):
+            bot = Bot(self, f"{self.prefix}{i}", random.Random(self.rnd.random()))
+            tasks.append(asyncio.create_task(bot.run()))
+            if delay:
+                await asyncio.sleep(delay)
+        print(f"ramp xong: {len(self.online)}/{self.clients} bot online", flush=True)
+
+        self.stats.ended = time.perf_counter()
+        self.phases.append(PhaseStats("steady"))
+        await asyncio.sleep(self.duration)
+        self.stats.ended = time.perf_counter()
+
+        self.stopping = True
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return self.report()
+
+    def report(self) -> dict:
+        return {
+            "config": {
+                "host": self.host, "port": self.port, "clients": self.clients,
+                "ramp": self.ramp, "duration": self.duration, "rate": self.rate,
+                "mix": self.mix, "proto": self.proto, "caps": self.caps,
+                "rooms": len(self.rooms), "rooms_per_client": self.rooms_per_client,
+                "msg_bytes": self.msg_bytes, "attach_bytes": len(self.attach_pool[0]),
+            },
+            "env": {"python": platform.python_version(), "platform": platform.platform(),
+                    "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "phases": {p.name: p.to_dict() for p in self.phases},
+        }
+
+
+def print_summary(result: dict):
+    for name, phase in result["phases"].items():
+        print(f"\n== {name} ({phase['seconds']}s) ==")
+        print(f"  gửi: {phase['msgs_out_per_sec']} msg/s, {phase['bytes_out_per_sec'] / 1024:.1f} KB/s | "
+              f"nhận: {phase['msgs_in_per_sec']} msg/s, {phase['frames_in_per_sec']} frame/s, "
+              f"{phase['bytes_in_per_sec'] / 1024:.1f} KB/s")
+        login = phase["login_latency"]
+        print(f"  login: {phase['logins']} ok, {phase['login_failures']} lỗi, "
+              f"p50 {login['p50_ms']} ms, p99 {login['p99_ms']} ms")
+        for kind, h in phase["latency"].items():
+            if h["count"]:
+                print(f"  {kind:<6} n={h['count']:<8} p50 {h['p50_ms']:>8} ms  p95 {h['p95_ms']:>8} ms  "
+                      f"p99 {h['p99_ms']:>8} ms  max {h['max_ms']:>8} ms")
+        if phase["errors"]:
+            print(f"  lỗi: {phase['errors']} (vd: {phase['error_samples'][:3]})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator asyncio cho chat server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--ramp", type=float, default=10.0, help="Giây để login hết các bot")
+    parser.add_argument("--duration", type=float, default=30.0, help="Giây đo sau khi ramp xong")
+    parser.add_argument("--rate", type=float, default=1.0, help="Hành động / giây / bot")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--rooms-per-client", type=int, default=2)
+    parser.add_argument("--msg-bytes", type=int, default=64)
+    parser.add_argument("--attach-bytes", type=int, default=16 * 1024)
+    parser.add_argument("--proto", type=int, choices=(PROTO_V1, PROTO_V2), default=PROTO_V2)
+    parser.add_argument("--no-caps", dest="caps", action="store_false",
+                        help="Login như client cũ (user_list/room_list đầy đủ, attachment inline)")
+    parser.add_argument("--no-deflate", dest="deflate", action="store_false",
+                        help="Không xin server nén frame lớn (so sánh băng thông)")
+    parser.add_argument("--prefix", default="Bot", help="Tiền tố username")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", default=None, help="Ghi kết quả JSON ra file ('-' = stdout)")
+    args = parser.parse_args()
+
+    result = asyncio.run(LoadRunner(args).run())
+    print_summary(result)
+    if args.json == "-":
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nĐã ghi {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ import re
 import os
 from tkinter import scrolledtext, messagebox, simpledialog, filedialog
 from PIL import Image, ImageTk
-from protocol import decode_file
+from protocol import decode_file, INLINE_FILE_LIMIT, MAX_STREAM_FILE_SIZE
 
 class ChatUI:
     def __init__(self, network, username: str):
@@ -14,7 +14,12 @@ class ChatUI:
         self.dm_target = None
         self.selected_room = None
         self.joined_rooms = set()
+        self.room_counts: dict[str, int] = {}
         self.hist = {}  # Lưu text history
+        # lịch sử trên server: id đã hiển thị, id cũ nhất đã tải, còn trang cũ hơn không
+        self.hist_ids: dict[str, set] = {}
+        self.hist_oldest: dict[str, int] = {}
+        self.hist_more: dict[str, bool] = {}
         self._placeholder_text = "Nhập tin nhắn..."
         
         # File attachment
@@ -79,6 +84,10 @@ class ChatUI:
                                font=("Segoe UI", 11, "bold"), anchor="w")
         self.header.pack(fill=tk.X, padx=10, pady=(10, 6))
 
+        tk.Button(right, text="⬆ Tin nhắn cũ hơn", command=self.load_older,
+                  bg="#40444b", fg="white", relief=tk.FLAT,
+                  font=("Segoe UI", 9), cursor="hand2").pack(anchor="e", padx=10, pady=(0, 6))
+
         self.chat_area = scrolledtext.ScrolledText(right, state="disabled", wrap=tk.WORD,
                                                    bg="#36393f", fg="white",
                                                    insertbackground="white", relief=tk.FLAT)
@@ -180,8 +189,8 @@ class ChatUI:
         )
         if file_path:
             file_size = os.path.getsize(file_path)
-            if file_size > 5 * 1024 * 1024:
-                messagebox.showerror("Lỗi", "File quá lớn (max 5MB)")
+            if file_size > MAX_STREAM_FILE_SIZE:
+                messagebox.showerror("Lỗi", f"File quá lớn (max {self._format_size(MAX_STREAM_FILE_SIZE)})")
                 return
             
             self.attached_file = file_path
@@ -194,7 +203,25 @@ class ChatUI:
         self.file_label.config(text="")
         self.file_label.unbind("<Button-1>")
 
+    def _send_attachment(self, msg: str, to_user: str = None, room: str = None) -> bool:
+        """File nhỏ gửi kèm message, file lớn gửi theo chunk (stream)"""
+        if self.attached_file and os.path.getsize(self.attached_file) > INLINE_FILE_LIMIT:
+            if msg:
+                ok = (self.network.send_group(self.username, room, msg) if room
+                      else self.network.send_private(self.username, to_user, msg))
+                if not ok:
+                    return False
+            return self.network.send_file_stream(self.username, self.attached_file, to_user, room) is not None
+        if room:
+            return self.network.send_group(self.username, room, msg, self.attached_file)
+        return self.network.send_private(self.username, to_user, msg, self.attached_file)
+
     # ===== helpers =====
+    @staticmethod
+    def _format_size(size: int) -> str:
+        size_kb = size / 1024
+        return f"{size_kb:.1f}KB" if size_kb < 1024 else f"{size_kb/1024:.1f}MB"
+
     def _key_dm(self, other: str) -> str:
         return f"DM:{other}"
 
@@ -204,6 +231,87 @@ class ChatUI:
     def _append_hist(self, key: str, text: str, tag: str):
         self.hist.setdefault(key, []).append((text, tag))
 
+    def _hist_lines(self, data: dict) -> tuple[str, str, list[str]] | None:
+        """(key, tag, các dòng text) của 1 message private / group để lưu vào history"""
+        sender = data.get("from")
+        msg = data.get("msg", "")
+        ts = data.get("timestamp", "")
+        file_data = data.get("file")
+        if data.get("type") == "group":
+            room = data.get("room")
+            if not room:
+                return None
+            key, prefix = self._key_room(room), f"({room}) "
+        else:
+            other = sender if sender != self.username else data.get("to")
+            if not other:
+                return None
+            key, prefix = self._key_dm(other), ""
+
+        lines = []
+        if file_data:
+            lines.append(f"  [{ts}] {prefix}{sender}: [📎 {file_data.get('name')}]  ")
+        if msg:
+            lines.append(f"  [{ts}] {prefix}{sender}: {msg}  ")
+        return key, "self" if sender == self.username else "other", lines
+
+    def _seen(self, key: str, msg_id) -> bool:
+        """True nếu message id đã có trong history (tránh trùng giữa tin live và trang lịch sử)"""
+        if msg_id is None:
+            return False
+        ids = self.hist_ids.setdefault(key, set())
+        if msg_id in ids:
+            return True
+        ids.add(msg_id)
+        if key not in self.hist_oldest or msg_id < self.hist_oldest[key]:
+            self.hist_oldest[key] = msg_id
+        return False
+
+    def _current_key(self) -> str | None:
+        if self.selected_room:
+            return self._key_room(self.selected_room)
+        if self.dm_target:
+            return self._key_dm(self.dm_target)
+        return None
+
+    def _ensure_history(self):
+        """Lần đầu mở 1 cuộc chat: xin trang lịch sử mới nhất từ server"""
+        key = self._current_key()
+        if key is None or key in self.hist_more:
+            return
+        if self.selected_room and self.selected_room not in self.joined_rooms:
+            return
+        self.hist_more[key] = True
+        self.network.request_history(room=self.selected_room, with_user=self.dm_target)
+
+    def load_older(self):
+        key = self._current_key()
+        if key is None:
+            return
+        if key not in self.hist_more:
+            self._ensure_history()
+            return
+        if not self.hist_more[key]:
+            self._append_chat_live("🔔 Không còn tin nhắn cũ hơn", "system")
+            return
+        self.network.request_history(room=self.selected_room, with_user=self.dm_target,
+                                     before=self.hist_oldest.get(key))
+
+    def _on_history(self, data: dict):
+        room = data.get("room")
+        key = self._key_room(room) if room else self._key_dm(data.get("with") or "")
+        older = []
+        for m in data.get("messages", []):
+            entry = self._hist_lines(m)
+            if entry is None or entry[0] != key or self._seen(key, m.get("id")):
+                continue
+            older.extend((text, entry[1]) for text in entry[2])
+        self.hist_more[key] = bool(data.get("more"))
+        if older:
+            self.hist[key] = older + self.hist.get(key, [])
+            if key == self._current_key():
+                self._render_hist(key)
+
     def _render_hist(self, key: str | None):
         self.chat_area.config(state="normal")
         self.chat_area.delete("1.0", tk.END)
@@ -225,14 +333,20 @@ class ChatUI:
         file_type = file_data.get("type", "")
         file_size = file_data.get("size", 0)
         
-        size_kb = file_size / 1024
-        size_text = f"{size_kb:.1f}KB" if size_kb < 1024 else f"{size_kb/1024:.1f}MB"
+        size_text = self._format_size(file_size)
         
         self.chat_area.config(state="normal")
         
         # Hiển thị thông tin file
         info_text = f"  [{timestamp}] {sender} đã gửi: {file_name} ({size_text})  \n"
         self.chat_area.insert(tk.END, info_text, tag)
+
+        if file_data.get("missing"):
+            # server đã xóa blob (evict) trước khi tải được
+            self.chat_area.insert(tk.END, "  ⚠️ File không còn trên server  \n", "system")
+            self.chat_area.config(state="disabled")
+            self.chat_area.yview(tk.END)
+            return
         
         if file_type.startswith("image/"):
             # Hiển thị preview ảnh (không lưu file)
@@ -275,8 +389,6 @@ class ChatUI:
 
     def _save_file_on_click(self, file_data: dict):
         """Lưu file khi user click"""
-        from protocol import decode_file
-        
         saved_path = decode_file(file_data)
         if saved_path:
             messagebox.showinfo("Thành công", f"Đã lưu file:\n{saved_path}")
@@ -304,6 +416,7 @@ class ChatUI:
         self.dm_target = u
         self.dm_label.config(text=f"Đang chat với: {u}")
         self._render_hist(self._key_dm(u))
+        self._ensure_history()
 
     def on_select_room(self, event=None):
         sel = self.room_list.curselection()
@@ -319,6 +432,7 @@ class ChatUI:
         self.room_label.config(text=f"Phòng đang chọn: {room} ({joined})")
         self.header.config(text=f"CHAT PHÒNG: {room} ({joined})")
         self._render_hist(self._key_room(room))
+        self._ensure_history()
 
     def send_message(self, event=None):
         msg = self.entry.get().strip()
@@ -334,7 +448,7 @@ class ChatUI:
             if self.selected_room not in self.joined_rooms:
                 messagebox.showwarning("Chưa join", "Bạn phải Join phòng trước khi gửi tin nhắn.")
                 return
-            success = self.network.send_group(self.username, self.selected_room, msg, self.attached_file)
+            success = self._send_attachment(msg, room=self.selected_room)
             if not success:
                 messagebox.showerror("Lỗi", "Không thể gửi tin nhắn. Kiểm tra kết nối.")
                 return
@@ -343,7 +457,7 @@ class ChatUI:
             return
 
         if self.dm_target:
-            success = self.network.send_private(self.username, self.dm_target, msg, self.attached_file)
+            success = self._send_attachment(msg, to_user=self.dm_target)
             if not success:
                 messagebox.showerror("Lỗi", "Không thể gửi tin nhắn. Kiểm tra kết nối.")
                 return
@@ -371,6 +485,16 @@ class ChatUI:
             return
         self.network.leave_room(self.username, self.selected_room)
 
+    def _render_rooms(self):
+        self.room_list.delete(0, tk.END)
+        for name in sorted(self.room_counts, key=str.lower):
+            self.room_list.insert(tk.END, f"{name} ({self.room_counts[name]})")
+
+        if self.selected_room:
+            joined = "Đã join" if self.selected_room in self.joined_rooms else "Chưa join"
+            self.room_label.config(text=f"Phòng đang chọn: {self.selected_room} ({joined})")
+            self.header.config(text=f"CHAT PHÒNG: {self.selected_room} ({joined})")
+
     # ===== network callbacks =====
     def on_message(self, data: dict):
         t = data.get("type")
@@ -385,22 +509,46 @@ class ChatUI:
                 self.dm_label.config(text="Đang chat với: (chưa chọn)")
             return
 
+        if t == "presence_join":
+            current = set(self.user_list.get(0, tk.END))
+            for u in data.get("users", []):
+                if u not in current:
+                    self.user_list.insert(tk.END, u)
+            return
+
+        if t == "presence_leave":
+            left = set(data.get("users", []))
+            for i in range(self.user_list.size() - 1, -1, -1):
+                if self.user_list.get(i) in left:
+                    self.user_list.delete(i)
+            if self.dm_target in left:
+                self.dm_target = None
+                self.dm_label.config(text="Đang chat với: (chưa chọn)")
+            return
+
         if t == "room_list":
             rooms = data.get("rooms", [])
-            new_joined = set()
-            self.room_list.delete(0, tk.END)
+            self.room_counts = {}
+            self.joined_rooms = set()
             for r in rooms:
                 name = r.get("name", "")
                 members = r.get("members", [])
                 if self.username in members:
-                    new_joined.add(name)
-                self.room_list.insert(tk.END, f"{name} ({len(members)})")
-            self.joined_rooms = new_joined
-
-            if self.selected_room:
-                joined = "Đã join" if self.selected_room in self.joined_rooms else "Chưa join"
-                self.room_label.config(text=f"Phòng đang chọn: {self.selected_room} ({joined})")
-                self.header.config(text=f"CHAT PHÒNG: {self.selected_room} ({joined})")
+                    self.joined_rooms.add(name)
+                self.room_counts[name] = len(members)
+            self._render_rooms()
+            return
+
+        if t == "room_delta":
+            for change in data.get("changes", []):
+                name = change.get("room", "")
+                self.room_counts[name] = change.get("count", self.room_counts.get(name, 0))
+                if self.username in change.get("add", ()):
+                    self.joined_rooms.add(name)
+                if self.username in change.get("remove", ()):
+                    self.joined_rooms.discard(name)
+            self._render_rooms()
+            self._ensure_history()
             return
 
         if t == "system":
@@ -425,65 +573,62 @@ class ChatUI:
             self._append_chat_live(f"❌ {data.get('msg','')}", "system")
             return
 
-        if t == "private":
-            sender = data.get("from")
-            to_user = data.get("to")
-            msg = data.get("msg", "")
-            ts = data.get("timestamp", "")
-            file_data = data.get("file")
-
-            other = sender if sender != self.username else to_user
-            if not other:
-                return
+        if t in ("file_received", "file_failed", "file_sent"):
+            self._on_file_event(data)
+            return
 
-            key = self._key_dm(other)
-            tag = "self" if sender == self.username else "other"
-            
-            # Hiển thị file nếu có VÀ đang ở conversation này
-            if file_data and self.dm_target == other:
-                self._display_file_live(file_data, sender, ts, tag)
-            
-            # Lưu vào history (text only)
-            if file_data:
-                self._append_hist(key, f"  [{ts}] {sender}: [📎 {file_data.get('name')}]  ", tag)
-            
-            # Hiển thị text message
-            if msg:
-                text = f"  [{ts}] {sender}: {msg}  "
-                self._append_hist(key, text, tag)
-                if self.dm_target == other:
-                    self._append_chat_live(text, tag)
+        if t == "history":
+            self._on_history(data)
             return
 
-        if t == "group":
-            room = data.get("room")
-            sender = data.get("from")
-            msg = data.get("msg", "")
-            ts = data.get("timestamp", "")
+        if t in ("private", "group"):
+            entry = self._hist_lines(data)
+            if entry is None:
+                return
+            key, tag, lines = entry
+            if self._seen(key, data.get("id")):
+                return
+            live = key == self._current_key()
             file_data = data.get("file")
 
-            if not room:
-                return
+            # Hiển thị file nếu có VÀ đang ở conversation / phòng này
+            if file_data and live:
+                self._display_file_live(file_data, data.get("from"), data.get("timestamp", ""), tag)
 
-            key = self._key_room(room)
-            tag = "self" if sender == self.username else "other"
-            
-            # Hiển thị file nếu có VÀ đang ở room này
-            if file_data and self.selected_room == room:
-                self._display_file_live(file_data, sender, ts, tag)
-            
-            # Lưu vào history (text only)
-            if file_data:
-                self._append_hist(key, f"  [{ts}] ({room}) {sender}: [📎 {file_data.get('name')}]  ", tag)
-            
-            # Hiển thị text message
-            if msg:
-                text = f"  [{ts}] ({room}) {sender}: {msg}  "
+            # Lưu vào history (text only); dòng file đã hiển thị ở trên
+            for i, text in enumerate(lines):
                 self._append_hist(key, text, tag)
-                if self.selected_room == room:
+                if live and not (file_data and i == 0):
                     self._append_chat_live(text, tag)
             return
 
+    def _on_file_event(self, data: dict):
+        """Kết quả gửi/nhận file stream (ClientNetwork tạo event khi transfer kết thúc)"""
+        t = data.get("type")
+        room = data.get("room")
+        sender = data.get("from") or self.username
+        name = data.get("name", "")
+        size_text = self._format_size(data.get("size") or 0)
+
+        if room:
+            key, live = self._key_room(room), self.selected_room == room
+        else:
+            other = data.get("to") if t == "file_sent" else sender
+            key, live = self._key_dm(other), self.dm_target == other
+
+        if t == "file_received":
+            text, tag = f"  [{data.get('timestamp', '')}] {sender} đã gửi: {name} ({size_text}) 💾 {data.get('path')}  ", "other"
+        elif t == "file_sent" and data.get("ok"):
+            text, tag = f"  📤 Đã gửi {name} ({size_text})  ", "self"
+        elif t == "file_sent":
+            text, tag = f"⚠️ Gửi file {name} thất bại: {data.get('error', '')}", "system"
+        else:
+            text, tag = f"⚠️ Nhận file {name} từ {sender} thất bại: {data.get('reason', '')}", "system"
+
+        self._append_hist(key, text, tag)
+        if live:
+            self._append_chat_live(text, tag)
+
     def on_disconnect(self):
         self._append_chat_live("⚠️ Mất kết nối server", "system")
 
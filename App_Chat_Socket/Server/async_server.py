@@ -0,0 +1,201 @@
+"""
+Chat Server engine asyncio (StreamReader/StreamWriter)
+Toàn bộ connection chạy trên 1 event loop -> không tốn 1 OS thread / client,
+giữ được 10k+ connection idle trong 1 process.
+
+Chạy: python async_server.py --host 0.0.0.0 --port 5555
+"""
+
+import argparse
+import asyncio
+import signal
+import time
+
+from chat_session import ChatSession, RELAY_POLL_INTERVAL, RELAY_STALL_TIMEOUT
+from server_core import ChatServerBase, add_server_arguments, server_kwargs
+from cluster import attach_cluster
+from framing import RECV_SIZE
+import protocol
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+class AsyncClientSession(ChatSession):
+    """1 connection trên event loop (không có thread riêng)"""
+
+    __slots__ = ("addr", "server", "username", "closed", "proto", "caps", "compress", "framer",
+                 "transfers", "throttle_targets", "rate_limiter", "rate_notice_at",
+                 "last_seen", "heartbeat",
+                 "reader", "writer", "outbox", "_wakeup", "_writer_task")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, server):
+        self.init_session(writer.get_extra_info("peername"), server)
+        self.reader = reader
+        self.writer = writer
+        self._wakeup = asyncio.Event()
+        self.outbox = server.new_outbound_queue(on_ready=self._wakeup.set)
+        self._writer_task = None
+
+    async def run(self):
+        self._writer_task = asyncio.create_task(self._write_loop())
+        try:
+            while not self.closed:
+                chunk = await self.reader.read(RECV_SIZE)
+                if not chunk:
+                    break
+                self.last_seen = time.monotonic()
+                self.server.m_bytes_in.inc(len(chunk))
+                self.framer.feed(chunk)
+                for line in self.framer.frames():
+                    data = self.read_frame(line)
+                    if data:
+                        self.dispatch(data)
+                await self._wait_relay_drain()
+        except (ConnectionError, OSError) as e:
+            self.server.log(f"Error từ {self.addr}: {e}", "ERROR")
+        finally:
+            self.disconnect()
+
+    async def _wait_relay_drain(self):
+        deadline = time.monotonic() + RELAY_STALL_TIMEOUT
+        while not self.closed and self.relay_congested() and time.monotonic() < deadline:
+            await asyncio.sleep(RELAY_POLL_INTERVAL)
+
+    async def _write_loop(self):
+        """Writer task riêng: drain() chỉ chặn task này, hàng đợi áp dụng policy khi đầy"""
+        try:
+            while not self.outbox.closed:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                batch = self.outbox.pop_batch()
+                if batch:
+                    self.writer.writelines(batch)
+                    await self.writer.drain()
+        except (ConnectionError, OSError) as e:
+            self.server.m_send_errors.inc()
+            self.server.log(f"Lỗi gửi đến {self.addr}: {e}", "ERROR")
+            self.abort_transport()
+
+    def close_transport(self):
+        self.outbox.close()
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+    def abort_transport(self):
+        self.outbox.close()
+        try:
+            self.writer.transport.abort()
+        except Exception:
+            pass
+
+
+class AsyncChatServer(ChatServerBase):
+    def __init__(self, host="0.0.0.0", port=5555, backlog: int = 1024, log_dir: str = "logs",
+                 reuse_port: bool = False, **kwargs):
+        super().__init__(host, port, log_dir, **kwargs)
+        self.backlog = backlog
+        # SO_REUSEPORT: nhiều worker process cùng listen 1 port, kernel chia connection (workers.py)
+        self.reuse_port = reuse_port
+        self._server: asyncio.AbstractServer | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.metrics.gauge("chat_asyncio_tasks", "Task đang chạy trên event loop").set_function(
+            lambda: len(asyncio.all_tasks(self._loop)) if self._loop is not None else 0)
+
+    def call_later(self, delay: float, fn):
+        # an toàn khi được gọi từ thread khác ngoài event loop
+        if self._loop is None:
+            super().call_later(delay, fn)
+            return
+        self._loop.call_soon_threadsafe(self._loop.call_later, delay, fn)
+
+    def call_soon(self, fn, *args):
+        if self._loop is None:
+            fn(*args)
+            return
+        self._loop.call_soon_threadsafe(fn, *args)
+
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.enable_keepalive(writer.get_extra_info("socket"))
+        session = AsyncClientSession(reader, writer, self)
+        self.add_client(session)
+        await session.run()
+
+    async def serve(self):
+        raise_fd_limit()
+        self._loop = asyncio.get_running_loop()
+        if self.cluster is not None:
+            self.cluster.start()
+        self._server = await asyncio.start_server(
+            self._on_connect, self.host, self.port,
+            backlog=self.backlog, limit=RECV_SIZE, reuse_port=self.reuse_port or None,
+        )
+        self.running = True
+        self.start_metrics()
+        self.start_heartbeat()
+        self.log(f"Server (asyncio) đang chạy trên {self.host}:{self.port}", "SUCCESS")
+        self.log(f"JSON codec: {protocol.CODEC.name}", "INFO")
+        self.logger.write("INFO", f"Server khởi động tại {self.host}:{self.port}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    def stop(self):
+        self.running = False
+        if self._server:
+            self._server.close()
+        for s in list(self.clients):
+            s.close_transport()
+        if self.cluster is not None:
+            self.cluster.stop()
+        self.stop_metrics()
+        self.logger.write("INFO", "Server đã tắt")
+        self.logger.flush()
+        self.history.flush()
+        self.mailbox.close()
+
+
+def raise_fd_limit():
+    """Nâng soft limit số file descriptor lên hard limit (mỗi connection 1 fd)"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = hard if hard != resource.RLIM_INFINITY else 65536
+    if soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def add_profiler_signal(server: AsyncChatServer):
+    """
+    SIGUSR1 -> bật/tắt profiler. Gọi từ process chạy server trên main thread
+    (serve() không tự đăng ký: chạy engine trên thread khác sẽ lỗi RuntimeError)
+    """
+    if hasattr(signal, "SIGUSR1"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, server.toggle_profiler)
+
+
+async def _serve_main(server: AsyncChatServer):
+    add_profiler_signal(server)
+    await server.serve()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat server (asyncio engine)")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = AsyncChatServer(args.host, args.port, args.backlog, **server_kwargs(args))
+    attach_cluster(server, args)
+    try:
+        asyncio.run(_serve_main(server))
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Backplane pub/sub giữa các node của cluster (ClusterNode trong cluster.py chỉ dùng interface này).
+
+- Backplane: interface. send(envelope, payload) không block; frame nhận được
+  đi vào on_frame(envelope, payload), mất kết nối gọi on_close()
+- BrokerBackplane: cài đặt dùng broker trong repo (bus_broker.py), qua TCP
+  "host:port" (nhiều máy / sau load balancer) hoặc Unix socket (worker cùng máy)
+
+Broker tự định tuyến: publish chỉ tới node có user / member phòng liên quan.
+"""
+
+import queue
+import socket
+import threading
+from typing import Callable, Optional
+
+from bus import BUS_MAX_FRAME, encode_bus, decode_bus
+from framing import FrameReader
+
+# số frame tối đa gộp trong 1 lần sendall
+SEND_BATCH = 256
+
+
+def parse_address(address: str):
+    """
+    "host:port" / ":port" -> (AF_INET, (host, port)); có "/" hoặc không có port là đường dẫn Unix socket.
+    Trả về (family, address) dùng cho socket.connect / bind.
+    """
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, address
+
+
+class Backplane:
+    """Interface backplane; ClusterNode gán on_frame / on_close trước khi connect()"""
+
+    def __init__(self):
+        self.on_frame: Callable[[dict, bytes], None] = lambda envelope, payload: None
+        self.on_close: Optional[Callable[[], None]] = None
+        self.connected = False
+
+    def connect(self):
+        raise NotImplementedError
+
+    def send(self, envelope: dict, payload: bytes = b""):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class BrokerBackplane(Backplane):
+    """
+    Kết nối tới broker trong repo.
+    - send() gọi từ bất kỳ thread nào, không block (writer thread riêng ghi xuống socket)
+    - reader thread gọi on_frame(envelope, payload) cho mỗi frame nhận được
+    """
+
+    def __init__(self, address: str):
+        super().__init__()
+        self.address = address
+        self.sock: Optional[socket.socket] = None
+        self._out: queue.Queue = queue.Queue()
+
+    def connect(self):
+        family, addr = parse_address(self.address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            self.sock.connect(addr)
+        except OSError:
+            self.sock.close()
+            raise
+        self.connected = True
+        # mỗi lần connect 1 queue mới: writer thread của kết nối cũ không lấy nhầm frame
+        self._out = queue.Queue()
+        threading.Thread(target=self._read_loop, args=(self.sock,), name="bus-reader", daemon=True).start()
+        threading.Thread(target=self._write_loop, args=(self.sock, self._out), name="bus-writer",
+                         daemon=True).start()
+
+    def send(self, envelope: dict, payload: bytes = b""):
+        if self.connected:
+            self._out.put(encode_bus(envelope, payload))
+
+    def close(self):
+        if not self.connected:
+            return
+        self.connected = False
+        self._out.put(None)
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _write_loop(self, sock: socket.socket, out: queue.Queue):
+        while True:
+            frame = out.get()
+            if frame is None:
+                return
+            batch = [frame]
+            while not out.empty() and len(batch) < SEND_BATCH:
+                frame = out.get_nowait()
+                if frame is None:
+                    out.put(None)
+                    break
+                batch.append(frame)
+            try:
+                sock.sendall(b"".join(batch))
+            except OSError:
+                self._closed()
+                return
+
+    def _read_loop(self, sock: socket.socket):
+        reader = FrameReader(max_frame=BUS_MAX_FRAME)
+        reader.length_prefixed = True
+        try:
+            while reader.recv_from(sock):
+                for frame in reader.frames():
+                    envelope, payload = decode_bus(frame)
+                    self.on_frame(envelope, payload)
+        except OSError:
+            pass
+        self._closed()
+
+    def _closed(self):
+        was_connected = self.connected
+        self.close()
+        if was_connected and self.on_close:
+            self.on_close()
@@ -0,0 +1,137 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1GB
+
+
+class BlobStore:
+    """
+    Kho attachment đánh địa chỉ theo nội dung (sha256) trên đĩa:
+      <root>/<2 ký tự đầu>/<sha256>
+    - cùng 1 file gửi lại nhiều lần chỉ lưu 1 bản
+    - LRU theo lần dùng gần nhất, xóa bớt khi tổng dung lượng > max_bytes
+    - đếm hit/miss để theo dõi hiệu quả dedup/cache
+    Dùng cho cả server (kho attachment) và client (cache blob đã tải).
+    """
+
+    def __init__(self, root: str = "blobs", max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[str, int]" = OrderedDict()  # hash -> size
+        self._bytes = 0
+
+        self.stored = 0       # blob mới được ghi
+        self.dedup_hits = 0   # put() trúng blob đã có
+        self.get_hits = 0
+        self.get_misses = 0
+        self.evictions = 0
+
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def hash_bytes(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    @staticmethod
+    def _valid(digest: str) -> bool:
+        return len(digest) == 64 and all(c in "0123456789abcdef" for c in digest)
+
+    def _load(self):
+        """Nạp index từ đĩa, blob cũ nhất (mtime) đứng đầu LRU"""
+        found = []
+        for sub in os.listdir(self.root):
+            sub_dir = os.path.join(self.root, sub)
+            if not os.path.isdir(sub_dir):
+                continue
+            for name in os.listdir(sub_dir):
+                if self._valid(name):
+                    st = os.stat(os.path.join(sub_dir, name))
+                    found.append((st.st_mtime, name, st.st_size))
+        for _, digest, size in sorted(found):
+            self._lru[digest] = size
+            self._bytes += size
+        with self._lock:
+            self._evict()
+
+    def has(self, digest: str) -> bool:
+        with self._lock:
+            return digest in self._lru
+
+    def put(self, data: bytes) -> str:
+        digest = self.hash_bytes(data)
+        with self._lock:
+            if digest in self._lru:
+                self._lru.move_to_end(digest)
+                self.dedup_hits += 1
+                return digest
+
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self._lock:
+            if digest not in self._lru:
+                self._lru[digest] = len(data)
+                self._bytes += len(data)
+                self.stored += 1
+            self._lru.move_to_end(digest)
+            self._evict(keep=digest)
+        return digest
+
+    def get(self, digest: str) -> Optional[bytes]:
+        with self._lock:
+            if digest not in self._lru:
+                self.get_misses += 1
+                return None
+            self._lru.move_to_end(digest)
+        try:
+            with open(self._path(digest), "rb") as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                size = self._lru.pop(digest, None)
+                if size is not None:
+                    self._bytes -= size
+                self.get_misses += 1
+            return None
+        with self._lock:
+            self.get_hits += 1
+        return data
+
+    def _evict(self, keep: Optional[str] = None):
+        """Gọi khi đang giữ lock"""
+        while self._bytes > self.max_bytes and self._lru:
+            digest, size = next(iter(self._lru.items()))
+            if digest == keep:
+                break
+            del self._lru[digest]
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "blobs": len(self._lru),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "stored": self.stored,
+                "dedup_hits": self.dedup_hits,
+                "get_hits": self.get_hits,
+                "get_misses": self.get_misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,42 @@
+"""
+Định dạng frame của bus giữa các worker/node (xem backplane.py, bus_broker.py, cluster.py).
+
+Frame trên bus = u32 length | u32 len(envelope) | envelope (JSON) | payload
+- envelope: {"op": ..., ...} điều khiển (presence, room, publish, kick, snapshot)
+- payload: message chat encode theo protocol v2 (bỏ 4 byte length), giữ nguyên
+  bytes của file -> broker chuyển tiếp mà không cần decode.
+"""
+
+import json
+import struct
+from typing import Optional
+
+from protocol import ENCODING, V2_LENGTH, encode_message_v2, decode_message_v2
+
+_ENVELOPE_LENGTH = struct.Struct("!I")
+
+# frame bus chứa cả attachment inline / file chunk
+BUS_MAX_FRAME = 64 * 1024 * 1024
+
+
+def encode_bus(envelope: dict, payload: bytes = b"") -> bytes:
+    env_raw = json.dumps(envelope, ensure_ascii=False).encode(ENCODING)
+    body_len = _ENVELOPE_LENGTH.size + len(env_raw) + len(payload)
+    return b"".join((V2_LENGTH.pack(body_len), _ENVELOPE_LENGTH.pack(len(env_raw)), env_raw, payload))
+
+
+def decode_bus(frame: bytes) -> tuple[dict, bytes]:
+    """frame = body (FrameReader đã bỏ length). Trả về (envelope, payload thô)"""
+    (n_env,) = _ENVELOPE_LENGTH.unpack_from(frame, 0)
+    start = _ENVELOPE_LENGTH.size
+    envelope = json.loads(frame[start:start + n_env].decode(ENCODING))
+    return envelope, frame[start + n_env:]
+
+
+def encode_payload(data: dict) -> bytes:
+    return encode_message_v2(data)[V2_LENGTH.size:]
+
+
+def decode_payload(payload: bytes) -> Optional[dict]:
+    return decode_message_v2(payload) if payload else None
+
@@ -0,0 +1,300 @@
+"""
+Broker của backplane: nắm user nào ở node nào và phòng nào có member ở node nào,
+để chuyển message chỉ tới node cần nhận (không phát cho mọi node).
+
+Chạy riêng cho cluster nhiều máy: python bus_broker.py --listen 0.0.0.0:7000
+rồi mỗi node: python async_server.py --port 5555 --cluster-broker <host>:7000
+(workers.py tự chạy broker trên Unix socket cho các worker cùng máy)
+
+Node -> broker (envelope):
+  {"op": "hello", "node": id}
+  {"op": "presence", "user": u, "online": bool}
+  {"op": "room", "event": "create" | "join" | "leave", "room": r, "user": u}
+  {"op": "publish", "user": u} | {"op": "publish", "room": r}   + payload (message)
+Broker -> node:
+  {"op": "snapshot", "users": {u: node}, "rooms": {r: [members]}}   (ngay sau hello)
+  presence / room (đã thêm "node") -> các node khác để registry giống nhau
+  publish -> node giữ user đích / node có member của phòng
+  {"op": "kick", "user": u}   username đã thuộc node khác (login trùng lúc ở 2 node)
+
+Node nhận chậm (byte chờ gửi trong transport của broker, như OutboundQueue của client):
+  > NODE_HIGH_WATER : broker ngừng đọc từ node đang publish tới node đó (chờ xả, tối đa
+                      NODE_DRAIN_TIMEOUT) -> TCP tự giảm tốc node publish
+  chờ quá NODE_DRAIN_TIMEOUT: node bị coi là kẹt -> bỏ frame publish tới node đó (đếm dropped)
+                      và không chặn node publish nữa, tới khi nó xả về dưới NODE_HIGH_WATER;
+                      presence / room vẫn gửi để registry các node không lệch nhau
+  > NODE_MAX_PENDING: ngắt node đó (bộ nhớ broker luôn có giới hạn)
+"""
+
+import argparse
+import asyncio
+import socket
+from collections import Counter
+
+from backplane import parse_address
+from bus import BUS_MAX_FRAME, encode_bus, decode_bus
+from framing import FrameReader, RECV_SIZE
+from room_manager import RoomManager
+
+NODE_HIGH_WATER = 1024 * 1024
+NODE_MAX_PENDING = 16 * 1024 * 1024
+NODE_DRAIN_TIMEOUT = 5.0
+
+
+class _Node:
+    __slots__ = ("node_id", "writer", "dropped", "stalled", "overflowed")
+
+    def __init__(self, node_id: str, writer: asyncio.StreamWriter):
+        self.node_id = node_id
+        self.writer = writer
+        self.dropped = 0
+        self.stalled = False    # đã chờ xả quá NODE_DRAIN_TIMEOUT
+        self.overflowed = False
+
+    def pending(self) -> int:
+        """Byte đang chờ gửi tới node này"""
+        return self.writer.transport.get_write_buffer_size()
+
+    def send(self, envelope: dict, payload: bytes = b""):
+        self.write(encode_bus(envelope, payload))
+
+    def write(self, frame: bytes, droppable: bool = False) -> bool:
+        """False nếu frame bị bỏ (droppable và node đang kẹt) hoặc node đã bị ngắt"""
+        transport = self.writer.transport
+        if transport.is_closing():
+            return False
+        pending = transport.get_write_buffer_size()
+        if self.stalled and pending <= NODE_HIGH_WATER:
+            self.stalled = False
+        if droppable and self.stalled:
+            self.dropped += 1
+            return False
+        if pending > NODE_MAX_PENDING:
+            # cả frame điều khiển cũng không xả được -> ngắt, vòng đọc của node này dọn registry
+            self.overflowed = True
+            transport.abort()
+            return False
+        self.writer.write(frame)
+        return True
+
+
+class BusBroker:
+    def __init__(self, log=print):
+        self.log = log
+        self.nodes: dict[str, _Node] = {}
+        self.owners: dict[str, str] = {}              # user -> node
+        self.rooms = RoomManager()                     # room -> members (toàn cụm)
+        self.room_nodes: dict[str, Counter] = {}       # room -> Counter(node -> số member)
+        self.routed = 0
+        self.frames = 0
+        self.dropped = 0
+        self.slow_disconnects = 0
+        self._server = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def serve(self, address: str):
+        """address: "host:port" (TCP) hoặc đường dẫn Unix socket"""
+        family, addr = parse_address(address)
+        if family == socket.AF_UNIX:
+            self._server = await asyncio.start_unix_server(self._on_connect, addr, limit=RECV_SIZE)
+        else:
+            self._server = await asyncio.start_server(self._on_connect, *addr, limit=RECV_SIZE)
+        return self._server
+
+    async def close(self, timeout: float = 2.0):
+        """Ngừng nhận node mới, đóng kết nối các node và chờ vòng đọc của chúng kết thúc"""
+        if self._server:
+            self._server.close()
+        for node in list(self.nodes.values()):
+            node.writer.close()
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=timeout)
+
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        framer = FrameReader(max_frame=BUS_MAX_FRAME)
+        framer.length_prefixed = True
+        node = None
+        congested: set[_Node] = set()  # node nhận đã quá NODE_HIGH_WATER sau các frame vừa đọc
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            while True:
+                chunk = await reader.read(RECV_SIZE)
+                if not chunk:
+                    break
+                framer.feed(chunk)
+                for frame in framer.frames():
+                    envelope, payload = decode_bus(frame)
+                    if node is None:
+                        if envelope.get("op") != "hello":
+                            continue
+                        node = self._hello(str(envelope.get("node")), writer)
+                        if node is None:
+                            return
+                        continue
+                    congested.update(self.handle(node, envelope, payload))
+                await writer.drain()
+                if congested:
+                    await self._wait_targets(congested)
+                    congested.clear()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if node is not None:
+                self._node_gone(node)
+            writer.close()
+            self._tasks.discard(task)
+
+    @staticmethod
+    async def _wait_targets(targets):
+        """Ngừng đọc từ node publish tới khi các node nhận xả bớt (hoặc hết NODE_DRAIN_TIMEOUT)"""
+        for target in targets:
+            if target.writer.transport.is_closing():
+                continue
+            try:
+                await asyncio.wait_for(target.writer.drain(), NODE_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                target.stalled = True
+            except (ConnectionError, OSError):
+                pass
+
+    def _hello(self, node_id: str, writer) -> _Node | None:
+        if node_id in self.nodes:
+            self.log(f"[bus] node {node_id} đã tồn tại, từ chối kết nối mới")
+            return None
+        node = _Node(node_id, writer)
+        self.nodes[node_id] = node
+        node.send({
+            "op": "snapshot",
+            "users": dict(self.owners),
+            "rooms": {r["name"]: r["members"] for r in self.rooms.snapshot()},
+        })
+        self.log(f"[bus] node {node_id} đã kết nối ({len(self.nodes)} node)")
+        return node
+
+    def _node_gone(self, node: _Node):
+        if self.nodes.get(node.node_id) is node:
+            del self.nodes[node.node_id]
+        for user in [u for u, n in self.owners.items() if n == node.node_id]:
+            self._user_offline(node, user)
+        if node.overflowed:
+            self.slow_disconnects += 1
+            self.log(f"[bus] node {node.node_id} nhận quá chậm (> {NODE_MAX_PENDING} byte chờ gửi), đã ngắt")
+        self.log(f"[bus] node {node.node_id} đã ngắt ({len(self.nodes)} node)")
+
+    def _others(self, node: _Node):
+        return [n for n in self.nodes.values() if n is not node]
+
+    def handle(self, node: _Node, envelope: dict, payload: bytes) -> list:
+        """Xử lý 1 frame của node; trả về các node nhận đã quá NODE_HIGH_WATER"""
+        self.frames += 1
+        op = envelope.get("op")
+        if op == "publish":
+            return self._publish(node, envelope, payload)
+        if op == "presence":
+            user = envelope.get("user", "")
+            if envelope.get("online"):
+                self._user_online(node, user)
+            elif self.owners.get(user) == node.node_id:
+                self._user_offline(node, user)
+        elif op == "room":
+            self._room_event(node, envelope)
+        return []
+
+    def _user_online(self, node: _Node, user: str):
+        owner = self.owners.get(user)
+        if owner is not None and owner != node.node_id:
+            # node bị kick dọn user cục bộ rồi nhận lại trạng thái thật từ node đang giữ user
+            node.send({"op": "kick", "user": user})
+            node.send({"op": "presence", "user": user, "online": True, "node": owner})
+            for room in self.rooms.rooms_of(user):
+                node.send({"op": "room", "event": "join", "room": room, "user": user, "node": owner})
+            return
+        self.owners[user] = node.node_id
+        for other in self._others(node):
+            other.send({"op": "presence", "user": user, "online": True, "node": node.node_id})
+
+    def _user_offline(self, node: _Node, user: str):
+        del self.owners[user]
+        for room in self.rooms.remove_user_everywhere(user):
+            self._count(room, node.node_id, -1)
+        for other in self._others(node):
+            other.send({"op": "presence", "user": user, "online": False, "node": node.node_id})
+
+    def _room_event(self, node: _Node, envelope: dict):
+        event, room, user = envelope.get("event"), envelope.get("room", ""), envelope.get("user", "")
+        if event == "create":
+            self.rooms.create_room(room)
+        elif self.owners.get(user) != node.node_id:
+            return  # user đã bị kick / không thuộc node này
+        elif event == "join":
+            if not self.rooms.is_member(room, user) and self.rooms.join(room, user):
+                self._count(room, node.node_id, 1)
+        elif event == "leave":
+            if self.rooms.is_member(room, user) and self.rooms.leave(room, user):
+                self._count(room, node.node_id, -1)
+        else:
+            return
+        envelope["node"] = node.node_id
+        for other in self._others(node):
+            other.send(envelope)
+
+    def _count(self, room: str, node_id: str, delta: int):
+        counter = self.room_nodes.setdefault(room, Counter())
+        counter[node_id] += delta
+        if counter[node_id] <= 0:
+            del counter[node_id]
+
+    def _publish(self, node: _Node, envelope: dict, payload: bytes):
+        if "room" in envelope:
+            targets = [self.nodes[n] for n in self.room_nodes.get(envelope["room"], ())
+                       if n != node.node_id and n in self.nodes]
+        else:
+            owner = self.owners.get(envelope.get("user", ""))
+            targets = [self.nodes[owner]] if owner in self.nodes and owner != node.node_id else []
+        if not targets:
+            return []
+        frame = encode_bus(envelope, payload)  # encode 1 lần cho mọi node nhận
+        congested = []
+        for target in targets:
+            if target.write(frame, droppable=True):
+                self.routed += 1
+            else:
+                self.dropped += 1
+            if not target.stalled and target.pending() > NODE_HIGH_WATER:
+                congested.append(target)
+        return congested
+
+    def stats(self) -> dict:
+        return {"nodes": len(self.nodes), "users": len(self.owners),
+                "frames": self.frames, "routed": self.routed, "dropped": self.dropped,
+                "slow_disconnects": self.slow_disconnects,
+                "pending_max": max((n.pending() for n in self.nodes.values()), default=0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Broker cho cluster chat server")
+    parser.add_argument("--listen", default="0.0.0.0:7000", help="host:port hoặc đường dẫn Unix socket")
+    parser.add_argument("--stats-interval", type=float, default=0, help="In thống kê mỗi N giây (0 = tắt)")
+    args = parser.parse_args()
+
+    async def run():
+        broker = BusBroker(log=lambda msg: print(msg, flush=True))
+        await broker.serve(args.listen)
+        print(f"[bus] broker đang chạy trên {args.listen}", flush=True)
+        try:
+            while True:
+                await asyncio.sleep(args.stats_interval or 3600)
+                if args.stats_interval:
+                    print(f"[bus] {broker.stats()}", flush=True)
+        finally:
+            await broker.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Chat Server engine thread-per-connection, không cần GUI / màn hình
+(chạy được trên server Linux headless). Dashboard Tkinter ở server.py chỉ là observer.
+
+Chạy: python chat_server.py --host 0.0.0.0 --port 5555
+"""
+
+import argparse
+import signal
+import socket
+import threading
+import time
+
+from chat_session import ChatSession, RELAY_POLL_INTERVAL, RELAY_STALL_TIMEOUT
+from server_core import ChatServerBase, add_server_arguments, server_kwargs
+from cluster import attach_cluster
+import protocol
+
+
+class ClientHandler(ChatSession, threading.Thread):
+    """Engine thread-per-connection: mỗi client 1 thread đọc + 1 writer thread"""
+
+    def __init__(self, conn: socket.socket, addr, server):
+        threading.Thread.__init__(self, daemon=True)
+        self.init_session(addr, server)
+        self.conn = conn
+        self.running = True
+        self.outbox = server.new_outbound_queue()
+        self.writer_thread = threading.Thread(target=self._write_loop, daemon=True)
+
+    def run(self):
+        self.writer_thread.start()
+        try:
+            while self.running:
+                n = self.framer.recv_from(self.conn)
+                if not n:
+                    break
+                self.last_seen = time.monotonic()
+                self.server.m_bytes_in.inc(n)
+                for line in self.framer.frames():
+                    data = self.read_frame(line)
+                    if data:
+                        self.dispatch(data)
+                self._wait_relay_drain()
+        except Exception as e:
+            if self.running:
+                self.server.log(f"Error từ {self.addr}: {e}", "ERROR")
+        finally:
+            self.disconnect()
+
+    def _wait_relay_drain(self):
+        deadline = time.monotonic() + RELAY_STALL_TIMEOUT
+        while self.running and self.relay_congested() and time.monotonic() < deadline:
+            time.sleep(RELAY_POLL_INTERVAL)
+
+    def _write_loop(self):
+        """Writer riêng: xả hàng đợi gửi xuống socket, chỉ connection này bị chậm"""
+        while True:
+            batch = self.outbox.get_batch()
+            if batch is None:
+                break
+            try:
+                for frame in batch:
+                    self.conn.sendall(frame)
+            except OSError as e:
+                if self.running:
+                    self.server.m_send_errors.inc()
+                    self.server.log(f"Lỗi gửi đến {self.addr}: {e}", "ERROR")
+                self.close_transport()
+                break
+
+    def close_transport(self):
+        self.running = False
+        self.outbox.close()
+        try:
+            # shutdown để recv() đang chờ ở reader thread trả về ngay
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class ChatServer(ChatServerBase):
+    """Server thread-per-connection: start() mở socket + accept thread, stop() đóng hết"""
+
+    def __init__(self, host="0.0.0.0", port=5555, backlog: int = 1024, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self.backlog = backlog
+        self.server_socket: socket.socket | None = None
+
+    def start(self):
+        """Bind + listen rồi accept trên thread riêng (không block). Lỗi bind -> OSError."""
+        if self.cluster is not None:
+            self.cluster.start()
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self.server_socket.bind((self.host, self.port))
+            self.server_socket.listen(self.backlog)
+        except OSError:
+            self.server_socket.close()
+            self.server_socket = None
+            if self.cluster is not None:
+                self.cluster.stop()
+            raise
+        self.running = True
+        self.start_metrics()
+        self.start_heartbeat()
+
+        self.log(f"Server đang chạy trên {self.host}:{self.port}", "SUCCESS")
+        self.log(f"Log file: {self.logger.file_path}", "INFO")
+        self.log(f"JSON codec: {protocol.CODEC.name}", "INFO")
+        self.log("Đang chờ kết nối từ clients...", "INFO")
+        self.logger.write("INFO", f"Server khởi động tại {self.host}:{self.port}")
+
+        threading.Thread(target=self.accept_loop, args=(self.server_socket,), daemon=True).start()
+
+    def accept_loop(self, server_socket: socket.socket):
+        """Vòng lặp chấp nhận kết nối"""
+        while self.running:
+            try:
+                client_socket, address = server_socket.accept()
+            except OSError as e:
+                if self.running:
+                    self.log(f"Lỗi accept: {e}", "ERROR")
+                break
+            self.log(f"🔌 Kết nối mới từ {address[0]}:{address[1]}", "CLIENT")
+            self.enable_keepalive(client_socket)
+            handler = ClientHandler(client_socket, address, self)
+            self.add_client(handler)
+            handler.start()
+
+    def stop(self):
+        """Tắt server: đóng socket lắng nghe và mọi connection"""
+        if not self.running:
+            return
+        self.log("Đang tắt server...", "WARNING")
+        self.running = False
+
+        try:
+            if self.server_socket:
+                self.server_socket.close()
+        except OSError:
+            pass
+        self.server_socket = None
+
+        with self.client_lock:
+            clients = list(self.clients)
+        for h in clients:
+            h.close_transport()
+        if self.cluster is not None:
+            self.cluster.stop()
+        self.stop_metrics()
+
+        self.update_counts()
+        self.log("Server đã tắt", "SUCCESS")
+        self.logger.write("INFO", "Server đã tắt")
+        self.logger.flush()
+        self.history.flush()
+        self.mailbox.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat server (thread-per-connection, headless)")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = ChatServer(args.host, args.port, args.backlog, **server_kwargs(args))
+    attach_cluster(server, args)
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda *_: server.toggle_profiler())
+    server.start()
+    try:
+        while not stopped.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,536 @@
+import time
+from typing import Callable, Optional
+
+from framing import FrameReader
+from protocol import (
+    PROTO_V1, SUPPORTED_PROTOS, MAX_STREAM_FILE_SIZE, CAP_DEFLATE, CAP_HEARTBEAT, encode_frame,
+    build_hello, build_pong, build_system, build_error, build_private, build_group,
+    build_file_begin, build_file_chunk, build_file_end, build_file_abort, valid_transfer_id, text_field,
+    build_blob, build_history, HISTORY_PAGE, HISTORY_MAX_PAGE,
+    Message, Login, Private, Group, RoomOp, TYPED_MESSAGES, decode_typed, peek_type,
+)
+from message_store import room_channel, dm_channel
+from rate_limit import STREAM_TYPES
+
+# type -> hàm xử lý (method của ChatSession), đăng ký bằng @handles.
+# Metrics đếm / đo thời gian theo đúng các type này; type lạ gộp vào "other"
+# (client không tạo thêm được series).
+# Type trong protocol.TYPED_MESSAGES nhận object có kiểu (Login, Group...), còn lại nhận dict.
+MESSAGE_HANDLERS: dict[str, Callable[["ChatSession", object], None]] = {}
+
+
+def handles(*types: str, registry: dict = MESSAGE_HANDLERS):
+    """Đăng ký method xử lý các type vào bảng (mặc định MESSAGE_HANDLERS)"""
+    def register(fn):
+        for t in types:
+            registry[t] = fn
+        return fn
+    return register
+
+
+def run_handler(handlers: dict, session, t, data, started: float):
+    """
+    Tra bảng type -> handler, chạy (qua profiler nếu đang bật) rồi ghi metrics theo type
+    (số frame, thời gian từ started); type không có trong bảng tính là "other"
+    """
+    handler = handlers.get(t) if isinstance(t, str) else None
+    if handler is not None:
+        profiler = session.server.profiler
+        if profiler.active:
+            profiler.call(handler, session, data)
+        else:
+            handler(session, data)
+    session.server.record_dispatch(t if handler is not None else "other", started)
+
+
+def _resolve(data) -> tuple:
+    """(type, message): dict của type có kiểu được chuyển thành object (engine dùng decode_frame)"""
+    if isinstance(data, Message):
+        return data.type, data
+    t = data.get("type")
+    if not isinstance(t, str):
+        return None, data
+    cls = TYPED_MESSAGES.get(t)
+    return t, (cls.from_dict(data) if cls is not None else data)
+
+
+# Chờ người nhận file xả bớt hàng đợi trước khi đọc tiếp chunk từ người gửi
+RELAY_POLL_INTERVAL = 0.005
+RELAY_STALL_TIMEOUT = 30.0
+
+# Báo "gửi quá nhanh" tối đa 1 lần / khoảng này (không báo mỗi frame bị bỏ)
+RATE_NOTICE_INTERVAL = 5.0
+
+
+class ChatSession:
+    """
+    Logic xử lý gói tin JSON của 1 client, dùng chung cho mọi engine
+    (thread-per-connection trong server.py, asyncio trong async_server.py).
+
+    Lớp con phải có: self.addr, self.server, self.outbox (OutboundQueue
+    được writer riêng của connection xả xuống socket) và cài đặt close_transport().
+    """
+
+    __slots__ = ()
+
+    def init_session(self, addr, server):
+        self.addr = addr
+        self.server = server
+        self.username: Optional[str] = None
+        self.closed = False
+        # version wire protocol, bắt đầu bằng v1 và có thể nâng lên lúc login
+        self.proto = PROTO_V1
+        # tính năng client khai báo lúc login (vd "blobs"), client cũ không có
+        self.caps = frozenset()
+        # nén frame lớn (chỉ khi đã lên v2 và client có caps "deflate")
+        self.compress = False
+        self.framer = FrameReader(on_oversize=self.on_oversize)
+        # file đang stream: transfer id -> (to_user, room)
+        self.transfers: dict = {}
+        # người nhận chunk đang đầy hàng đợi -> engine tạm ngừng đọc từ client này
+        self.throttle_targets = ()
+        # token bucket theo nhóm type (rate_limit.py), None = không giới hạn
+        self.rate_limiter = server.new_rate_limiter()
+        self.rate_notice_at = 0.0
+        # lần cuối nhận được byte (engine cập nhật), heartbeat.py so với idle timeout
+        self.last_seen = time.monotonic()
+        # client trả pong cho ping của server (caps "heartbeat")
+        self.heartbeat = False
+
+    # ===== Transport =====
+    def send_frame(self, frame: bytes, key: str | None = None):
+        """
+        Đưa 1 frame đã encode sẵn (có thể dùng chung giữa nhiều client) vào hàng đợi gửi.
+        Không bao giờ block thread gọi (kể cả khi client nhận chậm).
+        """
+        if not self.outbox.put(frame, key):
+            self.server.log(f"⚠️ {self.username or self.addr} nhận quá chậm, ngắt kết nối", "WARNING")
+            self.abort_transport()
+
+    def send_raw(self, data: dict):
+        frame = encode_frame(data, self.proto)
+        if self.compress:
+            frame = self.server.compress_frame(frame)
+        self.server.m_frames_out.labels(data.get("type", "")).inc()
+        self.server.m_bytes_out.inc(len(frame))
+        self.send_frame(frame)
+
+    def negotiate_proto(self, requested) -> None:
+        """
+        Client gửi "proto" trong login = version cao nhất nó hỗ trợ.
+        Nếu > v1: gửi hello (vẫn bằng v1) rồi cả 2 chiều chuyển sang version mới.
+        Client cũ không gửi "proto" -> giữ v1.
+        Lên v2 + caps "deflate" (server không tắt nén) -> hello báo "compress" và bật nén.
+        """
+        try:
+            requested = int(requested or PROTO_V1)
+        except (TypeError, ValueError):
+            return
+        proto = max(p for p in SUPPORTED_PROTOS if p <= max(requested, PROTO_V1))
+        if proto == PROTO_V1:
+            return
+        compress = CAP_DEFLATE in self.caps and self.server.compress_min_bytes > 0
+        self.send_raw(build_hello(proto, CAP_DEFLATE if compress else None))
+        self.proto = proto
+        self.framer.length_prefixed = True
+        self.compress = compress
+
+    def close_transport(self):
+        raise NotImplementedError
+
+    def abort_transport(self):
+        """Đóng ngay, bỏ dữ liệu đang chờ gửi (slow consumer)"""
+        self.close_transport()
+
+    # ===== Rate limit =====
+    def read_frame(self, raw: bytes):
+        """
+        decode_typed + rate limit; None = bỏ frame.
+        Trừ token theo type đọc nhanh từ đầu frame trước khi decode -> frame spam bị bỏ
+        mà không parse JSON. Type thật khác type đọc nhanh (key "type" lặp lại...) thì trừ lại
+        theo type thật.
+        """
+        limiter = self.rate_limiter
+        if limiter is None:
+            return decode_typed(raw, self.proto)
+        peeked = peek_type(raw, self.proto)
+        if peeked is not None and not self._admit(limiter, peeked, len(raw)):
+            return None
+        data = decode_typed(raw, self.proto)
+        if data is None:
+            return None
+        t = data.type if isinstance(data, Message) else data.get("type")
+        if t != peeked and not self._admit(limiter, t, len(raw)):
+            return None
+        return data
+
+    def _admit(self, limiter, msg_type, size: int) -> bool:
+        category = limiter.check(msg_type, size)
+        if category is None:
+            return True
+        if msg_type in STREAM_TYPES:
+            # vẫn chuyển tiếp, engine ngừng đọc tới khi hết nợ (relay_congested)
+            self.server.record_throttle(category, "delayed", size)
+            return True
+        self.server.record_throttle(category, "dropped", size)
+        now = time.monotonic()
+        if now - self.rate_notice_at >= RATE_NOTICE_INTERVAL:
+            self.rate_notice_at = now
+            self.send_raw(build_error("Bạn gửi quá nhanh, một số tin đã bị bỏ qua"))
+        return False
+
+    # ===== Dispatch =====
+    def dispatch(self, data):
+        """
+        Engine gọi cho mỗi frame đã decode (decode_typed: object có kiểu hoặc dict):
+        xử lý + ghi metrics theo type (số frame, thời gian).
+        Lỗi trong handler chỉ bỏ frame đó (log + báo client), connection vẫn mở.
+        """
+        started = time.perf_counter()
+        t, data = _resolve(data)
+        try:
+            run_handler(MESSAGE_HANDLERS, self, t, data, started)
+        except Exception as e:
+            self.server.log(f"Lỗi xử lý '{t}' từ {self.username or self.addr}: {e!r}", "ERROR")
+            self.send_raw(build_error("Gói tin không hợp lệ, đã bị bỏ qua"))
+
+    def handle_message(self, data):
+        """Gọi handler đăng ký cho type của data (không ghi metrics)"""
+        t, data = _resolve(data)
+        handler = MESSAGE_HANDLERS.get(t)
+        if handler is not None:
+            handler(self, data)
+
+    # ===== Handlers: mỗi type 1 method, đăng ký vào MESSAGE_HANDLERS bằng @handles =====
+    @handles("login")
+    def _on_login(self, data: Login):
+        user = data.user
+        if not user:
+            self.send_raw(build_error("Username không hợp lệ"))
+            return
+        if self.server.is_online(user):
+            self.send_raw(build_error(f"Username '{user}' đã được sử dụng"))
+            return
+
+        self.username = user
+        self.caps = data.caps
+        self.heartbeat = CAP_HEARTBEAT in self.caps
+        self.negotiate_proto(data.proto)
+        self.server.user_manager.add_user(user, self)
+        self.server.share_presence(user, True)
+        self.server.logger.write("INFO", f"{user} login từ {self.addr}")
+        self.server.log(f"✓ {user} đã login từ {self.addr[0]}:{self.addr[1]}", "SUCCESS")
+
+        # chỉ client mới login nhận snapshot, những người khác nhận presence_join
+        self.server.presence_changed(user, True)
+        self.server.send_user_list(self)
+        self.server.send_room_list(self)
+        self.send_raw(build_system(f"Chào mừng {user}!"))
+        self.server.deliver_mailbox(user)
+
+    @handles("logout")
+    def _on_logout(self, data: dict):
+        self.disconnect()
+
+    @handles("private")
+    def _on_private(self, data: Private):
+        sender = data.sender
+        to_user = data.to
+        msg = data.msg
+        file_data = data.file
+
+        if sender != self.username:
+            self.send_raw(build_error("Sender không khớp"))
+            return
+
+        target = self.server.user_manager.get_handler(to_user)
+        offline = not target and not self.server.is_online(to_user)
+        if offline and not to_user:
+            self.send_raw(build_error(f"User '{to_user}' không online"))
+            return
+
+        ref, inline = self._attachment(file_data)
+        if file_data and ref is None:
+            return
+
+        # encode 1 lần / version, dùng chung cho người nhận + echo người gửi
+        message = build_private(sender, to_user, msg, ref)
+        legacy = build_private(sender, to_user, msg, inline) if ref else None
+        self.server.record_message(dm_channel(sender, to_user), message, legacy)
+        if offline:
+            # giữ trong hộp thư, gửi khi to_user login
+            if not self.server.mailbox.put(to_user, message):
+                self.send_raw(build_error(f"Hộp thư của '{to_user}' đã đầy, tin nhắn chưa được gửi"))
+                return
+            if self.server.mailbox.pending(to_user) == 1:
+                self.send_raw(build_system(f"{to_user} đang offline, tin nhắn sẽ được gửi khi {to_user} online"))
+        self.server.fanout((target, self) if target else (self,), message, legacy=legacy)
+        if not target and not offline:
+            # người nhận ở worker / node khác trong cluster
+            self.server.relay_remote(legacy or message, to_user=to_user)
+
+        log_msg = f"{sender} → {to_user}: {msg[:30] if msg else ''}"
+        if file_data:
+            log_msg += f" [📎 {file_data.get('name')}]"
+        self.server.log(log_msg, "CLIENT")
+        self.server.logger.write("PRIVATE", log_msg)
+
+    @handles("create_room")
+    def _on_create_room(self, data: RoomOp):
+        user = data.user
+        room = data.room
+        if user != self.username:
+            return
+        if not room:
+            self.send_raw(build_error("Tên phòng không hợp lệ"))
+            return
+        if self.server.room_manager.create_room(room):
+            self.server.room_changed(room)
+            self.server.share_room("create", room)
+            self.server.broadcast_room(room, build_system(f"{user} đã tạo phòng '{room}'", room))
+            self.server.log(f"🏠 {user} tạo phòng '{room}'", "SUCCESS")
+            self.server.logger.write("ROOM", f"{user} tạo phòng '{room}'")
+        else:
+            self.send_raw(build_error(f"Phòng '{room}' đã tồn tại"))
+
+    @handles("join_room")
+    def _on_join_room(self, data: RoomOp):
+        user = data.user
+        room = data.room
+        if user != self.username:
+            return
+        if not self.server.room_manager.room_exists(room):
+            self.send_raw(build_error(f"Phòng '{room}' không tồn tại"))
+            return
+        if self.server.room_manager.join(room, user):
+            self.server.room_changed(room, user, True)
+            self.server.share_room("join", room, user)
+            self.server.broadcast_room(room, build_system(f"{user} đã join phòng '{room}'", room))
+            self.server.log(f"👥 {user} join phòng '{room}'", "INFO")
+            self.server.logger.write("ROOM", f"{user} join phòng '{room}'")
+
+    @handles("leave_room")
+    def _on_leave_room(self, data: RoomOp):
+        user = data.user
+        room = data.room
+        if user != self.username:
+            return
+        if self.server.room_manager.leave(room, user):
+            self.server.room_changed(room, user, False)
+            self.server.share_room("leave", room, user)
+            self.server.broadcast_room(room, build_system(f"{user} đã rời phòng '{room}'", room))
+            self.server.log(f"👋 {user} rời phòng '{room}'", "WARNING")
+            self.server.logger.write("ROOM", f"{user} rời phòng '{room}'")
+
+    @handles("group")
+    def _on_group(self, data: Group):
+        room = data.room
+        sender = data.sender
+        msg = data.msg
+        file_data = data.file
+
+        if sender != self.username:
+            self.send_raw(build_error("Sender không khớp"))
+            return
+
+        if not self.server.room_manager.is_member(room, sender):
+            self.send_raw(build_error(f"Bạn chưa join phòng '{room}'"))
+            return
+
+        ref, inline = self._attachment(file_data)
+        if file_data and ref is None:
+            return
+
+        message = build_group(room, sender, msg, ref)
+        legacy = build_group(room, sender, msg, inline) if ref else None
+        self.server.record_message(room_channel(room), message, legacy)
+        self.server.broadcast_room(room, message, legacy=legacy)
+
+        log_msg = f"[{room}] {sender}: {msg[:30] if msg else ''}"
+        if file_data:
+            log_msg += f" [📎 {file_data.get('name')}]"
+        self.server.log(log_msg, "CLIENT")
+        self.server.logger.write("GROUP", log_msg)
+
+    @handles("ping")
+    def _on_ping(self, data: dict):
+        self.send_raw(build_pong())
+
+    @handles("pong")
+    def _on_pong(self, data: dict):
+        pass  # last_seen đã được engine cập nhật lúc nhận
+
+    @handles("presence_sync")
+    def _on_presence_sync(self, data: dict):
+        if self.username:
+            self.server.send_user_list(self)
+
+    @handles("room_sync")
+    def _on_room_sync(self, data: dict):
+        if self.username:
+            self.server.send_room_list(self)
+
+    @handles("blob_get")
+    def _on_blob_get(self, data: dict):
+        if not self.username:
+            return
+        digest = str(data.get("hash", ""))
+        self.send_raw(build_blob(digest, self.server.blob_store.get(digest)))
+
+    def _attachment(self, file_data):
+        """(ref, inline) của attachment, báo lỗi cho người gửi nếu không dùng được"""
+        if not file_data:
+            return None, None
+        ref, inline = self.server.store_attachment(file_data)
+        if ref is None:
+            self.send_raw(build_error("File đính kèm không hợp lệ hoặc không còn trên server"))
+        return ref, inline
+
+    @handles("history")
+    def _history(self, data: dict):
+        """1 trang lịch sử của phòng (phải là member) hoặc cuộc chat riêng với 1 user"""
+        if not self.username:
+            return
+        room = text_field(data.get("room")) or None
+        with_user = text_field(data.get("with")) or None
+        if room:
+            if not self.server.room_manager.is_member(room, self.username):
+                self.send_raw(build_error(f"Bạn chưa join phòng '{room}'"))
+                return
+            channel = room_channel(room)
+        elif with_user:
+            channel = dm_channel(self.username, with_user)
+        else:
+            return
+        limit = data.get("limit")
+        limit = min(limit, HISTORY_MAX_PAGE) if isinstance(limit, int) and limit > 0 else HISTORY_PAGE
+        messages, more = self.server.history.history(channel, data.get("before"), limit)
+        self.send_raw(build_history(messages, more, room, with_user))
+
+    # ===== Streaming file transfer (relay) =====
+    def _transfer_targets(self, to_user: str | None, room: str | None) -> list:
+        if room:
+            return [h for h in self.server.room_handlers(room) if h is not self]
+        target = self.server.user_manager.get_handler(to_user)
+        return [target] if target else []
+
+    def _transfer_send(self, to_user: str | None, room: str | None, data: dict) -> list:
+        """Gửi frame của file stream cho người nhận cục bộ + node khác trong cluster"""
+        targets = self._transfer_targets(to_user, room)
+        self.server.fanout(targets, data)
+        if room or not targets:
+            self.server.relay_remote(data, to_user, room)
+        return targets
+
+    @handles("file_begin")
+    def _file_begin(self, data: dict):
+        tid = data.get("id")
+        to_user = text_field(data.get("to")) or None
+        room = text_field(data.get("room")) or None
+        name = text_field(data.get("name"))
+        size = data.get("size", 0)
+
+        if data.get("from") != self.username or not valid_transfer_id(tid) or tid in self.transfers:
+            self.send_raw(build_error("File transfer không hợp lệ"))
+            return
+        if not isinstance(size, int) or size < 0 or size > MAX_STREAM_FILE_SIZE:
+            self.send_raw(build_file_abort(self.username, tid, "File quá lớn", to_user, room))
+            return
+        if room and not self.server.room_manager.is_member(room, self.username):
+            self.send_raw(build_file_abort(self.username, tid, f"Bạn chưa join phòng '{room}'", to_user, room))
+            return
+        if not room and not self.server.is_online(to_user):
+            self.send_raw(build_file_abort(self.username, tid, f"User '{to_user}' không online", to_user, room))
+            return
+
+        self.transfers[tid] = (to_user, room)
+        # dựng lại frame từ các trường đã kiểm tra, không chuyển nguyên dict của client
+        self._transfer_send(to_user, room, build_file_begin(
+            self.username, tid, name, text_field(data.get("mime")) or "application/octet-stream",
+            size, to_user, room))
+
+        log_msg = f"{self.username} → {room or to_user}: [📤 {name} {size} bytes]"
+        self.server.log(log_msg, "CLIENT")
+        self.server.logger.write("GROUP" if room else "PRIVATE", log_msg)
+
+    @handles("file_chunk", "file_end", "file_abort")
+    def _file_relay(self, data: dict):
+        """
+        file_chunk / file_end / file_abort: kiểm tra kiểu các trường rồi dựng lại frame
+        theo transfer đã mở (chunk sai kiểu -> hủy transfer, không chuyển cho người nhận)
+        """
+        tid = data.get("id")
+        route = self.transfers.get(tid) if isinstance(tid, str) else None
+        if route is None:
+            return
+        to_user, room = route
+        t = data.get("type")
+        if t == "file_chunk":
+            index, chunk, crc = data.get("index"), data.get("data"), data.get("crc")
+            if not (isinstance(index, int) and isinstance(chunk, (bytes, str)) and isinstance(crc, int)):
+                self._abort_transfer(tid, "Chunk không hợp lệ")
+                return
+            frame = build_file_chunk(self.username, tid, index, chunk, to_user, room, crc)
+            self.throttle_targets = self._transfer_send(to_user, room, frame)
+            return
+        del self.transfers[tid]
+        if t == "file_end":
+            chunks = data.get("chunks")
+            frame = build_file_end(self.username, tid, chunks if isinstance(chunks, int) else -1,
+                                   text_field(data.get("sha256")), to_user, room)
+        else:
+            frame = build_file_abort(self.username, tid, text_field(data.get("reason")) or "Người gửi hủy",
+                                     to_user, room)
+        self._transfer_send(to_user, room, frame)
+
+    def _abort_transfer(self, tid: str, reason: str):
+        """Hủy 1 transfer: báo người nhận + người gửi"""
+        to_user, room = self.transfers.pop(tid)
+        abort = build_file_abort(self.username, tid, reason, to_user, room)
+        self._transfer_send(to_user, room, abort)
+        self.send_raw(abort)
+
+    def relay_congested(self) -> bool:
+        """
+        True nếu người nhận file đã đầy nửa hàng đợi gửi. Engine sẽ tạm ngừng đọc
+        socket của người gửi -> TCP tự giảm tốc người gửi thay vì drop chunk.
+        Cũng True khi bucket bytes đang âm vì chunk vượt rate limit.
+        """
+        if self.rate_limiter is not None and self.rate_limiter.in_debt():
+            return True
+        for h in self.throttle_targets:
+            q = h.outbox
+            if not h.closed and (q.pending_bytes > q.max_bytes // 2 or len(q) > q.max_frames // 2):
+                return True
+        self.throttle_targets = ()
+        return False
+
+    def _abort_transfers(self):
+        for tid, (to_user, room) in list(self.transfers.items()):
+            self._transfer_send(to_user, room,
+                                build_file_abort(self.username, tid, "Người gửi đã ngắt kết nối", to_user, room))
+        self.transfers.clear()
+
+    def on_oversize(self, size: int):
+        """FrameReader báo frame vượt giới hạn (đã bị bỏ, không buffer hết)"""
+        self.server.log(f"Frame quá lớn ({size} bytes) từ {self.username or self.addr}", "WARNING")
+        self.send_raw(build_error("Gói tin quá lớn, đã bị bỏ qua"))
+
+    def disconnect(self):
+        """Dọn dẹp user/room rồi đóng kết nối (gọi nhiều lần vẫn an toàn)"""
+        if self.closed:
+            return
+        self.closed = True
+
+        if self.username:
+            self._abort_transfers()
+            self.server.user_manager.remove_user(self.username)
+            for room in self.server.room_manager.remove_user_everywhere(self.username):
+                self.server.room_changed(room, self.username, False)
+            self.server.logger.write("INFO", f"{self.username} logout")
+            self.server.log(f"✗ {self.username} đã logout", "WARNING")
+            self.server.presence_changed(self.username, False)
+            self.server.share_presence(self.username, False)
+
+        self.server.remove_client(self)
+        self.close_transport()
@@ -0,0 +1,157 @@
+"""
+ClusterNode: nối 1 chat server (1 worker process hoặc 1 node sau load balancer)
+vào backplane chung với các node khác (xem backplane.py).
+
+- login/logout, create/join/leave phòng được chia sẻ qua backplane -> mọi node
+  có cùng danh sách user online và cùng room_manager (member ở node khác
+  không có handler cục bộ, room_handlers chỉ chứa connection của node này)
+- private tới user ở node khác / group có member ở node khác được broker
+  chuyển tới đúng node đó, node nhận gửi cho connection của nó
+- message qua backplane luôn là bản đầy đủ (attachment kèm data); node nhận lưu
+  lại vào blob store của nó rồi gửi ref / inline như message cục bộ
+"""
+
+import socket
+
+from backplane import Backplane, BrokerBackplane
+from bus import encode_payload, decode_payload
+from protocol import build_error
+
+
+class ClusterNode:
+    def __init__(self, server, backplane: Backplane | str, node_id: str):
+        """backplane: instance Backplane hoặc địa chỉ broker ("host:port" / đường dẫn Unix socket)"""
+        self.server = server
+        self.node_id = node_id
+        self.bus = BrokerBackplane(backplane) if isinstance(backplane, str) else backplane
+        self.bus.on_frame = self._on_frame
+        self.bus.on_close = self._on_bus_closed
+        # user ở node khác -> node id; copy-on-write như UserManager, đọc không lock
+        self._remote: dict[str, str] = {}
+        self.relayed = 0
+        self.received = 0
+        server.cluster = self
+
+    # ===== Vòng đời (engine gọi trong start / stop) =====
+    def start(self):
+        self.bus.connect()
+        self.bus.send({"op": "hello", "node": self.node_id})
+        self.server.log(f"Cluster: node {self.node_id} đã nối backplane", "SUCCESS")
+
+    def stop(self):
+        self.bus.close()
+
+    # ===== Registry =====
+    def has_user(self, user: str) -> bool:
+        return user in self._remote
+
+    def users(self) -> list[str]:
+        return list(self._remote)
+
+    # ===== Gửi lên backplane =====
+    def share_presence(self, user: str, online: bool):
+        self.bus.send({"op": "presence", "user": user, "online": online})
+
+    def share_room(self, event: str, room: str, user: str | None = None):
+        self.bus.send({"op": "room", "event": event, "room": room, "user": user})
+
+    def publish(self, data: dict, to_user: str | None = None, room: str | None = None):
+        envelope = {"op": "publish", "room": room} if room else {"op": "publish", "user": to_user}
+        self.bus.send(envelope, encode_payload(data))
+        self.relayed += 1
+
+    # ===== Nhận từ backplane =====
+    def _on_frame(self, envelope: dict, payload: bytes):
+        # thread của backplane -> chạy trên thread / event loop của engine
+        self.server.call_soon(self._handle, envelope, payload)
+
+    def _handle(self, envelope: dict, payload: bytes):
+        op = envelope.get("op")
+        if op == "publish":
+            self.received += 1
+            data = decode_payload(payload)
+            if data:
+                self.server.deliver_remote(data, envelope.get("user"), envelope.get("room"))
+        elif op == "presence":
+            if envelope.get("online"):
+                self._remote_online(envelope["user"], envelope.get("node"))
+            else:
+                self._remote_offline(envelope["user"])
+        elif op == "room":
+            self._remote_room(envelope.get("event"), envelope.get("room", ""), envelope.get("user"))
+        elif op == "snapshot":
+            self._apply_snapshot(envelope)
+        elif op == "kick":
+            self._kick(envelope.get("user", ""))
+
+    def _remote_online(self, user: str, node: str):
+        if self._remote.get(user) == node:
+            return
+        remote = dict(self._remote)
+        remote[user] = node
+        self._remote = remote
+        self.server.presence_changed(user, True)
+        # tin offline đang giữ ở node này cho user -> chuyển tới node user vừa login
+        self.server.deliver_mailbox(user)
+
+    def _remote_offline(self, user: str):
+        if user not in self._remote:
+            return
+        remote = dict(self._remote)
+        del remote[user]
+        self._remote = remote
+        for room in self.server.room_manager.remove_user_everywhere(user):
+            self.server.room_changed(room, user, False)
+        self.server.presence_changed(user, False)
+
+    def _remote_room(self, event: str, room: str, user: str | None):
+        rooms = self.server.room_manager
+        if event == "create":
+            if rooms.create_room(room):
+                self.server.room_changed(room)
+        elif event == "join":
+            if rooms.join(room, user):
+                self.server.room_changed(room, user, True)
+        elif event == "leave":
+            if rooms.leave(room, user):
+                self.server.room_changed(room, user, False)
+
+    def _apply_snapshot(self, envelope: dict):
+        for user, node in envelope.get("users", {}).items():
+            self._remote_online(user, node)
+        for room, members in envelope.get("rooms", {}).items():
+            self._remote_room("create", room, None)
+            for user in members:
+                self._remote_room("join", room, user)
+
+    def _kick(self, user: str):
+        """Cùng username vừa login ở node khác trước: ngắt connection ở worker này"""
+        handler = self.server.user_manager.get_handler(user)
+        if handler is None:
+            return
+        handler.send_raw(build_error(f"Username '{user}' đã được sử dụng"))
+        self.server.log(f"Cluster: {user} đã login ở node khác, ngắt kết nối", "WARNING")
+        handler.disconnect()
+        if user in self._remote:
+            # disconnect() vừa báo offline cục bộ; user vẫn online ở node kia
+            self.server.presence_changed(user, True)
+
+    def _on_bus_closed(self):
+        self.server.log(f"Cluster: node {self.node_id} mất kết nối backplane", "ERROR")
+        self.server.call_soon(self._drop_remote)
+
+    def _drop_remote(self):
+        for user in list(self._remote):
+            self._remote_offline(user)
+
+    def stats(self) -> dict:
+        return {"node": self.node_id, "remote_users": len(self._remote),
+                "relayed": self.relayed, "received": self.received}
+
+
+def attach_cluster(server, args):
+    """--cluster-broker (add_server_arguments) -> gắn ClusterNode cho server; không có thì chạy đơn lẻ"""
+    if not args.cluster_broker:
+        return None
+    node_id = args.node_id or f"{socket.gethostname()}:{server.port}"
+    return ClusterNode(server, args.cluster_broker, node_id)
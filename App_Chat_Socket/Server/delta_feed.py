@@ -0,0 +1,68 @@
+import threading
+from typing import Callable
+
+# Các thay đổi trong cửa sổ này được gộp thành 1 lần phát
+DEFAULT_WINDOW = 0.05
+
+
+class DeltaFeed:
+    """
+    Phát thay đổi dạng delta có version thay vì gửi lại cả snapshot.
+    - change(key, op): ghi nhận thay đổi; cùng key trong 1 cửa sổ thì op sau ghi đè op trước
+      (op phải idempotent phía client: join 2 lần / leave user không có đều vô hại)
+    - hết cửa sổ: build(ops) -> các gói delta, mỗi gói được gán version tăng dần 1,
+      rồi publish(gói) gửi đi
+    - client thấy version nhảy cóc -> xin lại snapshot; snapshot phải gửi trong
+      `with feed.lock` để không chen vào giữa các gói delta
+    schedule(delay, fn): hẹn giờ của engine (threading.Timer / loop.call_later).
+    """
+
+    def __init__(self, schedule: Callable[[float, Callable[[], None]], None],
+                 build: Callable[[dict], list], publish: Callable[[list], None],
+                 window: float = DEFAULT_WINDOW):
+        self.schedule = schedule
+        self.build = build
+        self.publish = publish
+        self.window = window
+        self.version = 0
+        self.lock = threading.RLock()
+
+        self._pending: dict = {}
+        self._scheduled = False
+        self.changes = 0    # số thay đổi ghi nhận
+        self.flushes = 0    # số lần phát
+        self.coalesced = 0  # thay đổi bị gộp (cùng key trong 1 cửa sổ)
+
+    def change(self, key, op):
+        with self.lock:
+            self.changes += 1
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = op
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.schedule(self.window, self.flush)
+
+    def flush(self):
+        with self.lock:
+            self._scheduled = False
+            if not self._pending:
+                return
+            ops, self._pending = self._pending, {}
+            messages = self.build(ops)
+            for data in messages:
+                self.version += 1
+                data["version"] = self.version
+            self.flushes += 1
+            self.publish(messages)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "version": self.version,
+                "changes": self.changes,
+                "flushes": self.flushes,
+                "coalesced": self.coalesced,
+                "pending": len(self._pending),
+            }
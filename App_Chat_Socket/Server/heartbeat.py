@@ -0,0 +1,102 @@
+"""
+Heartbeat + dọn connection chết (laptop ngủ, rớt Wi-Fi...) thay vì chờ recv() báo lỗi
+sau vài giờ, trong lúc đó connection vẫn giữ username và nhận mọi broadcast.
+
+- mỗi connection có last_seen (engine cập nhật mỗi lần recv), gửi / nhận bình thường
+  không đụng tới bánh xe -> không tốn gì trên đường nóng
+- 1 TimerWheel cho cả server: mỗi tick (HEARTBEAT_TICK) lấy ra đúng 1 slot, xem last_seen
+  của các connection trong đó rồi xếp lại vào slot mới (không có 1 timer / connection)
+- client login với caps ["heartbeat"]: im lặng >= interval -> gửi ping (client trả pong),
+  im lặng >= timeout -> đóng. Client cũ không trả pong nên không bị đóng theo cách này,
+  chỉ dựa vào TCP keepalive (enable_keepalive)
+- connection chưa login sau timeout giây cũng bị đóng
+"""
+
+import math
+import socket
+import threading
+
+HEARTBEAT_TICK = 1.0                # giây
+DEFAULT_HEARTBEAT_INTERVAL = 30.0
+DEFAULT_IDLE_TIMEOUT = 90.0
+
+REASON_IDLE = "idle"
+REASON_LOGIN = "login_timeout"
+
+
+class TimerWheel:
+    """Slot thứ i chứa item đến hạn ở tick i (mod số slot); hạn xa hơn horizon bị kéo về horizon"""
+
+    def __init__(self, tick: float, horizon: float):
+        self.tick = tick
+        self._slots: list[list] = [[] for _ in range(int(math.ceil(horizon / tick)) + 1)]
+        self._cursor = 0
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def schedule(self, item, delay: float):
+        steps = min(max(1, int(math.ceil(delay / self.tick))), len(self._slots) - 1)
+        with self._lock:
+            self._slots[(self._cursor + steps) % len(self._slots)].append(item)
+            self.size += 1
+
+    def advance(self) -> list:
+        """Sang tick tiếp theo, trả về (và bỏ khỏi bánh xe) các item đến hạn"""
+        with self._lock:
+            self._cursor = (self._cursor + 1) % len(self._slots)
+            due = self._slots[self._cursor]
+            self._slots[self._cursor] = []
+            self.size -= len(due)
+        return due
+
+
+class HeartbeatReaper:
+    def __init__(self, interval: float = DEFAULT_HEARTBEAT_INTERVAL,
+                 timeout: float = DEFAULT_IDLE_TIMEOUT, tick: float = HEARTBEAT_TICK):
+        self.interval = min(interval, timeout)
+        self.timeout = timeout
+        self.tick_interval = tick
+        self.wheel = TimerWheel(tick, timeout)
+
+    def watch(self, session):
+        """Connection mới: kiểm tra lần đầu sau interval (client heartbeat kịp nhận ping trước hạn)"""
+        self.wheel.schedule(session, self.interval)
+
+    def tick(self, now: float) -> tuple[list, list]:
+        """
+        Xử lý 1 slot. Trả về (session cần ping, [(session, lý do)] cần đóng);
+        session đã đóng / client cũ đã login bị bỏ khỏi bánh xe.
+        """
+        ping, reap = [], []
+        for session in self.wheel.advance():
+            if session.closed:
+                continue
+            idle = now - session.last_seen
+            if session.username is None:
+                if idle >= self.timeout:
+                    reap.append((session, REASON_LOGIN))
+                else:
+                    self.wheel.schedule(session, self.timeout - idle)
+                continue
+            if not session.heartbeat:
+                continue
+            if idle >= self.timeout:
+                reap.append((session, REASON_IDLE))
+            elif idle >= self.interval:
+                ping.append(session)
+                self.wheel.schedule(session, min(self.interval, self.timeout - idle))
+            else:
+                self.wheel.schedule(session, self.interval - idle)
+        return ping, reap
+
+
+def enable_keepalive(sock, idle: float):
+    """TCP keepalive cho client không hỗ trợ heartbeat: kernel phát hiện peer chết sau ~idle giây"""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):  # Linux (macOS / Windows giữ mặc định hệ thống)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, max(1, int(idle)))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, int(idle) // 3))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+    except OSError:
+        pass
@@ -1,22 +1,176 @@
 ﻿import os
+import gzip
+import queue
+import atexit
+import shutil
+import threading
+import time
 from datetime import datetime
 
+DEFAULT_FLUSH_INTERVAL = 1.0   # giây
+DEFAULT_BATCH_LINES = 512
+DEFAULT_MAX_QUEUE = 100_000
+
+_STOP = object()
+_FLUSH = object()  # flush(): ghi ngay batch đang gom, không chờ hết flush_interval
+
+
 class ChatLogger:
     """
     Ghi log server ra file để làm minh chứng thực nghiệm.
     Mỗi ngày 1 file: logs/chat_YYYYMMDD.txt
+
+    write() chỉ đưa dòng log vào hàng đợi (không mở file trên thread xử lý message);
+    1 writer thread gom các dòng, tính từ dòng đầu tiên của batch, rồi ghi khi đủ batch_lines
+    hoặc khi đã qua flush_interval giây (dòng log nằm trong RAM tối đa ~flush_interval).
+    - đổi file theo ngày của từng dòng log (server chạy qua nửa đêm sang file mới)
+    - compress=True: file của ngày đã qua được nén thành .txt.gz
+    - hàng đợi có giới hạn: đầy thì bỏ dòng log và tăng bộ đếm dropped
     """
-    def __init__(self, folder: str = "logs"):
+
+    def __init__(self, folder: str = "logs", flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 batch_lines: int = DEFAULT_BATCH_LINES, max_queue: int = DEFAULT_MAX_QUEUE,
+                 compress: bool = False):
         self.folder = folder
+        self.flush_interval = flush_interval
+        self.batch_lines = batch_lines
+        self.compress = compress
         os.makedirs(self.folder, exist_ok=True)
-        self.file_path = self._build_path()
 
-    def _build_path(self) -> str:
-        date_str = datetime.now().strftime("%Y%m%d")
+        self._date = datetime.now().strftime("%Y%m%d")
+        self.file_path = self._build_path(self._date)
+        self._file = None
+
+        self._queue: queue.Queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.rotations = 0
+
+        if compress:
+            self._compress_stale()
+        self._thread = threading.Thread(target=self._run, name="chat-logger", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _build_path(self, date_str: str) -> str:
         return os.path.join(self.folder, f"chat_{date_str}.txt")
 
     def write(self, level: str, message: str):
-        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        line = f"[{ts}] [{level}] {message}\n"
-        with open(self.file_path, "a", encoding="utf-8") as f:
-            f.write(line)
\ No newline at end of file
+        now = datetime.now()
+        line = f"[{now.strftime('%Y-%m-%d %H:%M:%S')}] [{level}] {message}\n"
+        try:
+            self._queue.put_nowait((now.strftime("%Y%m%d"), line))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def flush(self):
+        """Chờ writer ghi xong mọi dòng đã write() trước đó"""
+        if self._thread.is_alive():
+            self._queue.put(_FLUSH)
+            self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "written": self.written,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "rotations": self.rotations,
+                "queue": self._queue.qsize(),
+            }
+
+    # ===== Writer thread =====
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            batch = []
+            taken = 1
+            deadline = time.monotonic() + self.flush_interval
+            # gom tới khi đủ batch_lines / hết flush_interval / có yêu cầu flush / dừng
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                if item is _FLUSH:
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_lines:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                taken += 1
+            try:
+                self._write_batch(batch)
+            except OSError as e:
+                print(f"[LOGGER] Lỗi ghi log: {e}", flush=True)
+            for _ in range(taken):
+                self._queue.task_done()
+        self._close_file()
+
+    def _write_batch(self, batch: list):
+        if not batch:
+            return
+        lines = []
+        for date_str, line in batch:
+            if date_str != self._date:
+                self._flush_lines(lines)
+                lines = []
+                self._rotate(date_str)
+            lines.append(line)
+        self._flush_lines(lines)
+        with self._lock:
+            self.written += len(batch)
+            self.batches += 1
+
+    def _flush_lines(self, lines: list):
+        if not lines:
+            return
+        if self._file is None:
+            self._file = open(self.file_path, "a", encoding="utf-8")
+        self._file.write("".join(lines))
+        self._file.flush()
+
+    def _rotate(self, date_str: str):
+        old_path = self.file_path
+        self._close_file()
+        self._date = date_str
+        self.file_path = self._build_path(date_str)
+        with self._lock:
+            self.rotations += 1
+        if self.compress and os.path.exists(old_path):
+            self._gzip(old_path)
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _compress_stale(self):
+        """Nén file log của các ngày trước còn sót từ lần chạy trước"""
+        current = os.path.basename(self.file_path)
+        for name in os.listdir(self.folder):
+            if name.startswith("chat_") and name.endswith(".txt") and name != current:
+                self._gzip(os.path.join(self.folder, name))
+
+    @staticmethod
+    def _gzip(path: str):
+        try:
+            with open(path, "rb") as src, gzip.open(path + ".gz", "ab") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+        except OSError as e:
+            print(f"[LOGGER] Không nén được {path}: {e}", flush=True)
@@ -0,0 +1,269 @@
+"""
+Hộp thư offline: private gửi tới user đang offline được giữ lại và gửi
+khi user đó login (thay vì báo lỗi "không online" để người gửi gửi lại liên tục).
+
+- mỗi user tối đa max_messages tin / max_bytes (JSON), đầy thì từ chối tin mới
+- tin quá ttl giây bị bỏ (dọn lúc put / take, không cần timer riêng)
+- mem_messages tin đầu của mỗi user nằm trong RAM, phần sau ghi nối vào
+  <root>/<sha1(user)>.jsonl; close() ghi nốt phần trong RAM, lần khởi động sau nạp lại
+- việc ghi file do 1 writer thread làm: put() chỉ đưa tin vào hàng đợi (không mở file
+  trên thread / event loop xử lý message), take() chờ hàng đợi ghi xong trước khi đọc file
+- take(user, n) lấy theo thứ tự gửi, server gửi dần từng batch sau login
+"""
+
+import os
+import json
+import time
+import queue
+import hashlib
+import threading
+from collections import deque
+
+DEFAULT_MAX_MESSAGES = 1000               # / user
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024       # / user
+DEFAULT_MEM_MESSAGES = 64                 # / user, phần còn lại nằm trên đĩa
+DEFAULT_MAX_USERS = 10_000
+DEFAULT_TTL = 7 * 24 * 3600               # giây
+
+_STOP = object()
+
+
+class _Box:
+    __slots__ = ("mem", "count", "bytes", "spilled")
+
+    def __init__(self):
+        self.mem: deque = deque()   # (expires_at, size, message)
+        self.count = 0              # tổng số tin (RAM + đĩa)
+        self.bytes = 0
+        self.spilled = 0            # số dòng đang nằm trong file
+
+
+class OfflineMailbox:
+    def __init__(self, root: str = "mailbox", max_messages: int = DEFAULT_MAX_MESSAGES,
+                 max_bytes: int = DEFAULT_MAX_BYTES, mem_messages: int = DEFAULT_MEM_MESSAGES,
+                 max_users: int = DEFAULT_MAX_USERS, ttl: float = DEFAULT_TTL):
+        self.root = root
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.mem_messages = mem_messages
+        self.max_users = max_users
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._boxes: dict[str, _Box] = {}
+
+        self.queued = 0
+        self.delivered = 0
+        self.rejected = 0
+        self.expired = 0
+        self.spilled = 0
+        self.write_errors = 0
+
+        os.makedirs(root, exist_ok=True)
+        self._load()
+        # (user, expires, size, message) chờ ghi nối vào file của user
+        self._spill_queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="mailbox-spill", daemon=True)
+        self._thread.start()
+
+    def _path(self, user: str) -> str:
+        return os.path.join(self.root, hashlib.sha1(user.encode("utf-8")).hexdigest() + ".jsonl")
+
+    def _load(self):
+        """Nạp lại các file spill còn lại (mỗi dòng có tên user)"""
+        now = time.time()
+        for name in os.listdir(self.root):
+            if not name.endswith(".jsonl"):
+                continue
+            entries = self._read_file(os.path.join(self.root, name))
+            live = [e for e in entries if e["exp"] > now]
+            if not live:
+                os.remove(os.path.join(self.root, name))
+                continue
+            # tin hết hạn trong file được bỏ lúc take()
+            box = self._boxes.setdefault(live[0]["user"], _Box())
+            box.spilled += len(entries)
+            box.count += len(entries)
+            box.bytes += sum(e["size"] for e in entries)
+
+    @staticmethod
+    def _read_file(path: str) -> list[dict]:
+        entries = []
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue  # dòng ghi dở khi server bị kill
+        except OSError:
+            pass
+        return entries
+
+    def put(self, user: str, message: dict) -> bool:
+        """Giữ message cho user; False nếu hộp thư đầy / quá nhiều user có hộp thư"""
+        body = json.dumps(message, ensure_ascii=False)
+        size = len(body)
+        now = time.time()
+        with self._lock:
+            box = self._boxes.get(user)
+            if box is None:
+                if len(self._boxes) >= self.max_users:
+                    self._purge_all(now)
+                if len(self._boxes) >= self.max_users:
+                    self.rejected += 1
+                    return False
+                box = self._boxes[user] = _Box()
+            self._expire_mem(box, now)
+            if box.count >= self.max_messages or box.bytes + size > self.max_bytes:
+                self.rejected += 1
+                return False
+            expires = now + self.ttl
+            if box.spilled == 0 and len(box.mem) < self.mem_messages:
+                box.mem.append((expires, size, message))
+            else:
+                # giữ thứ tự: đã có tin trên đĩa thì tin mới cũng ghi nối vào file (writer thread)
+                self._spill_queue.put((user, expires, size, message))
+                box.spilled += 1
+                self.spilled += 1
+            box.count += 1
+            box.bytes += size
+            self.queued += 1
+            return True
+
+    def pending(self, user: str) -> int:
+        box = self._boxes.get(user)
+        return box.count if box else 0
+
+    def take(self, user: str, limit: int) -> list[dict]:
+        """Lấy (và xóa) tối đa limit tin cũ nhất còn hạn của user"""
+        now = time.time()
+        out = []
+        with self._lock:
+            box = self._boxes.get(user)
+            if box is None:
+                return out
+            while len(out) < limit:
+                if not box.mem and box.spilled:
+                    self._unspill(user, box)
+                if not box.mem:
+                    break
+                expires, size, message = box.mem.popleft()
+                box.count -= 1
+                box.bytes -= size
+                if expires > now:
+                    out.append(message)
+                else:
+                    self.expired += 1
+            if box.count <= 0:
+                del self._boxes[user]
+            self.delivered += len(out)
+        return out
+
+    def _unspill(self, user: str, box: _Box):
+        """RAM đã hết: đọc cả file (đã bị giới hạn bởi max_messages / max_bytes) vào RAM"""
+        # các dòng put() đã xếp hàng phải nằm trong file trước khi đọc (writer không lấy _lock)
+        self._flush_spill()
+        path = self._path(user)
+        entries = self._read_file(path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        box.mem.extend((e["exp"], e["size"], e["msg"]) for e in entries)
+        lost = box.spilled - len(entries)
+        box.spilled = 0
+        if lost > 0:
+            # dòng hỏng: sửa lại bộ đếm cho khớp với phần còn đọc được
+            box.count = len(box.mem)
+            box.bytes = sum(size for _, size, _ in box.mem)
+
+    def close(self):
+        """Tắt server: ghi phần trong RAM xuống đĩa (trước các dòng đã spill) để nạp lại lần sau"""
+        if self._thread.is_alive():
+            self._spill_queue.put(_STOP)
+            self._thread.join()
+        with self._lock:
+            for user, box in self._boxes.items():
+                if not box.mem:
+                    continue
+                path = self._path(user)
+                lines = [json.dumps({"user": user, "exp": exp, "size": size, "msg": message},
+                                    ensure_ascii=False) + "\n" for exp, size, message in box.mem]
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        lines.extend(f)
+                except OSError:
+                    pass
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    f.writelines(lines)
+                os.replace(path + ".tmp", path)
+                box.spilled += len(box.mem)
+                box.mem.clear()
+
+    # ===== Writer thread =====
+    def _flush_spill(self):
+        if self._thread.is_alive():
+            self._spill_queue.join()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._spill_queue.get()
+            batch = []
+            # gom các tin đang chờ, mỗi file chỉ mở 1 lần / batch
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+                try:
+                    item = self._spill_queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._write_spill(batch)
+            for _ in range(len(batch) + stop):
+                self._spill_queue.task_done()
+
+    def _write_spill(self, batch: list):
+        lines: dict[str, list[str]] = {}
+        for user, expires, size, message in batch:
+            lines.setdefault(user, []).append(
+                json.dumps({"user": user, "exp": expires, "size": size, "msg": message},
+                           ensure_ascii=False) + "\n")
+        for user, user_lines in lines.items():
+            try:
+                with open(self._path(user), "a", encoding="utf-8") as f:
+                    f.writelines(user_lines)
+            except OSError as e:
+                # _unspill sửa lại bộ đếm theo số dòng đọc được
+                with self._lock:
+                    self.write_errors += len(user_lines)
+                print(f"[MAILBOX] Lỗi ghi hộp thư: {e}", flush=True)
+
+    def _expire_mem(self, box: _Box, now: float):
+        while box.mem and box.mem[0][0] <= now:
+            _, size, _ = box.mem.popleft()
+            box.count -= 1
+            box.bytes -= size
+            self.expired += 1
+
+    def _purge_all(self, now: float):
+        # chỉ dọn phần trong RAM; hộp thư có tin trên đĩa được dọn khi take()
+        for user, box in list(self._boxes.items()):
+            self._expire_mem(box, now)
+            if box.count <= 0:
+                del self._boxes[user]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._boxes),
+                "pending": sum(b.count for b in self._boxes.values()),
+                "queued": self.queued,
+                "delivered": self.delivered,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "spilled": self.spilled,
+                "write_errors": self.write_errors,
+                "spill_queue": self._spill_queue.qsize(),
+            }
@@ -0,0 +1,216 @@
+"""
+Lưu lịch sử private / group vào SQLite (WAL) để xem lại sau khi server khởi động lại.
+
+- mỗi message có id tăng dần (theo thời gian, micro giây) gán ngay lúc append()
+  -> server gửi id kèm message, client dùng id để xin trang cũ hơn
+- id là rowid (message mới luôn ghi vào cuối bảng); index (channel, id):
+  "50 tin trước id X" của 1 phòng / 1 cặp DM là 1 lần quét index, không phụ thuộc
+  tổng số message
+- append() chỉ đưa vào hàng đợi; 1 writer thread ghi theo batch trong 1 transaction
+  (giống ChatLogger). Message chưa ghi xuống đĩa vẫn đọc được qua history()
+- shard: vài process (workers.py) ghi chung 1 file mà id không trùng nhau
+"""
+
+import json
+import os
+import queue
+import atexit
+import sqlite3
+import threading
+import time
+from collections import deque
+
+DEFAULT_FLUSH_INTERVAL = 0.2   # giây
+DEFAULT_BATCH_ROWS = 1024
+DEFAULT_MAX_QUEUE = 100_000
+WRITER_CACHE_KB = 64 * 1024
+
+# id = micro giây << SHARD_BITS | shard
+SHARD_BITS = 6
+MAX_ID = (1 << 63) - 1
+
+_STOP = object()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    channel TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_channel_id ON messages (channel, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def room_channel(room: str) -> str:
+    return f"room:{room}"
+
+
+def dm_channel(user_a: str, user_b: str) -> str:
+    """Cùng 1 channel cho cả 2 chiều của cuộc chat riêng"""
+    a, b = sorted((user_a, user_b))
+    return f"dm:{a}\x1f{b}"
+
+
+class MessageStore:
+    def __init__(self, path: str = "history.db", shard: int = 0,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 batch_rows: int = DEFAULT_BATCH_ROWS, max_queue: int = DEFAULT_MAX_QUEUE):
+        self.path = path
+        self.shard = shard % (1 << SHARD_BITS)
+        self.flush_interval = flush_interval
+        self.batch_rows = batch_rows
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        # connection đọc riêng cho mỗi thread (sqlite3 không dùng chung giữa thread)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (self._meta_key(),)).fetchone()
+        self._last_id = row[0] if row else 0
+
+        self._queue: queue.Queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        # channel -> deque (id, body) đã append nhưng writer chưa commit
+        self._unflushed: dict[str, deque] = {}
+        self.stored = 0
+        self.dropped = 0
+        self.batches = 0
+        self.reads = 0
+
+        self._thread = threading.Thread(target=self._run, name="message-store", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _meta_key(self) -> str:
+        return f"last_id:{self.shard}"
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _next_id(self) -> int:
+        # gọi khi đang giữ self._lock
+        new_id = time.time_ns() // 1000 << SHARD_BITS | self.shard
+        if new_id <= self._last_id:
+            new_id = self._last_id + (1 << SHARD_BITS)
+        self._last_id = new_id
+        return new_id
+
+    def append(self, channel: str, message: dict) -> int | None:
+        """Gán id + đưa message vào hàng đợi ghi. Trả về id (None nếu hàng đợi đầy)"""
+        with self._lock:
+            msg_id = self._next_id()
+            body = json.dumps(dict(message, id=msg_id), ensure_ascii=False)
+            try:
+                self._queue.put_nowait((channel, msg_id, body))
+            except queue.Full:
+                self.dropped += 1
+                return None
+            self._unflushed.setdefault(channel, deque()).append((msg_id, body))
+        return msg_id
+
+    def history(self, channel: str, before: int | None = None, limit: int = 50) -> tuple[list[dict], bool]:
+        """
+        Tối đa limit message của channel có id < before (None = mới nhất), thứ tự cũ -> mới.
+        Trả về (messages, more): more=True nếu còn message cũ hơn.
+        """
+        before = before if isinstance(before, int) and 0 < before <= MAX_ID else MAX_ID
+        with self._lock:
+            pending = [row for row in self._unflushed.get(channel, ()) if row[0] < before]
+        rows = {msg_id: body for msg_id, body in pending[-(limit + 1):]}
+        # message đã commit trong lúc đọc pending có thể xuất hiện ở cả 2 nơi -> gộp theo id
+        for msg_id, body in self._conn().execute(
+                "SELECT id, body FROM messages WHERE channel = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (channel, before, limit + 1)):
+            rows.setdefault(msg_id, body)
+        with self._lock:
+            self.reads += 1
+        newest = sorted(rows, reverse=True)[:limit + 1]
+        more = len(newest) > limit
+        return [json.loads(rows[i]) for i in reversed(newest[:limit])], more
+
+    def flush(self):
+        """Chờ writer ghi xong mọi message đã append() trước đó"""
+        if self._thread.is_alive():
+            self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "stored": self.stored,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "reads": self.reads,
+                "queue": self._queue.qsize(),
+            }
+
+    # ===== Writer thread =====
+    def _run(self):
+        conn = self._conn()
+        # cache lớn cho writer: trang index của các channel đang hoạt động nằm sẵn trong RAM
+        conn.execute(f"PRAGMA cache_size=-{WRITER_CACHE_KB}")
+        stop = False
+        while not stop:
+            batch = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            while True:
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+                if stop or len(batch) >= self.batch_rows:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(conn, batch)
+            except sqlite3.Error as e:
+                print(f"[HISTORY] Lỗi ghi lịch sử: {e}", flush=True)
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+        conn.close()
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: list):
+        if not batch:
+            return
+        written = False
+        try:
+            with conn:
+                conn.executemany("INSERT OR IGNORE INTO messages (channel, id, body) VALUES (?, ?, ?)", batch)
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                             (self._meta_key(), batch[-1][1]))
+            written = True
+        finally:
+            # lỗi ghi: batch cũng bị bỏ khỏi bộ nhớ, không giữ mãi
+            with self._lock:
+                for channel, _, _ in batch:
+                    pending = self._unflushed[channel]
+                    pending.popleft()
+                    if not pending:
+                        del self._unflushed[channel]
+                if written:
+                    self.stored += len(batch)
+                    self.batches += 1
+                else:
+                    self.dropped += len(batch)
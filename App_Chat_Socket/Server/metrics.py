@@ -0,0 +1,267 @@
+"""
+Metrics của server theo định dạng text của Prometheus (GET /metrics trên 1 port HTTP local).
+
+- Counter / Gauge / Histogram, có thể có label (vd type của message):
+    frames_in = registry.counter("chat_frames_in_total", "...", ("type",))
+    frames_in.labels("group").inc()
+  child của mỗi bộ label được tạo 1 lần rồi giữ lại
+- đường nóng không lấy lock: mỗi thread cộng vào ô riêng của nó (dict theo thread id,
+  chỉ thread đó ghi key của mình), lúc scrape mới cộng các ô lại
+- Gauge có thể đọc giá trị lúc scrape (set_function) thay vì cập nhật liên tục
+- collector: hàm trả về {tên: giá trị} đọc lúc scrape, dùng cho các bộ đếm có sẵn
+  (OutboundStats, BlobStore.stats(), ChatLogger.stats()...)
+"""
+
+import math
+import threading
+from threading import get_ident
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# giây: 50µs .. 10s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children: dict = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.samples(self.name, _labels(self.labelnames, values)))
+        return lines
+
+
+class _Value:
+    __slots__ = ("_cells", "_base", "fn")
+
+    def __init__(self):
+        self._cells: dict[int, float] = {}  # thread id -> phần cộng dồn của thread đó
+        self._base = 0.0
+        self.fn: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1):
+        cells = self._cells
+        tid = get_ident()
+        cells[tid] = cells.get(tid, 0) + amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        # gauge đặt giá trị tuyệt đối: bỏ phần inc/dec trước đó
+        self._cells = {}
+        self._base = value
+
+    def set_function(self, fn: Callable[[], float]):
+        self.fn = fn
+
+    def get(self) -> float:
+        if self.fn is not None:
+            return self.fn()
+        return self._base + sum(list(self._cells.values()))
+
+    def samples(self, name: str, labels: str) -> list[str]:
+        return [f"{name}{labels} {_format(self.get())}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default.dec(amount)
+
+    def set(self, value: float):
+        self._default.set(value)
+
+    def set_function(self, fn: Callable[[], float]):
+        self._default.set_function(fn)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "_cells")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        # thread id -> [count ô 0, ..., count ô +Inf, sum]
+        self._cells: dict[int, list] = {}
+
+    def observe(self, value: float):
+        cell = self._cells.get(get_ident())
+        if cell is None:
+            cell = self._cells[get_ident()] = [0] * (len(self.bounds) + 1) + [0.0]
+        cell[bisect_left(self.bounds, value)] += 1
+        cell[-1] += value
+
+    def samples(self, name: str, labels: str) -> list[str]:
+        counts = [0] * (len(self.bounds) + 1)
+        total = 0.0
+        for cell in list(self._cells.values()):
+            cell = list(cell)
+            for i in range(len(counts)):
+                counts[i] += cell[i]
+            total += cell[-1]
+        base = labels[1:-1] if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), counts):
+            cumulative += count
+            le = f'le="{_format(float(bound))}"'
+            lines.append(f"{name}_bucket{{{base + ',' if base else ''}{le}}} {cumulative}")
+        lines.append(f"{name}_sum{labels} {_format(total)}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        # (prefix, help, fn): fn() -> {tên: số} đọc lúc scrape, xuất thành gauge <prefix>_<tên>
+        self._collectors: list[tuple[str, str, Callable[[], dict]]] = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: tuple = ()) -> Gauge:
+        return self._add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def add_collector(self, prefix: str, help_text: str, fn: Callable[[], dict]):
+        self._collectors.append((prefix, help_text, fn))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, help_text, fn in self._collectors:
+            try:
+                values = fn()
+            except Exception:
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                lines.append(f"# HELP {name} {help_text} ({key})")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """HTTP server nhỏ trên daemon thread: GET /metrics -> registry.render()"""
+
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._httpd: Optional[ThreadingHTTPServer] = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # không in mỗi lần scrape ra console
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        threading.Thread(target=self._httpd.serve_forever, name="metrics-http", daemon=True).start()
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
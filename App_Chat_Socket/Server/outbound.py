@@ -0,0 +1,148 @@
+import threading
+from collections import deque
+from typing import Callable, Optional
+
+# Chính sách khi hàng đợi gửi của 1 client bị đầy (slow consumer)
+POLICY_DROP = "drop"              # bỏ frame mới
+POLICY_DISCONNECT = "disconnect"  # ngắt kết nối client chậm
+POLICY_COALESCE = "coalesce"      # frame cùng key (user_list, room_list...) ghi đè frame cũ đang chờ
+POLICIES = (POLICY_DROP, POLICY_DISCONNECT, POLICY_COALESCE)
+
+DEFAULT_MAX_FRAMES = 1024
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+class OutboundStats:
+    """Bộ đếm dùng chung cho mọi hàng đợi gửi của server"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.overflow_disconnects = 0
+        self.max_depth = 0
+
+    def add(self, queued=0, dropped=0, coalesced=0, overflow_disconnects=0, depth=0):
+        with self._lock:
+            self.queued += queued
+            self.dropped += dropped
+            self.coalesced += coalesced
+            self.overflow_disconnects += overflow_disconnects
+            if depth > self.max_depth:
+                self.max_depth = depth
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "queued": self.queued,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "overflow_disconnects": self.overflow_disconnects,
+                "max_depth": self.max_depth,
+            }
+
+
+class OutboundQueue:
+    """
+    Hàng đợi gửi có giới hạn của 1 connection.
+    - put() được gọi từ bất kỳ thread nào (broadcast), không bao giờ block.
+    - writer riêng của connection lấy frame ra và ghi xuống socket.
+    - on_ready: callback khi có frame mới (engine asyncio dùng để đánh thức writer task);
+      nếu không có thì writer thread chờ qua Condition.
+    """
+
+    def __init__(self, max_frames: int = DEFAULT_MAX_FRAMES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 policy: str = POLICY_DROP, stats: Optional[OutboundStats] = None,
+                 on_ready: Optional[Callable[[], None]] = None):
+        if policy not in POLICIES:
+            raise ValueError(f"Policy không hợp lệ: {policy}")
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.stats = stats or OutboundStats()
+        self.on_ready = on_ready
+
+        self._cond = threading.Condition()
+        self._items: deque = deque()  # mỗi item: [key, frame]
+        self._by_key: dict = {}
+        self._bytes = 0
+        self.closed = False
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def pending_bytes(self) -> int:
+        return self._bytes
+
+    def put(self, frame: bytes, key: Optional[str] = None) -> bool:
+        """
+        Đưa frame vào hàng đợi.
+        Trả về False nếu đầy và policy = disconnect (caller phải ngắt kết nối).
+        """
+        with self._cond:
+            if self.closed:
+                return True
+
+            if key is not None and self.policy == POLICY_COALESCE:
+                item = self._by_key.get(key)
+                if item is not None:
+                    self._bytes += len(frame) - len(item[1])
+                    item[1] = frame
+                    self.stats.add(coalesced=1)
+                    return True
+
+            if self._items and (len(self._items) >= self.max_frames
+                                or self._bytes + len(frame) > self.max_bytes):
+                if self.policy == POLICY_DISCONNECT:
+                    self.stats.add(overflow_disconnects=1)
+                    return False
+                self.stats.add(dropped=1)
+                return True
+
+            item = [key, frame]
+            self._items.append(item)
+            if key is not None:
+                self._by_key[key] = item
+            self._bytes += len(frame)
+            self.stats.add(queued=1, depth=len(self._items))
+            was_empty = len(self._items) == 1
+            if self.on_ready is None:
+                self._cond.notify()
+
+        if was_empty and self.on_ready is not None:
+            self.on_ready()
+        return True
+
+    def pop_batch(self) -> list[bytes]:
+        """Lấy toàn bộ frame đang chờ (không block)"""
+        with self._cond:
+            return self._drain()
+
+    def get_batch(self, timeout: Optional[float] = None) -> Optional[list[bytes]]:
+        """Chờ tới khi có frame (writer thread). None = queue đã đóng."""
+        with self._cond:
+            while not self._items and not self.closed:
+                if not self._cond.wait(timeout):
+                    return []
+            if not self._items:
+                return None
+            return self._drain()
+
+    def _drain(self) -> list[bytes]:
+        frames = [item[1] for item in self._items]
+        self._items.clear()
+        self._by_key.clear()
+        self._bytes = 0
+        return frames
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._items.clear()
+            self._by_key.clear()
+            self._bytes = 0
+            self._cond.notify_all()
+        if self.on_ready is not None:
+            self.on_ready()
@@ -0,0 +1,90 @@
+"""
+Profile các handler message lúc server đang chạy, không cần restart.
+
+- toggle() (SIGUSR1 trên Linux/macOS): lần 1 bật, lần 2 tắt và ghi
+  <out_dir>/dispatch-YYYYmmdd-HHMMSS.prof (đọc bằng pstats / snakeviz)
+  + file .txt top hàm theo thời gian cộng dồn
+- khi bật, ChatSession.dispatch chạy handler qua call(): mỗi thread 1 cProfile.Profile
+  (engine thread-per-connection có nhiều thread đọc), lúc tắt gộp lại thành 1 file
+- khi tắt, đường nóng chỉ tốn 1 lần đọc thuộc tính active
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from typing import Callable, Optional
+
+TOP_FUNCTIONS = 40
+
+
+class DispatchProfiler:
+    def __init__(self, out_dir: str = "profiles", log: Callable[[str, str], None] = lambda msg, level: None):
+        self.out_dir = out_dir
+        self.log = log
+        self.active = False
+        self.started = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiles: list[cProfile.Profile] = []
+        self._generation = 0
+
+    def toggle(self) -> Optional[str]:
+        """Bật nếu đang tắt; tắt + ghi file nếu đang bật (trả về đường dẫn .prof)"""
+        if self.active:
+            return self.stop()
+        self.start()
+        return None
+
+    def start(self):
+        with self._lock:
+            if self.active:
+                return
+            self._profiles = []
+            self._generation += 1
+            self.started = time.time()
+            self.active = True
+        self.log("Profiler: bắt đầu ghi (gửi lại SIGUSR1 để dừng + ghi file)", "WARNING")
+
+    def call(self, fn, *args):
+        local = self._local
+        prof = getattr(local, "prof", None)
+        if prof is None or local.generation != self._generation:
+            prof = local.prof = cProfile.Profile()
+            local.generation = self._generation
+            with self._lock:
+                self._profiles.append(prof)
+        return prof.runcall(fn, *args)
+
+    def stop(self) -> Optional[str]:
+        with self._lock:
+            if not self.active:
+                return None
+            self.active = False
+            profiles, self._profiles = self._profiles, []
+        elapsed = time.time() - self.started
+
+        stats = None
+        for prof in profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(prof)
+                else:
+                    stats.add(prof)
+            except (TypeError, ValueError):
+                continue  # thread chưa xử lý xong message nào
+        if stats is None or not stats.stats:
+            self.log("Profiler: đã dừng, không có message nào được xử lý", "WARNING")
+            return None
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"dispatch-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+        stats.dump_stats(path)
+        text = io.StringIO()
+        pstats.Stats(path, stream=text).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+        with open(path[:-5] + ".txt", "w", encoding="utf-8") as f:
+            f.write(text.getvalue())
+        self.log(f"Profiler: {elapsed:.1f}s, {len(profiles)} thread -> {path}", "SUCCESS")
+        return path
@@ -0,0 +1,124 @@
+"""
+Giới hạn tốc độ theo từng connection bằng token bucket, kiểm tra trước khi decode frame
+(1 client spam vào phòng 500 người = 500 lần gửi cho mỗi frame).
+
+- mỗi nhóm (category) 1 bucket: rate token / giây, chứa tối đa burst token
+    chat   : private / group / file_begin, 1 token / frame
+    room   : create_room / join_room / leave_room, 1 token / frame
+    bytes  : private / group / file_* theo số byte của frame (attachment inline, chunk)
+    sync   : presence_sync / room_sync / history / blob_get (server phải gửi snapshot / blob), ping
+- 1 type có thể tốn token ở nhiều bucket (group: chat + bytes), đủ hết mới trừ
+- frame chat / room / sync quá giới hạn bị bỏ; chunk của file stream không bỏ được
+  (hỏng cả file) nên vẫn được chuyển đi, bucket bytes bị âm và engine ngừng đọc
+  socket tới khi hồi lại (TCP tự giảm tốc người gửi)
+- rate <= 0: không giới hạn nhóm đó
+"""
+
+import time
+from typing import Optional
+
+CATEGORY_CHAT = "chat"
+CATEGORY_ROOM = "room"
+CATEGORY_BYTES = "bytes"
+CATEGORY_SYNC = "sync"
+
+# category -> (rate / giây, burst)
+DEFAULT_RATE_LIMITS = {
+    CATEGORY_CHAT: (10.0, 30.0),
+    CATEGORY_ROOM: (2.0, 10.0),
+    # burst >= frame lớn nhất (attachment inline 5MB ~ 7MB base64) để frame hợp lệ luôn qua được
+    CATEGORY_BYTES: (16 * 1024 * 1024, 32 * 1024 * 1024),
+    CATEGORY_SYNC: (5.0, 20.0),
+}
+
+# type -> các (category, tính theo byte?) phải trả; type không có ở đây không bị giới hạn
+RATE_RULES = {
+    "private": ((CATEGORY_CHAT, False), (CATEGORY_BYTES, True)),
+    "group": ((CATEGORY_CHAT, False), (CATEGORY_BYTES, True)),
+    "file_begin": ((CATEGORY_CHAT, False),),
+    "file_chunk": ((CATEGORY_BYTES, True),),
+    "file_end": ((CATEGORY_BYTES, True),),
+    "file_abort": ((CATEGORY_BYTES, True),),
+    "create_room": ((CATEGORY_ROOM, False),),
+    "join_room": ((CATEGORY_ROOM, False),),
+    "leave_room": ((CATEGORY_ROOM, False),),
+    "presence_sync": ((CATEGORY_SYNC, False),),
+    "room_sync": ((CATEGORY_SYNC, False),),
+    "history": ((CATEGORY_SYNC, False),),
+    "blob_get": ((CATEGORY_SYNC, False),),
+    "ping": ((CATEGORY_SYNC, False),),
+}
+
+# Frame thuộc file stream: không bỏ, chỉ làm chậm việc đọc
+STREAM_TYPES = frozenset(("file_chunk", "file_end", "file_abort"))
+
+
+def parse_rate_limit(text: str) -> tuple:
+    """'chat=5:20' -> ("chat", 5.0, 20.0); 'chat=5' -> burst = rate; 'chat=0' -> tắt nhóm đó"""
+    category, _, value = text.partition("=")
+    if category not in DEFAULT_RATE_LIMITS or not value:
+        raise ValueError(f"Cần dạng <{'|'.join(DEFAULT_RATE_LIMITS)}>=RATE[:BURST], nhận '{text}'")
+    rate, _, burst = value.partition(":")
+    rate = float(rate)
+    return category, rate, float(burst) if burst else rate
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def refill(self, now: float) -> float:
+        tokens = self.tokens + (now - self.stamp) * self.rate
+        self.tokens = tokens if tokens < self.burst else self.burst
+        self.stamp = now
+        return self.tokens
+
+
+class RateLimiter:
+    """Các bucket của 1 connection (không lock: chỉ thread / task đọc của connection đó dùng)"""
+
+    __slots__ = ("buckets",)
+
+    def __init__(self, limits: dict):
+        self.buckets = {c: TokenBucket(rate, burst) for c, (rate, burst) in limits.items() if rate > 0}
+
+    def check(self, msg_type: str, size: int) -> Optional[str]:
+        """
+        Trừ token cho 1 frame, trả về category không đủ token (None = đủ).
+        Frame thường thiếu token: không trừ gì, người gọi bỏ frame.
+        Frame stream (STREAM_TYPES) thiếu token: vẫn trừ (bucket âm), người gọi cho đi tiếp.
+        """
+        rules = RATE_RULES.get(msg_type)
+        if rules is None:
+            return None
+        now = time.monotonic()
+        buckets = self.buckets
+        short = None
+        costs = []
+        for category, by_bytes in rules:
+            bucket = buckets.get(category)
+            if bucket is None:
+                continue
+            # frame lớn hơn burst vẫn qua được khi bucket đầy (trừ hết)
+            cost = min(size, bucket.burst) if by_bytes else 1
+            if bucket.refill(now) < cost:
+                if msg_type not in STREAM_TYPES:
+                    return category
+                short = category
+            costs.append((bucket, cost))
+        for bucket, cost in costs:
+            bucket.tokens -= cost
+        return short
+
+    def in_debt(self) -> bool:
+        """Có bucket đang âm (do frame stream) -> engine nên tạm ngừng đọc"""
+        now = time.monotonic()
+        for bucket in self.buckets.values():
+            if bucket.tokens < 0 and bucket.refill(now) < 0:
+                return True
+        return False
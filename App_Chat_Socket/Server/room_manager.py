@@ -1,5 +1,5 @@
 ﻿import threading
-from typing import Dict, Set, List
+from typing import Dict, Set, List, FrozenSet
 
 
 class RoomManager:
@@ -7,11 +7,21 @@ class RoomManager:
     Quản lý phòng chat:
     - room tồn tại ngay khi create (kể cả chưa ai join)
     - join/leave theo username
+    - index ngược user -> rooms: rời mọi phòng / disconnect chỉ tốn O(số phòng của user)
+    - ghi (create/join/leave) giữ lock; đọc members/room_exists/is_member KHÔNG lock:
+      mỗi lần ghi công bố lại frozenset member của phòng vào _views
+      (gán 1 key của dict là atomic trong CPython, người đọc luôn thấy bản cũ hoặc mới trọn vẹn)
     """
 
     def __init__(self):
         self._lock = threading.Lock()
         self._rooms: Dict[str, Set[str]] = {}
+        self._user_rooms: Dict[str, Set[str]] = {}
+        self._views: Dict[str, FrozenSet[str]] = {}
+
+    def _publish(self, room: str):
+        """Gọi khi đang giữ lock"""
+        self._views[room] = frozenset(self._rooms[room])
 
     def create_room(self, room: str) -> bool:
         room = (room or "").strip()
@@ -21,12 +31,11 @@ class RoomManager:
             if room in self._rooms:
                 return False
             self._rooms[room] = set()
+            self._publish(room)
             return True
 
     def room_exists(self, room: str) -> bool:
-        room = (room or "").strip()
-        with self._lock:
-            return room in self._rooms
+        return (room or "").strip() in self._views
 
     def join(self, room: str, user: str) -> bool:
         room = (room or "").strip()
@@ -37,6 +46,8 @@ class RoomManager:
             if room not in self._rooms:
                 return False
             self._rooms[room].add(user)
+            self._user_rooms.setdefault(user, set()).add(room)
+            self._publish(room)
             return True
 
     def leave(self, room: str, user: str) -> bool:
@@ -48,20 +59,48 @@ class RoomManager:
             if room not in self._rooms:
                 return False
             self._rooms[room].discard(user)
+            self._publish(room)
+            rooms = self._user_rooms.get(user)
+            if rooms is not None:
+                rooms.discard(room)
+                if not rooms:
+                    del self._user_rooms[user]
             return True
 
     def members(self, room: str) -> List[str]:
-        room = (room or "").strip()
-        with self._lock:
-            return sorted(list(self._rooms.get(room, set())))
+        return sorted(self.members_view(room))
+
+    def members_view(self, room: str) -> FrozenSet[str]:
+        """Tập member hiện tại (immutable, không lock, không sort)"""
+        return self._views.get((room or "").strip(), frozenset())
 
-    def remove_user_everywhere(self, user: str) -> None:
+    def is_member(self, room: str, user: str) -> bool:
+        return user in self.members_view(room)
+
+    def remove_user_everywhere(self, user: str) -> List[str]:
+        """Xóa user khỏi mọi phòng, trả về các phòng user đã ở"""
         user = (user or "").strip()
         if not user:
-            return
+            return []
+        with self._lock:
+            left = self._user_rooms.pop(user, set())
+            for name in left:
+                self._rooms[name].discard(user)
+                self._publish(name)
+        return sorted(left)
+
+    def rooms_of(self, user: str) -> List[str]:
+        """Các phòng user đang ở"""
+        user = (user or "").strip()
+        with self._lock:
+            return sorted(self._user_rooms.get(user, ()))
+
+    def counts(self, rooms=None) -> Dict[str, int]:
+        """Số member mỗi phòng (rooms=None: tất cả), không sort/copy danh sách member"""
         with self._lock:
-            for members in self._rooms.values():
-                members.discard(user)
+            if rooms is None:
+                return {name: len(members) for name, members in self._rooms.items()}
+            return {name: len(self._rooms.get(name, ())) for name in rooms}
 
     def snapshot(self) -> list[dict]:
         """
@@ -75,3 +114,22 @@ class RoomManager:
             out.sort(key=lambda x: x["name"].lower())
             return out
 
+    def check_consistency(self) -> List[str]:
+        """So khớp room -> members với user -> rooms. Trả về danh sách lỗi (rỗng = khớp)."""
+        problems = []
+        with self._lock:
+            for name, members in self._rooms.items():
+                for user in members:
+                    if name not in self._user_rooms.get(user, ()):
+                        problems.append(f"{user} ở phòng '{name}' nhưng thiếu trong index")
+            for name, members in self._rooms.items():
+                if self._views.get(name) != members:
+                    problems.append(f"view của phòng '{name}' lệch với danh sách member")
+            for user, rooms in self._user_rooms.items():
+                if not rooms:
+                    problems.append(f"index của {user} rỗng nhưng chưa bị xóa")
+                for name in rooms:
+                    if user not in self._rooms.get(name, ()):
+                        problems.append(f"index ghi {user} ở phòng '{name}' nhưng phòng không có")
+        return problems
+
@@ -0,0 +1,736 @@
+import queue
+import threading
+import time
+from datetime import datetime
+
+from user_manager import UserManager
+from room_manager import RoomManager
+from logger import ChatLogger
+from delta_feed import DeltaFeed
+from blob_store import BlobStore, DEFAULT_MAX_BYTES as DEFAULT_BLOB_MAX_BYTES
+from message_store import MessageStore
+from mailbox import OfflineMailbox
+from metrics import MetricsRegistry, MetricsServer, SIZE_BUCKETS
+from profiler import DispatchProfiler
+from rate_limit import RateLimiter, DEFAULT_RATE_LIMITS, parse_rate_limit
+from heartbeat import HeartbeatReaper, enable_keepalive, DEFAULT_HEARTBEAT_INTERVAL, DEFAULT_IDLE_TIMEOUT, REASON_IDLE, REASON_LOGIN
+from outbound import (
+    OutboundQueue, OutboundStats,
+    POLICIES, POLICY_DROP, DEFAULT_MAX_FRAMES, DEFAULT_MAX_BYTES,
+)
+from protocol import (
+    CAP_BLOBS, CAP_PRESENCE, CAP_ROOM_DELTA, CAP_ROOM_COUNTS,
+    COMPRESS_MIN_BYTES, COMPRESS_LEVEL, compress_frame_v2,
+    encode_frame, payload_bytes, build_file_ref, build_ping,
+    build_user_list, build_system, build_room_list,
+    build_presence_join, build_presence_leave, build_room_delta, build_room_counts,
+)
+
+
+class BroadcastStats:
+    """
+    Đếm số lần encode trong các broadcast để kiểm tra
+    "encode 1 lần / broadcast" (encodes) so với số socket nhận (recipients).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.broadcasts = 0
+        self.encodes = 0
+        self.recipients = 0
+        self.last_encodes = 0
+        self.last_recipients = 0
+
+    def record(self, encodes: int, recipients: int):
+        with self._lock:
+            self.broadcasts += 1
+            self.encodes += encodes
+            self.recipients += recipients
+            self.last_encodes = encodes
+            self.last_recipients = recipients
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "broadcasts": self.broadcasts,
+                "encodes": self.encodes,
+                "recipients": self.recipients,
+                # số lần encode tiết kiệm được so với encode mỗi recipient
+                "encodes_saved": self.recipients - self.encodes,
+                "last_encodes": self.last_encodes,
+                "last_recipients": self.last_recipients,
+            }
+
+
+class CompressionStats:
+    """Các frame đã thử nén (mỗi broadcast nén 1 lần): byte trước / sau và thời gian nén"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.skipped = 0       # nén không nhỏ hơn (vd ảnh đã nén sẵn) -> gửi bản gốc
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def record(self, size_in: int, size_out: int, seconds: float):
+        with self._lock:
+            if size_out < size_in:
+                self.frames += 1
+            else:
+                self.skipped += 1
+            self.bytes_in += size_in
+            self.bytes_out += size_out
+            self.seconds += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            attempts = self.frames + self.skipped
+            return {
+                "frames": self.frames,
+                "skipped": self.skipped,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                # bytes_out / bytes_in: càng nhỏ càng tiết kiệm băng thông
+                "ratio": round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else 1.0,
+                "seconds": round(self.seconds, 6),
+                "us_per_frame": round(self.seconds / attempts * 1e6, 1) if attempts else 0.0,
+            }
+
+
+# Gửi hộp thư offline sau login: mỗi lần 1 batch, nghỉ giữa các batch để không chặn login
+MAILBOX_BATCH = 100
+MAILBOX_PACE_INTERVAL = 0.02   # giây
+
+# Sự kiện gửi cho observer (dashboard...):
+#   ("log", "HH:MM:SS", level, message)   ("counts", online, connections)
+EVENT_QUEUE_SIZE = 10_000
+
+# --console-level -> các level không in ra console (observer / ChatLogger vẫn nhận đủ).
+# Dòng CLIENT (mỗi private / group, mỗi connection) mặc định không in: print + flush
+# đồng bộ trên event loop tốn đáng kể khi tải cao, nội dung đã có trong file log.
+CONSOLE_LEVELS = {
+    "client": frozenset(),
+    "info": frozenset({"CLIENT"}),
+    "warning": frozenset({"CLIENT", "INFO", "SUCCESS"}),
+}
+DEFAULT_CONSOLE_LEVEL = "info"
+
+
+class ChatServerBase:
+    """
+    Phần lõi dùng chung của chat server (không phụ thuộc GUI/engine):
+    - user_manager, room_manager, logger
+    - danh sách connection
+    - các hàm broadcast
+    Engine (thread/asyncio) kế thừa và lo phần accept + socket.
+    Không phụ thuộc GUI: dashboard đăng ký observer và tự đọc sự kiện từ queue.
+    """
+
+    def __init__(self, host="0.0.0.0", port=5555, log_dir: str = "logs", log_compress: bool = False,
+                 outbound_policy: str = POLICY_DROP,
+                 outbound_max_frames: int = DEFAULT_MAX_FRAMES,
+                 outbound_max_bytes: int = DEFAULT_MAX_BYTES,
+                 blob_dir: str = "blobs", blob_max_bytes: int = DEFAULT_BLOB_MAX_BYTES,
+                 history_db: str = "history.db", history_shard: int = 0,
+                 mailbox_dir: str = "mailbox",
+                 metrics_host: str = "127.0.0.1", metrics_port: int = 0,
+                 profile_dir: str = "profiles",
+                 compress_min_bytes: int = COMPRESS_MIN_BYTES, compress_level: int = COMPRESS_LEVEL,
+                 rate_limits: dict | None = None,
+                 heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 console_level: str = DEFAULT_CONSOLE_LEVEL):
+        self.host = host
+        self.port = port
+        self.running = False
+        # in log ra console (tắt khi đã có dashboard hiển thị)
+        self.console_log = True
+        self.console_hidden = CONSOLE_LEVELS[console_level]
+        self._observers: list[queue.Queue] = []
+        self.events_dropped = 0
+
+        # Hàng đợi gửi riêng cho từng connection (slow consumer policy)
+        self.outbound_policy = outbound_policy
+        self.outbound_max_frames = outbound_max_frames
+        self.outbound_max_bytes = outbound_max_bytes
+        self.outbound_stats = OutboundStats()
+        # nén frame v2 >= compress_min_bytes cho client có caps "deflate" (0 = tắt)
+        self.compress_min_bytes = compress_min_bytes
+        self.compress_level = compress_level
+        self.compression_stats = CompressionStats()
+        # token bucket / connection: category -> (rate, burst), {} = không giới hạn
+        self.rate_limits = DEFAULT_RATE_LIMITS if rate_limits is None else rate_limits
+        # ping connection im lặng + đóng connection chết (heartbeat.py), idle_timeout 0 = tắt
+        self.heartbeat = HeartbeatReaper(heartbeat_interval, idle_timeout) if idle_timeout > 0 else None
+        self._ping_frames: dict = {}
+
+        # set thay vì list: remove O(1) khi có hàng nghìn connection
+        self.clients = set()
+        self.client_lock = threading.Lock()
+
+        self.user_manager = UserManager()
+        self.room_manager = RoomManager()
+        # room -> tuple handler của member, dựng lại khi join/leave/disconnect;
+        # broadcast_room đọc không lock
+        self._room_handlers: dict = {}
+        self._room_handlers_lock = threading.Lock()
+        self.logger = ChatLogger(log_dir, compress=log_compress)
+        self.broadcast_stats = BroadcastStats()
+        # attachment inline lưu theo sha256 -> gửi lại cùng file không tốn thêm dung lượng
+        self.blob_store = BlobStore(blob_dir, blob_max_bytes)
+        # lịch sử private/group (SQLite), message được gán id trước khi gửi đi
+        self.history = MessageStore(history_db, history_shard)
+        # private gửi tới user offline, gửi lại khi user login
+        self.mailbox = OfflineMailbox(mailbox_dir)
+        # login/logout -> presence_join/leave có version, gộp trong 1 cửa sổ ngắn
+        self.presence = DeltaFeed(self.call_later, self._build_presence, self._publish_presence)
+        # create/join/leave -> room_delta có version (hoặc room_counts cho client chỉ cần số người)
+        self.rooms_feed = DeltaFeed(self.call_later, self._build_room_delta, self._publish_rooms)
+        # ClusterNode (cluster.py) khi chạy nhiều worker / node; None = server đơn lẻ
+        self.cluster = None
+
+        # metrics (Prometheus text trên http://metrics_host:metrics_port/metrics, port 0 = tắt)
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self._metrics_server = None
+        self._init_metrics()
+        # cProfile các handler, bật/tắt lúc đang chạy (SIGUSR1)
+        self.profiler = DispatchProfiler(profile_dir, self.log)
+
+    # ===== Metrics =====
+    def _init_metrics(self):
+        m = self.metrics = MetricsRegistry()
+        self.m_frames_in = m.counter("chat_frames_in_total", "Frame nhận từ client theo type", ("type",))
+        self.m_frames_out = m.counter("chat_frames_out_total", "Frame đưa vào hàng đợi gửi theo type", ("type",))
+        self.m_bytes_in = m.counter("chat_bytes_in_total", "Byte nhận từ client")
+        self.m_bytes_out = m.counter("chat_bytes_out_total", "Byte đưa vào hàng đợi gửi")
+        self.m_dispatch = m.histogram("chat_dispatch_seconds", "Thời gian handler xử lý 1 frame theo type",
+                                      ("type",))
+        # type -> (child frames_in, child dispatch): tra 1 lần / frame thay vì 2 lần labels()
+        self._dispatch_children: dict = {}
+        self.m_fanout = m.histogram("chat_fanout_recipients", "Số connection nhận trong 1 lần fanout",
+                                    buckets=SIZE_BUCKETS)
+        self.m_send_errors = m.counter("chat_send_errors_total", "Lỗi khi gửi tới client")
+        # action: dropped (frame bị bỏ) | delayed (chunk file stream, ngừng đọc tới khi hồi token)
+        self.m_throttled = m.counter("chat_throttled_frames_total", "Frame vượt rate limit",
+                                     ("category", "action"))
+        self.m_throttled_bytes = m.counter("chat_throttled_bytes_total", "Byte của frame vượt rate limit",
+                                           ("category", "action"))
+        # reason: idle (client heartbeat không trả lời) | login_timeout (mở connection mà không login)
+        self.m_reaped = m.counter("chat_reaped_connections_total", "Connection bị đóng vì im lặng quá lâu",
+                                  ("reason",))
+        for reason in (REASON_IDLE, REASON_LOGIN):
+            self.m_reaped.labels(reason)
+        self.m_pings = m.counter("chat_pings_sent_total", "Ping gửi tới connection im lặng")
+        m.gauge("chat_heartbeat_watched", "Connection đang nằm trong bánh xe heartbeat").set_function(
+            lambda: self.heartbeat.wheel.size if self.heartbeat else 0)
+        m.gauge("chat_connections", "Connection đang mở").set_function(self.connection_count)
+        m.gauge("chat_users_online", "User online (cả node khác trong cluster)").set_function(
+            lambda: len(self.online_users()))
+        m.gauge("chat_threads", "Số thread của process").set_function(threading.active_count)
+        m.gauge("chat_observer_events_dropped", "Sự kiện observer bị bỏ").set_function(lambda: self.events_dropped)
+        m.add_collector("chat_broadcast", "BroadcastStats", self.broadcast_stats.snapshot)
+        m.add_collector("chat_outbound", "Hàng đợi gửi", self.outbound_snapshot)
+        m.add_collector("chat_compression", "Nén frame v2", self.compression_stats.snapshot)
+        m.add_collector("chat_blobs", "Blob store", self.blob_store.stats)
+        m.add_collector("chat_logger", "ChatLogger", self.logger.stats)
+        m.add_collector("chat_history", "Lịch sử SQLite", self.history.stats)
+        m.add_collector("chat_mailbox", "Hộp thư offline", self.mailbox.stats)
+        m.add_collector("chat_cluster", "Cluster", lambda: self.cluster.stats() if self.cluster else {})
+
+    def start_metrics(self):
+        """Engine gọi khi start; lỗi bind chỉ ghi log, server vẫn chạy"""
+        if not self.metrics_port or self._metrics_server is not None:
+            return
+        server = MetricsServer(self.metrics, self.metrics_host, self.metrics_port)
+        try:
+            server.start()
+        except OSError as e:
+            self.log(f"Không mở được metrics port {self.metrics_port}: {e}", "ERROR")
+            return
+        self._metrics_server = server
+        self.log(f"Metrics: http://{self.metrics_host}:{server.port}/metrics", "INFO")
+
+    def stop_metrics(self):
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+            self._metrics_server = None
+
+    def record_dispatch(self, msg_type: str, started: float):
+        children = self._dispatch_children.get(msg_type)
+        if children is None:
+            children = self._dispatch_children[msg_type] = (
+                self.m_frames_in.labels(msg_type), self.m_dispatch.labels(msg_type))
+        children[0].inc()
+        children[1].observe(time.perf_counter() - started)
+
+    # ===== Heartbeat =====
+    def start_heartbeat(self):
+        """Engine gọi khi start: 1 chuỗi call_later cho cả server (không phải 1 timer / connection)"""
+        if self.heartbeat is not None:
+            self.call_later(self.heartbeat.tick_interval, self._heartbeat_tick)
+
+    def enable_keepalive(self, sock):
+        """TCP keepalive theo idle timeout: dọn cả client cũ không trả pong khi peer biến mất"""
+        if self.heartbeat is not None and sock is not None:
+            enable_keepalive(sock, self.heartbeat.timeout)
+
+    def _heartbeat_tick(self):
+        if not self.running:
+            return
+        try:
+            pings, reaped = self.heartbeat.tick(time.monotonic())
+            for handler in pings:
+                frame = self._ping_frames.get(handler.proto)
+                if frame is None:
+                    frame = self._ping_frames[handler.proto] = encode_frame(build_ping(), handler.proto)
+                handler.send_frame(frame, "ping")
+            if pings:
+                self.m_pings.inc(len(pings))
+            if reaped:
+                for handler, reason in reaped:
+                    self.m_reaped.labels(reason).inc()
+                    handler.abort_transport()
+                self.log(f"Đóng {len(reaped)} connection không phản hồi", "WARNING")
+        except Exception as e:
+            self.log(f"Lỗi heartbeat: {e}", "ERROR")
+        finally:
+            self.call_later(self.heartbeat.tick_interval, self._heartbeat_tick)
+
+    def toggle_profiler(self):
+        """SIGUSR1: bật / tắt profiler (tắt thì ghi file .prof)"""
+        self.profiler.toggle()
+
+    # ===== Observer =====
+    def attach_observer(self, maxsize: int = EVENT_QUEUE_SIZE) -> queue.Queue:
+        """Trả về queue nhận sự kiện log/counts; observer tự lấy ra trên thread của nó"""
+        q = queue.Queue(maxsize)
+        self._observers = self._observers + [q]
+        return q
+
+    def detach_observer(self, q: queue.Queue):
+        self._observers = [o for o in self._observers if o is not q]
+
+    def _emit(self, event: tuple):
+        # không bao giờ chờ observer: queue đầy thì bỏ sự kiện
+        for q in self._observers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                self.events_dropped += 1
+
+    def log(self, message: str, level="INFO"):
+        """Log ra console + gửi cho observer (gọi được từ mọi thread)"""
+        console = self.console_log and level not in self.console_hidden
+        if not console and not self._observers:
+            return
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        if console:
+            print(f"[{timestamp}] [{level}] {message}", flush=True)
+        if self._observers:
+            self._emit(("log", timestamp, level, message))
+
+    def update_counts(self):
+        """Báo số users/connections hiện tại cho observer"""
+        if self._observers:
+            self._emit(("counts", len(self.online_users()), self.connection_count()))
+
+    def call_later(self, delay: float, fn):
+        """Hẹn giờ gọi fn (engine asyncio override để chạy trên event loop)"""
+        timer = threading.Timer(delay, fn)
+        timer.daemon = True
+        timer.start()
+
+    def call_soon(self, fn, *args):
+        """Chạy fn từ thread khác (bus của cluster); engine asyncio override để chạy trên event loop"""
+        fn(*args)
+
+    def connection_count(self) -> int:
+        with self.client_lock:
+            return len(self.clients)
+
+    def new_outbound_queue(self, on_ready=None) -> OutboundQueue:
+        return OutboundQueue(self.outbound_max_frames, self.outbound_max_bytes,
+                             self.outbound_policy, self.outbound_stats, on_ready)
+
+    def outbound_snapshot(self) -> dict:
+        """Counters của các hàng đợi gửi + tổng độ sâu hiện tại"""
+        with self.client_lock:
+            clients = list(self.clients)
+        depths = [len(h.outbox) for h in clients]
+        stats = self.outbound_stats.snapshot()
+        stats["policy"] = self.outbound_policy
+        stats["depth_total"] = sum(depths)
+        stats["depth_max_now"] = max(depths, default=0)
+        return stats
+
+    def add_client(self, handler):
+        with self.client_lock:
+            self.clients.add(handler)
+        if self.heartbeat is not None:
+            self.heartbeat.watch(handler)
+        self.update_counts()
+
+    def remove_client(self, handler):
+        """Xóa client khỏi danh sách"""
+        with self.client_lock:
+            self.clients.discard(handler)
+        self.update_counts()
+
+    # ===== Attachments =====
+    def store_attachment(self, file_data):
+        """
+        Lưu data của attachment inline vào blob store.
+        Trả về (ref, inline): ref chỉ có {hash, name, type, size} cho client hỗ trợ blob,
+        inline giữ nguyên data cho client cũ. ref = None nếu attachment không hợp lệ.
+        Client cũng có thể gửi thẳng ref (hash đã có trên server) thay vì data.
+        """
+        if not isinstance(file_data, dict):
+            return None, None
+        if file_data.get("data"):
+            try:
+                raw = payload_bytes(file_data["data"])
+            except (ValueError, TypeError):
+                return None, None
+            ref = build_file_ref(file_data, self.blob_store.put(raw), len(raw))
+            return ref, dict(ref, data=raw)
+
+        digest = str(file_data.get("hash", ""))
+        raw = self.blob_store.get(digest) if digest else None
+        if raw is None:
+            return None, None
+        ref = build_file_ref(file_data, digest, len(raw))
+        return ref, dict(ref, data=raw)
+
+    def record_message(self, channel: str, message: dict, legacy: dict | None = None):
+        """Lưu message vào lịch sử và gắn id cho mọi bản sẽ gửi (gọi trước fanout)"""
+        msg_id = self.history.append(channel, message)
+        if msg_id is not None:
+            message["id"] = msg_id
+            if legacy is not None:
+                legacy["id"] = msg_id
+
+    # ===== Hộp thư offline =====
+    def deliver_mailbox(self, user: str):
+        """User vừa online (ở server này hoặc node khác): bắt đầu gửi dần hộp thư offline"""
+        if self.mailbox.pending(user):
+            self.call_later(0, lambda: self._drain_mailbox(user))
+
+    def _drain_mailbox(self, user: str):
+        handler = self.user_manager.get_handler(user)
+        if handler is None:
+            if not self.is_online(user):
+                return  # đã offline lại: giữ phần còn lại cho lần login sau
+        elif handler.closed:
+            return
+        elif len(handler.outbox) > handler.outbox.max_frames // 2:
+            # client nhận chậm: chờ hàng đợi gửi vơi bớt
+            self.call_later(MAILBOX_PACE_INTERVAL, lambda: self._drain_mailbox(user))
+            return
+
+        for message in self.mailbox.take(user, MAILBOX_BATCH):
+            legacy = None
+            if message.get("file"):
+                ref, inline = self.store_attachment(message["file"])
+                if ref is not None:
+                    legacy = dict(message, file=inline)
+            if handler is not None:
+                self.fanout((handler,), message, legacy=legacy)
+            else:
+                self.relay_remote(legacy or message, to_user=user)
+        if self.mailbox.pending(user):
+            self.call_later(MAILBOX_PACE_INTERVAL, lambda: self._drain_mailbox(user))
+
+    # ===== Broadcast helpers =====
+    def fanout(self, handlers, data: dict, key: str | None = None, legacy: dict | None = None) -> int:
+        """
+        Encode data đúng 1 lần (mỗi protocol version) rồi gửi cùng 1 frame (bytes) tới mọi handler.
+        key: frame cùng key có thể được gộp trong hàng đợi (policy coalesce).
+        legacy: bản gửi cho client không có caps "blobs" (attachment kèm data inline).
+        Trả về số handler đã gửi.
+        """
+        frames = {}  # (proto, legacy) -> frame: mỗi biến thể chỉ encode 1 lần
+        packed = {}  # (proto, legacy) -> bản nén, cũng chỉ nén 1 lần
+        sent = 0
+        nbytes = 0
+        for h in handlers:
+            variant = (h.proto, legacy is not None and CAP_BLOBS not in h.caps)
+            frame = frames.get(variant)
+            if frame is None:
+                frame = frames[variant] = encode_frame(legacy if variant[1] else data, h.proto)
+            if h.compress:
+                compressed = packed.get(variant)
+                if compressed is None:
+                    compressed = packed[variant] = self.compress_frame(frame)
+                frame = compressed
+            try:
+                h.send_frame(frame, key)
+                sent += 1
+                nbytes += len(frame)
+            except Exception:
+                self.m_send_errors.inc()
+        self.broadcast_stats.record(len(frames), sent)
+        self.m_fanout.observe(sent)
+        if sent:
+            self.m_frames_out.labels(data.get("type", "")).inc(sent)
+            self.m_bytes_out.inc(nbytes)
+        return sent
+
+    def new_rate_limiter(self):
+        """Bucket cho 1 connection mới (None nếu không giới hạn gì)"""
+        if not any(rate > 0 for rate, _ in self.rate_limits.values()):
+            return None
+        return RateLimiter(self.rate_limits)
+
+    def record_throttle(self, category: str, action: str, size: int):
+        self.m_throttled.labels(category, action).inc()
+        self.m_throttled_bytes.labels(category, action).inc(size)
+
+    def compress_frame(self, frame: bytes) -> bytes:
+        """Nén frame v2 nếu đủ lớn (bản gốc nếu nhỏ hơn ngưỡng hoặc nén không lợi)"""
+        if len(frame) < self.compress_min_bytes:
+            return frame
+        started = time.perf_counter()
+        out = compress_frame_v2(frame, self.compress_level)
+        self.compression_stats.record(len(frame), len(out), time.perf_counter() - started)
+        return out
+
+    def broadcast_online(self, data: dict, exclude: str | None = None, key: str | None = None):
+        """Gửi message đến tất cả users online"""
+        handlers = []
+        for u in self.user_manager.get_online_users():
+            if exclude and u == exclude:
+                continue
+            h = self.user_manager.get_handler(u)
+            if h:
+                handlers.append(h)
+        self.fanout(handlers, data, key)
+
+    def send_user_list_all(self):
+        """Gửi danh sách users đến tất cả clients"""
+        self.broadcast_online(build_user_list(self.online_users()), key="user_list")
+        self.update_counts()
+
+    # ===== Presence =====
+    def presence_changed(self, user: str, online: bool):
+        self.presence.change(user, online)
+        self.update_counts()
+
+    @staticmethod
+    def _build_presence(ops: dict) -> list[dict]:
+        left = [u for u, online in ops.items() if not online]
+        joined = [u for u, online in ops.items() if online]
+        messages = []
+        if left:
+            messages.append(build_presence_leave(left))
+        if joined:
+            messages.append(build_presence_join(joined))
+        return messages
+
+    def _publish_presence(self, messages: list[dict]):
+        """Client hỗ trợ delta nhận các gói delta, client cũ nhận 1 user_list đầy đủ / lần phát"""
+        delta, legacy = [], []
+        for h in self.user_manager.get_online_handlers():
+            (delta if CAP_PRESENCE in h.caps else legacy).append(h)
+        for data in messages:
+            self.fanout(delta, data)
+        if legacy:
+            self.fanout(legacy, build_user_list(self.online_users()), key="user_list")
+
+    def send_user_list(self, handler):
+        """Snapshot user online + version cho 1 client (lúc login hoặc khi client xin presence_sync)"""
+        with self.presence.lock:
+            handler.send_raw(build_user_list(self.online_users(), self.presence.version))
+
+    # ===== Room directory =====
+    def room_changed(self, room: str, user: str | None = None, joined: bool = True):
+        """user=None: phòng mới tạo; ngược lại user join (joined=True) / rời phòng"""
+        self.republish_room(room)
+        if user is None:
+            self.rooms_feed.change((room, None), "created")
+        else:
+            self.rooms_feed.change((room, user), "add" if joined else "remove")
+
+    def _build_room_delta(self, ops: dict) -> list[dict]:
+        changes = {}
+        for (room, user), op in ops.items():
+            change = changes.setdefault(room, {"room": room})
+            if op == "created":
+                change["created"] = True
+            else:
+                change.setdefault(op, []).append(user)
+        for room, count in self.room_manager.counts(list(changes)).items():
+            changes[room]["count"] = count
+        return [build_room_delta(list(changes.values()))]
+
+    def _publish_rooms(self, messages: list[dict]):
+        """
+        Mỗi lần phát chỉ mang các phòng vừa đổi: client room_delta nhận delta,
+        client room_counts nhận số người, client cũ nhận 1 room_list đầy đủ.
+        """
+        full, counts_only, legacy = [], [], []
+        for h in self.user_manager.get_online_handlers():
+            if CAP_ROOM_DELTA in h.caps:
+                full.append(h)
+            elif CAP_ROOM_COUNTS in h.caps:
+                counts_only.append(h)
+            else:
+                legacy.append(h)
+        for data in messages:
+            if full:
+                self.fanout(full, data)
+            if counts_only:
+                counts = {c["room"]: c["count"] for c in data["changes"]}
+                self.fanout(counts_only, build_room_counts(counts, data["version"]))
+        if legacy:
+            self.fanout(legacy, build_room_list(self.room_manager.snapshot()), key="room_list")
+
+    def send_room_list(self, handler):
+        """Snapshot danh sách phòng + version cho 1 client (lúc login hoặc khi client xin room_sync)"""
+        with self.rooms_feed.lock:
+            version = self.rooms_feed.version
+            if CAP_ROOM_COUNTS in handler.caps and CAP_ROOM_DELTA not in handler.caps:
+                handler.send_raw(build_room_counts(self.room_manager.counts(), version, full=True))
+            else:
+                handler.send_raw(build_room_list(self.room_manager.snapshot(), version))
+
+    def republish_room(self, room: str):
+        """
+        Dựng lại tuple handler của phòng từ tập member mới nhất.
+        Lock chỉ để các lần dựng lại không ghi đè lẫn nhau; bản cuối cùng luôn đọc member mới nhất.
+        """
+        with self._room_handlers_lock:
+            handlers = tuple(h for h in map(self.user_manager.get_handler, self.room_manager.members_view(room))
+                             if h is not None)
+            if handlers or self.room_manager.room_exists(room):
+                self._room_handlers[room] = handlers
+
+    def room_handlers(self, room: str) -> tuple:
+        return self._room_handlers.get(room, ())
+
+    def send_room_list_all(self):
+        """Gửi danh sách rooms đến tất cả clients"""
+        self.broadcast_online(build_room_list(self.room_manager.snapshot()), key="room_list")
+
+    def broadcast_system(self, msg: str):
+        """Broadcast system message"""
+        self.broadcast_online(build_system(msg))
+
+    def broadcast_room(self, room: str, data: dict, legacy: dict | None = None):
+        """Gửi message đến tất cả members trong room (đọc tuple handler dựng sẵn, không lock)"""
+        self.fanout(self.room_handlers(room), data, legacy=legacy)
+        self.relay_remote(legacy or data, room=room)
+
+    # ===== Cluster =====
+    def is_online(self, user: str) -> bool:
+        """User online ở server này hoặc ở worker / node khác trong cluster"""
+        return self.user_manager.has_user(user) or (self.cluster is not None and self.cluster.has_user(user))
+
+    def online_users(self) -> list[str]:
+        users = self.user_manager.get_online_users()
+        if self.cluster is not None:
+            users = users + self.cluster.users()
+        return users
+
+    def share_presence(self, user: str, online: bool):
+        if self.cluster is not None:
+            self.cluster.share_presence(user, online)
+
+    def share_room(self, event: str, room: str, user: str | None = None):
+        if self.cluster is not None:
+            self.cluster.share_room(event, room, user)
+
+    def relay_remote(self, data: dict, to_user: str | None = None, room: str | None = None):
+        """Chuyển message (bản đầy đủ) tới node đang giữ to_user / member của room"""
+        if self.cluster is not None:
+            self.cluster.publish(data, to_user, room)
+
+    def deliver_remote(self, data: dict, to_user: str | None = None, room: str | None = None):
+        """Message từ node khác: gửi cho connection cục bộ của to_user / của room"""
+        legacy = None
+        if data.get("file"):
+            ref, inline = self.store_attachment(data["file"])
+            if ref is None:
+                return
+            data, legacy = dict(data, file=ref), dict(data, file=inline)
+        if room:
+            handlers = self.room_handlers(room)
+        else:
+            handlers = [h for h in (self.user_manager.get_handler(to_user),) if h is not None]
+        self.fanout(handlers, data, legacy=legacy)
+
+
+# ===== CLI dùng chung cho các engine =====
+def add_server_arguments(parser, backlog: int = 1024):
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--backlog", type=int, default=backlog)
+    parser.add_argument("--log-dir", default="logs")
+    parser.add_argument("--log-gzip", action="store_true", help="Nén file log của các ngày đã qua")
+    parser.add_argument("--console-level", choices=CONSOLE_LEVELS, default=DEFAULT_CONSOLE_LEVEL,
+                        help="Log ra console: client = cả từng message / connection, "
+                             "info = bỏ các dòng đó (mặc định), warning = chỉ cảnh báo + lỗi")
+    parser.add_argument("-q", "--quiet", dest="console_level", action="store_const", const="warning",
+                        help="= --console-level warning")
+    parser.add_argument("--slow-policy", choices=POLICIES, default=POLICY_DROP,
+                        help="Xử lý client nhận chậm khi hàng đợi gửi đầy")
+    parser.add_argument("--outbound-max-frames", type=int, default=DEFAULT_MAX_FRAMES)
+    parser.add_argument("--outbound-max-bytes", type=int, default=DEFAULT_MAX_BYTES)
+    parser.add_argument("--blob-dir", default="blobs", help="Thư mục lưu attachment theo hash")
+    parser.add_argument("--blob-max-mb", type=int, default=1024)
+    parser.add_argument("--history-db", default="history.db", help="File SQLite lưu lịch sử chat")
+    parser.add_argument("--mailbox-dir", default="mailbox", help="Thư mục hộp thư offline (phần tràn RAM)")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="Port HTTP cho /metrics (Prometheus), 0 = tắt")
+    parser.add_argument("--metrics-host", default="127.0.0.1")
+    parser.add_argument("--profile-dir", default="profiles", help="Thư mục file .prof (bật/tắt bằng SIGUSR1)")
+    parser.add_argument("--rate-limit", action="append", default=[], type=parse_rate_limit,
+                        metavar="CATEGORY=RATE[:BURST]",
+                        help="Token bucket / connection, lặp lại được (vd chat=5:20, room=1:5, "
+                             "bytes=8388608:16777216, sync=0 để tắt 1 nhóm)")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Tắt mọi rate limit")
+    parser.add_argument("--compress-min", type=int, default=COMPRESS_MIN_BYTES,
+                        help="Nén frame v2 từ N byte cho client có caps deflate, 0 = tắt")
+    parser.add_argument("--compress-level", type=int, default=COMPRESS_LEVEL, choices=range(1, 10),
+                        metavar="1-9")
+    parser.add_argument("--heartbeat-interval", type=float, default=DEFAULT_HEARTBEAT_INTERVAL,
+                        help="Gửi ping khi client (caps heartbeat) im lặng N giây")
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help="Đóng connection im lặng / chưa login sau N giây, 0 = tắt")
+    parser.add_argument("--cluster-broker", default=None,
+                        help="Địa chỉ broker (host:port hoặc Unix socket) để chạy nhiều node chung user/phòng")
+    parser.add_argument("--node-id", default=None, help="Tên node trong cluster (mặc định hostname:port)")
+
+
+def server_kwargs(args) -> dict:
+    """Tham số khởi tạo ChatServerBase từ kết quả add_server_arguments"""
+    return {
+        "log_dir": args.log_dir,
+        "log_compress": args.log_gzip,
+        "outbound_policy": args.slow_policy,
+        "outbound_max_frames": args.outbound_max_frames,
+        "outbound_max_bytes": args.outbound_max_bytes,
+        "blob_dir": args.blob_dir,
+        "blob_max_bytes": args.blob_max_mb * 1024 * 1024,
+        "history_db": args.history_db,
+        "mailbox_dir": args.mailbox_dir,
+        "metrics_host": args.metrics_host,
+        "metrics_port": args.metrics_port,
+        "profile_dir": args.profile_dir,
+        "compress_min_bytes": args.compress_min,
+        "compress_level": args.compress_level,
+        "rate_limits": rate_limits_from_args(args),
+        "heartbeat_interval": args.heartbeat_interval,
+        "idle_timeout": args.idle_timeout,
+        "console_level": args.console_level,
+    }
+
+
+def rate_limits_from_args(args) -> dict:
+    if args.no_rate_limit:
+        return {}
+    limits = dict(DEFAULT_RATE_LIMITS)
+    for category, rate, burst in args.rate_limit:
+        limits[category] = (rate, burst)
+    return limits
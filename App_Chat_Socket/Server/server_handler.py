@@ -1,6 +1,7 @@
 ﻿import os
 import sys
 import threading
+import time
 import importlib.util
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -19,10 +20,17 @@ spec.loader.exec_module(protocol)
 # map function
 decode_message = protocol.decode_message
 encode_message = protocol.encode_message
+encode_frame = protocol.encode_frame
 build_error = protocol.build_error
 build_private = protocol.build_private
 build_group = protocol.build_group
 
+from framing import FrameReader
+from chat_session import handles, run_handler
+
+# type -> handler của ClientHandler (chỉ nói v1, handler nhận dict), đăng ký bằng @handles
+LEGACY_HANDLERS: dict = {}
+
 
 
 
@@ -35,56 +43,36 @@ class ClientHandler(threading.Thread):
         self.user_manager = user_manager
         self.username = None
         self.running = True
+        self.proto = protocol.PROTO_V1  # handler này chỉ nói v1
+        self.caps = frozenset()  # không hỗ trợ blob -> luôn nhận attachment inline
+        self.compress = False
 
     def run(self):
-        buffer = b""
+        reader = FrameReader(on_oversize=lambda size: self.send_raw(build_error("Gói tin quá lớn")))
         try:
             while self.running:
-                chunk = self.client_socket.recv(4096)
-                if not chunk:
+                if not reader.recv_from(self.client_socket):
                     break
-                buffer += chunk
-
-                while b"\n" in buffer:
-                    line, buffer = buffer.split(b"\n", 1)
-                    if line:
-                        self._handle_one(line)
+                for line in reader.frames():
+                    self._handle_one(line)
         except Exception as e:
             self.server.log(f"Lỗi recv từ {self.username or self.address}: {e}", "ERROR")
         finally:
             self.close()
 
     def _handle_one(self, raw: bytes):
+        started = time.perf_counter()
         data = decode_message(raw)
         if data is None:
             return
+        run_handler(LEGACY_HANDLERS, self, data.get("type"), data, started)
 
-        t = data.get("type")
-
-        if t == "login":
-            self._login(data)
-        elif t == "logout":
-            self.running = False
-
-        elif t == "private":
-            self._private(data)
-
-        elif t == "create_room":
-            self._create_room(data)
-
-        elif t == "join_room":
-            self._join_room(data)
-
-        elif t == "leave_room":
-            self._leave_room(data)
-
-        elif t == "group":
-            self._group(data)
-
-        else:
-            pass
+    @handles("logout", registry=LEGACY_HANDLERS)
+    def _logout(self, data: dict):
+        self.running = False
 
     # ===== Login =====
+    @handles("login", registry=LEGACY_HANDLERS)
     def _login(self, data: dict):
         username = (data.get("user") or "").strip()
         if not username:
@@ -106,6 +94,7 @@ class ClientHandler(threading.Thread):
         self.server.update_counts()
 
     # ===== Private 1-1 =====
+    @handles("private", registry=LEGACY_HANDLERS)
     def _private(self, data: dict):
         if not self.username:
             self.send_raw(build_error("Bạn chưa login"))
@@ -127,15 +116,16 @@ class ClientHandler(threading.Thread):
             self.send_raw(build_error(f"User '{to_user}' không online"))
             return
 
-        payload = build_private(self.username, to_user, msg)
+        frame = encode_frame(build_private(self.username, to_user, msg))
 
-        # gửi cho người nhận + echo cho người gửi
-        target.send_raw(payload)
-        self.send_raw(payload)
+        # gửi cho người nhận + echo cho người gửi (dùng chung 1 frame)
+        target.send_frame(frame)
+        self.send_frame(frame)
 
         self.server.log(f"💬 PRIVATE {self.username} -> {to_user}: {msg}", "CLIENT")
 
     # ===== Rooms =====
+    @handles("create_room", registry=LEGACY_HANDLERS)
     def _create_room(self, data: dict):
         if not self.username:
             self.send_raw(build_error("Bạn chưa login"))
@@ -153,11 +143,13 @@ class ClientHandler(threading.Thread):
 
         # creator auto-join cho tiện dùng
         self.server.room_manager.join(room, self.username)
+        self.server.republish_room(room)
 
         self.server.log(f"🧩 {self.username} tạo phòng '{room}'", "SUCCESS")
         self.server.broadcast_system(f"{self.username} đã tạo phòng '{room}'")
         self.server.send_room_list_all()
 
+    @handles("join_room", registry=LEGACY_HANDLERS)
     def _join_room(self, data: dict):
         if not self.username:
             self.send_raw(build_error("Bạn chưa login"))
@@ -169,10 +161,12 @@ class ClientHandler(threading.Thread):
             return
 
         self.server.room_manager.join(room, self.username)
+        self.server.republish_room(room)
         self.server.log(f"➕ {self.username} join '{room}'", "INFO")
         self.server.broadcast_system(f"{self.username} đã join phòng '{room}'")
         self.server.send_room_list_all()
 
+    @handles("leave_room", registry=LEGACY_HANDLERS)
     def _leave_room(self, data: dict):
         if not self.username:
             self.send_raw(build_error("Bạn chưa login"))
@@ -184,10 +178,12 @@ class ClientHandler(threading.Thread):
             return
 
         self.server.room_manager.leave(room, self.username)
+        self.server.republish_room(room)
         self.server.log(f"➖ {self.username} leave '{room}'", "INFO")
         self.server.broadcast_system(f"{self.username} đã rời phòng '{room}'")
         self.server.send_room_list_all()
 
+    @handles("group", registry=LEGACY_HANDLERS)
     def _group(self, data: dict):
         if not self.username:
             self.send_raw(build_error("Bạn chưa login"))
@@ -201,8 +197,7 @@ class ClientHandler(threading.Thread):
         if not msg:
             return
 
-        members = self.server.room_manager.members(room)
-        if self.username not in members:
+        if not self.server.room_manager.is_member(room, self.username):
             self.send_raw(build_error("Bạn chưa join phòng này"))
             return
 
@@ -212,19 +207,23 @@ class ClientHandler(threading.Thread):
         self.server.log(f"💬 ROOM({room}) {self.username}: {msg}", "CLIENT")
 
     # ===== Send helpers =====
-    def send_raw(self, data: dict):
+    def send_frame(self, frame: bytes, key=None):
         try:
-            self.client_socket.sendall(encode_message(data) + b"\n")
+            self.client_socket.sendall(frame)
         except Exception:
             self.running = False
 
+    def send_raw(self, data: dict):
+        self.send_frame(encode_frame(data))
+
     def close(self):
         self.running = False
 
         if self.username:
             # remove user online + remove from rooms
             try:
-                self.server.room_manager.remove_user_everywhere(self.username)
+                for room in self.server.room_manager.remove_user_everywhere(self.username):
+                    self.server.republish_room(room)
             except Exception:
                 pass
 
@@ -6,7 +6,8 @@ class UserManager:
     """
     Quản lý danh sách user online trên server.
     Map: username -> handler (ClientHandler).
-    Thread-safe (vì nhiều ClientHandler thread add/remove).
+    Copy-on-write: add/remove giữ lock, tạo dict mới rồi thay cả dict;
+    dict đã công bố không bao giờ bị sửa -> mọi hàm đọc không cần lock.
     """
 
     def __init__(self):
@@ -17,22 +18,26 @@ class UserManager:
         with self._lock:
             if username in self._users:
                 return False
-            self._users[username] = handler
+            users = dict(self._users)
+            users[username] = handler
+            self._users = users
             return True
 
     def remove_user(self, username: str) -> None:
         with self._lock:
             if username in self._users:
-                del self._users[username]
+                users = dict(self._users)
+                del users[username]
+                self._users = users
 
     def get_handler(self, username: str) -> Optional[Any]:
-        with self._lock:
-            return self._users.get(username)
+        return self._users.get(username)
+
+    def get_online_handlers(self) -> list[Any]:
+        return list(self._users.values())
 
     def get_online_users(self) -> list[str]:
-        with self._lock:
-            return list(self._users.keys())
+        return list(self._users)
 
     def has_user(self, username: str) -> bool:
-        with self._lock:
-            return username in self._users
+        return username in self._users
@@ -0,0 +1,124 @@
+"""
+Chạy chat server trên nhiều core: N worker process (engine asyncio) cùng listen
+1 port bằng SO_REUSEPORT, kernel chia connection mới cho các worker.
+Process chính chạy broker của bus (Unix socket, xem bus_broker.py) để
+private / group / presence / phòng đi đúng tới worker đang giữ user.
+
+Chạy (Linux): python workers.py --workers 4 --port 5555
+Log / hộp thư offline mỗi worker ở <log-dir>/w<i>, <mailbox-dir>/w<i>; blob store dùng chung 1 thư mục.
+--metrics-port P: worker i mở /metrics trên port P + i.
+kill -USR1 <pid process chính>: bật/tắt profiler của mọi worker (file ở <profile-dir>/w<i>).
+Có --cluster-broker: các worker nối thẳng vào broker đó (cluster nhiều máy),
+process chính không chạy broker riêng.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import tempfile
+
+from async_server import AsyncChatServer, add_profiler_signal
+from bus_broker import BusBroker
+from cluster import ClusterNode
+from server_core import add_server_arguments, server_kwargs
+
+WORKER_CHECK_INTERVAL = 1.0
+
+
+def run_worker(index: int, bus_address: str, node_prefix: str, args):
+    """Entry point của 1 worker process"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C do process chính xử lý
+    worker = f"w{index}"
+    kwargs = server_kwargs(args)
+    kwargs["log_dir"] = os.path.join(args.log_dir, worker)
+    kwargs["mailbox_dir"] = os.path.join(args.mailbox_dir, worker)
+    kwargs["profile_dir"] = os.path.join(args.profile_dir, worker)
+    if args.metrics_port:
+        kwargs["metrics_port"] = args.metrics_port + index  # mỗi worker 1 port
+    kwargs["history_shard"] = index  # các worker ghi chung 1 file lịch sử, id không trùng
+    server = AsyncChatServer(args.host, args.port, args.backlog, reuse_port=True, **kwargs)
+    ClusterNode(server, bus_address, f"{node_prefix}/{worker}" if node_prefix else worker)
+    try:
+        asyncio.run(_serve_worker(server))
+    except asyncio.CancelledError:
+        pass
+
+
+async def _serve_worker(server: AsyncChatServer):
+    # process chính terminate() -> SIGTERM: tắt server trên event loop
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.stop)
+    add_profiler_signal(server)
+    await server.serve()
+
+
+async def run_master(args):
+    broker = bus_dir = None
+    if args.cluster_broker:
+        bus_address = args.cluster_broker
+        node_prefix = args.node_id or f"{socket.gethostname()}:{args.port}"
+    else:
+        bus_dir = tempfile.mkdtemp(prefix="chat-bus-")
+        bus_address = os.path.join(bus_dir, "bus.sock")
+        node_prefix = ""
+        broker = BusBroker(log=lambda msg: print(msg, flush=True))
+        await broker.serve(bus_address)
+
+    # spawn: worker không thừa hưởng event loop / socket của process chính
+    ctx = multiprocessing.get_context("spawn")
+    workers = []
+    for i in range(args.workers):
+        p = ctx.Process(target=run_worker, args=(i, bus_address, node_prefix, args), name=f"chat-worker-{i}")
+        p.start()
+        workers.append(p)
+    print(f"[master] {args.workers} worker trên {args.host}:{args.port}, bus {bus_address}", flush=True)
+
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopped.set)
+
+    def forward_profiler_toggle():
+        # SIGUSR1 cho process chính -> bật/tắt profiler của mọi worker
+        for p in workers:
+            if p.is_alive():
+                os.kill(p.pid, signal.SIGUSR1)
+
+    loop.add_signal_handler(signal.SIGUSR1, forward_profiler_toggle)
+    try:
+        while not stopped.is_set():
+            try:
+                await asyncio.wait_for(stopped.wait(), WORKER_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            for p in [p for p in workers if not p.is_alive()]:
+                print(f"[master] {p.name} đã dừng (exit {p.exitcode})", flush=True)
+                workers.remove(p)
+            if not workers:
+                break
+    finally:
+        for p in workers:
+            if p.is_alive():
+                p.terminate()
+        for p in workers:
+            p.join(5)
+        if broker is not None:
+            await broker.close()
+            shutil.rmtree(bus_dir, ignore_errors=True)
+            print(f"[master] bus: {broker.stats()}", flush=True)
+        print("[master] đã tắt", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat server nhiều worker process (SO_REUSEPORT)")
+    add_server_arguments(parser)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    asyncio.run(run_master(args))
+
+
+if __name__ == "__main__":
+    main()
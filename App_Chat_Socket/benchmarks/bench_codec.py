@@ -0,0 +1,130 @@
+"""
+So sánh decode + dispatch của frame client gửi lên:
+- dict: decode_frame bằng json stdlib (đường cũ), handler đọc data.get(...).strip()
+- typed: decode_typed (Login / Private / Group / thao tác phòng, object __slots__),
+  handler đọc thuộc tính; đo với từng JSON codec đang cài (stdlib, orjson)
+
+"dispatch" ở đây là tra bảng type -> handler + phần đọc trường ở đầu handler
+(giống ChatSession), không gồm việc handler làm sau đó (broadcast, log...).
+
+Chạy: python benchmarks/bench_codec.py [--repeat 5] [--count 2000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server"))
+
+import protocol
+from protocol import (
+    PROTO_V1, PROTO_V2, JSON_CODECS, encode_frame, decode_frame, decode_typed,
+    build_login, build_private, build_group, build_join_room,
+)
+from chat_session import _resolve
+
+
+# ===== Phần đầu handler theo 2 kiểu =====
+def _dict_login(data):
+    caps = data.get("caps")
+    if isinstance(caps, list):
+        caps = frozenset(c for c in caps if isinstance(c, str))
+    return data.get("user", "").strip(), data.get("proto"), caps
+
+
+def _dict_private(data):
+    return data.get("from", "").strip(), data.get("to", "").strip(), data.get("msg", ""), data.get("file")
+
+
+def _dict_group(data):
+    return data.get("room", "").strip(), data.get("from", "").strip(), data.get("msg", ""), data.get("file")
+
+
+def _dict_room(data):
+    return data.get("user", "").strip(), data.get("room", "").strip()
+
+
+DICT_HANDLERS = {"login": _dict_login, "private": _dict_private, "group": _dict_group, "join_room": _dict_room}
+
+
+def _typed_login(msg):
+    return msg.user, msg.proto, msg.caps
+
+
+def _typed_private(msg):
+    return msg.sender, msg.to, msg.msg, msg.file
+
+
+def _typed_group(msg):
+    return msg.room, msg.sender, msg.msg, msg.file
+
+
+def _typed_room(msg):
+    return msg.user, msg.room
+
+
+TYPED_HANDLERS = {"login": _typed_login, "private": _typed_private, "group": _typed_group,
+                  "join_room": _typed_room}
+
+
+def scenarios() -> dict:
+    return {
+        "login": build_login("alice", PROTO_V2, ["blobs", "presence_delta", "room_delta"]),
+        "private": build_private("alice", "bob", "tối nay đi ăn không? 🍜"),
+        "group": build_group("room1", "alice", "xin chào mọi người 👋"),
+        "group 1KB": build_group("room1", "alice", "xin chào 👋 " * 85),
+        "join_room": build_join_room("alice", "room1"),
+    }
+
+
+def dict_path(frames, proto):
+    for raw in frames:
+        data = decode_frame(raw, proto)
+        DICT_HANDLERS[data.get("type")](data)
+
+
+def typed_path(frames, proto):
+    for raw in frames:
+        t, msg = _resolve(decode_typed(raw, proto))
+        TYPED_HANDLERS[t](msg)
+
+
+def bench(fn, frames, proto, repeat: int) -> float:
+    """Thời gian tốt nhất (µs) cho 1 frame"""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(frames, proto)
+        best = min(best, time.perf_counter() - t0)
+    return best / len(frames) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--count", type=int, default=2000, help="số frame mỗi lần đo")
+    args = parser.parse_args()
+
+    codecs = list(JSON_CODECS)
+    header = f"{'scenario':<12} {'proto':>5} {'dict/stdlib µs':>15}"
+    for name in codecs:
+        header += f" {'typed/' + name + ' µs':>17} {'speedup':>8}"
+    print(header)
+    for name, data in scenarios().items():
+        for proto in (PROTO_V1, PROTO_V2):
+            wire = encode_frame(data, proto)
+            # body như FrameReader trả về (bỏ \n của v1 / u32 length của v2)
+            frames = [wire[4:] if proto == PROTO_V2 else wire[:-1]] * args.count
+            protocol.set_codec("stdlib")
+            base = bench(dict_path, frames, proto, args.repeat)
+            line = f"{name:<12} {'v' + str(proto):>5} {base:>15.2f}"
+            for codec in codecs:
+                protocol.set_codec(codec)
+                t = bench(typed_path, frames, proto, args.repeat)
+                line += f" {t:>17.2f} {base / t:>7.2f}x"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark MessageStore: tốc độ append() trên thread gửi, tốc độ writer ghi xuống SQLite,
+và thời gian lấy 1 trang "50 tin trước id X" khi DB đã có rất nhiều message.
+
+Chạy: python benchmarks/bench_history.py [--rows 2000000] [--channels 5000] [--db /tmp/history_bench.db]
+(DB được giữ lại giữa các lần chạy: chạy lại với --rows 0 để chỉ đo truy vấn)
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server"))
+
+from message_store import MessageStore, room_channel
+from protocol import build_group
+
+
+def fill(store: MessageStore, rows: int, channels: int):
+    rnd = random.Random(1)
+    message = build_group("room", "user", "x" * 60)
+    start = time.perf_counter()
+    for i in range(rows):
+        while store.append(room_channel(f"room{rnd.randrange(channels)}"), message) is None:
+            time.sleep(0.01)  # hàng đợi đầy: chờ writer
+    appended = time.perf_counter() - start
+    store.flush()
+    total = time.perf_counter() - start
+    print(f"append: {rows} msg, {appended / max(rows, 1) * 1e6:.1f} µs/msg trên thread gọi")
+    print(f"ghi xong: {total:.1f}s ({rows / total:.0f} msg/s), {store.stats()}")
+
+
+def query(store: MessageStore, channels: int, samples: int = 2000):
+    rnd = random.Random(2)
+    latest, paged = [], []
+    for _ in range(samples):
+        channel = room_channel(f"room{rnd.randrange(channels)}")
+        t0 = time.perf_counter()
+        messages, more = store.history(channel)
+        latest.append(time.perf_counter() - t0)
+        if messages and more:
+            t0 = time.perf_counter()
+            store.history(channel, messages[0]["id"])
+            paged.append(time.perf_counter() - t0)
+    for name, times in (("trang mới nhất", latest), ("trang trước id X", paged)):
+        if not times:
+            continue
+        times.sort()
+        print(f"{name}: p50 {times[len(times) // 2] * 1e3:.2f} ms, "
+              f"p99 {times[int(len(times) * 0.99)] * 1e3:.2f} ms ({len(times)} lần)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--channels", type=int, default=5000)
+    parser.add_argument("--db", default=os.path.join("/tmp", "history_bench.db"))
+    args = parser.parse_args()
+
+    store = MessageStore(args.db)
+    if args.rows:
+        fill(store, args.rows, args.channels)
+    size_mb = os.path.getsize(args.db) / 1024 / 1024
+    print(f"DB: {args.db} ({size_mb:.0f} MB)")
+    query(store, args.channels)
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+So sánh protocol v1 (JSON + \\n) và v2 (length-prefixed binary):
+- bytes trên đường truyền
+- chi phí tách frame + decode phía nhận
+
+Chạy: python benchmarks/bench_protocol.py [--repeat 200]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server"))
+
+from framing import FrameReader
+from protocol import (
+    PROTO_V1, PROTO_V2, encode_frame, decode_frame,
+    build_group, build_private, build_user_list, build_room_list,
+)
+
+
+def scenarios() -> dict:
+    attachment = os.urandom(1024 * 1024)
+    users = [f"user{i:05d}" for i in range(2000)]
+    rooms = [{"name": f"room{i}", "members": users[i:i + 50]} for i in range(200)]
+    return {
+        "chat (short)": build_group("room1", "alice", "xin chào mọi người 👋"),
+        "private 1MB file": build_private("alice", "bob", "ảnh nè", {
+            "name": "photo.png", "type": "image/png", "size": len(attachment), "data": attachment,
+        }),
+        "user_list 2000": build_user_list(users),
+        "room_list 200x50": build_room_list(rooms),
+    }
+
+
+def bench_decode(wire: bytes, proto: int, count: int, repeat: int) -> float:
+    """Thời gian trung bình (µs) để tách + decode 1 frame"""
+    stream = wire * count
+    best = float("inf")
+    for _ in range(repeat):
+        reader = FrameReader(max_frame=64 * 1024 * 1024)
+        reader.length_prefixed = proto == PROTO_V2
+        t0 = time.perf_counter()
+        reader.feed(stream)
+        n = 0
+        for frame in reader.frames():
+            decode_frame(frame, proto)
+            n += 1
+        best = min(best, time.perf_counter() - t0)
+        assert n == count
+    return best / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--count", type=int, default=20, help="số frame mỗi lần đo")
+    args = parser.parse_args()
+
+    print(f"{'scenario':<20} {'v1 bytes':>12} {'v2 bytes':>12} {'ratio':>7} "
+          f"{'v1 µs':>10} {'v2 µs':>10} {'speedup':>8}")
+    for name, data in scenarios().items():
+        w1 = encode_frame(data, PROTO_V1)
+        w2 = encode_frame(data, PROTO_V2)
+        t1 = bench_decode(w1, PROTO_V1, args.count, args.repeat)
+        t2 = bench_decode(w2, PROTO_V2, args.count, args.repeat)
+        print(f"{name:<20} {len(w1):>12,} {len(w2):>12,} {len(w2) / len(w1):>7.2f} "
+              f"{t1:>10.1f} {t2:>10.1f} {t1 / t2:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
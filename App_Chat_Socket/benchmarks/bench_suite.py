@@ -0,0 +1,394 @@
+"""
+Microbenchmark các đường nóng: encode/decode message, encode_file/decode_file,
+tách frame từ buffer nhận, bỏ frame vượt rate limit, RoomManager.snapshot,
+broadcast_room qua socketpair.
+Mỗi case chạy với nhiều kích thước (message, phòng, số user), báo ops/s và
+bộ nhớ cấp phát đỉnh / op (tracemalloc), rồi so với file baseline.
+
+Chạy: python benchmarks/bench_suite.py                    # đo + so với baseline nếu có
+      python benchmarks/bench_suite.py --save-baseline    # ghi kết quả làm baseline mới
+      python benchmarks/bench_suite.py --filter framing --json out.json
+Thoát với mã 1 nếu có case chậm hơn / cấp phát nhiều hơn baseline quá --tolerance.
+Baseline phụ thuộc máy: tạo trên chính máy (CI) dùng để so sánh.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server"))
+
+from framing import FrameReader, RECV_SIZE
+from protocol import (
+    PROTO_V1, PROTO_V2, encode_message, decode_message, encode_frame, decode_frame, decode_typed,
+    encode_file, decode_file, build_group, peek_type,
+)
+from room_manager import RoomManager
+from rate_limit import RateLimiter
+from server_core import ChatServerBase
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_TOLERANCE = 0.15
+ALLOC_SAMPLES = 20
+
+
+class Case:
+    """
+    1 benchmark: setup() trả về hàm op() không tham số; teardown() dọn tài nguyên.
+    ops_per_call: số đơn vị công việc 1 lần op() làm (vd số frame được tách).
+    """
+
+    def __init__(self, group: str, name: str, setup, teardown=None, ops_per_call: int = 1):
+        self.group = group
+        self.name = name
+        self.setup = setup
+        self.teardown = teardown
+        self.ops_per_call = ops_per_call
+
+    @property
+    def key(self) -> str:
+        return f"{self.group}/{self.name}"
+
+
+def measure(case: Case, min_time: float, repeat: int) -> dict:
+    op = case.setup()
+    try:
+        # ước lượng số lần gọi để mỗi lượt đo ~min_time giây
+        calls = 1
+        while True:
+            t0 = time.perf_counter()
+            for _ in range(calls):
+                op()
+            elapsed = time.perf_counter() - t0
+            if elapsed >= min_time / 10 or calls >= 1 << 20:
+                break
+            calls *= 4
+        calls = max(1, int(calls * min_time / max(elapsed, 1e-9)))
+
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            for _ in range(calls):
+                op()
+            best = min(best, time.perf_counter() - t0)
+
+        # bộ nhớ cấp phát đỉnh trong 1 lần op (kể cả phần được giải phóng ngay sau đó)
+        tracemalloc.start()
+        peaks = []
+        for _ in range(ALLOC_SAMPLES):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            op()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - current)
+        tracemalloc.stop()
+    finally:
+        if case.teardown:
+            case.teardown()
+
+    per_op = best / calls / case.ops_per_call
+    return {
+        "ops_per_sec": round(1 / per_op, 1),
+        "us_per_op": round(per_op * 1e6, 3),
+        "alloc_peak_bytes": int(sorted(peaks)[len(peaks) // 2] / case.ops_per_call),
+    }
+
+
+# ===== Cases =====
+def _text(size: int) -> str:
+    return ("xin chào 👋 " * (size // 12 + 1))[:size]
+
+
+def protocol_cases(sizes) -> list[Case]:
+    cases = []
+    for size in sizes:
+        data = build_group("room1", "alice", _text(size))
+        raw = encode_message(data)
+        wire2 = encode_frame(data, PROTO_V2)
+        cases += [
+            Case("encode_message", f"{size}B", lambda d=data: lambda: encode_message(d)),
+            Case("decode_message", f"{size}B", lambda r=raw: lambda: decode_message(r)),
+            Case("encode_frame_v2", f"{size}B", lambda d=data: lambda: encode_frame(d, PROTO_V2)),
+            # body sau u32 length, như frame FrameReader trả về
+            Case("decode_frame_v2", f"{size}B", lambda b=wire2[4:]: lambda: decode_frame(b, PROTO_V2)),
+            Case("decode_typed", f"{size}B", lambda r=raw: lambda: decode_typed(r)),
+            Case("decode_typed_v2", f"{size}B", lambda b=wire2[4:]: lambda: decode_typed(b, PROTO_V2)),
+        ]
+    return cases
+
+
+def file_cases(sizes) -> list[Case]:
+    cases = []
+    for size in sizes:
+        work = {}
+
+        def setup(size=size, work=work):
+            work["dir"] = tempfile.mkdtemp(prefix="bench-file-")
+            path = os.path.join(work["dir"], "photo.png")
+            with open(path, "wb") as f:
+                f.write(os.urandom(size))
+            return lambda: encode_file(path)
+
+        def setup_decode(size=size, work=work):
+            work["dir"] = tempfile.mkdtemp(prefix="bench-file-")
+            path = os.path.join(work["dir"], "photo.png")
+            with open(path, "wb") as f:
+                f.write(os.urandom(size))
+            file_dict = encode_file(path)
+            out_dir = os.path.join(work["dir"], "out")
+
+            def op():
+                os.remove(decode_file(file_dict, out_dir))
+            return op
+
+        teardown = lambda work=work: shutil.rmtree(work["dir"], ignore_errors=True)
+        cases += [
+            Case("encode_file", _size_name(size), setup, teardown),
+            Case("decode_file", _size_name(size), setup_decode, teardown),
+        ]
+    return cases
+
+
+def framing_cases(sizes, frames: int = 256) -> list[Case]:
+    """Tách `frames` frame từ luồng byte nhận theo từng chunk RECV_SIZE (như recv loop)"""
+    cases = []
+    for size in sizes:
+        data = build_group("room1", "alice", _text(size))
+        for proto, label in ((PROTO_V1, "v1"), (PROTO_V2, "v2")):
+            stream = encode_frame(data, proto) * frames
+            chunks = [stream[i:i + RECV_SIZE] for i in range(0, len(stream), RECV_SIZE)]
+
+            def setup(chunks=chunks, proto=proto):
+                def op():
+                    reader = FrameReader()
+                    reader.length_prefixed = proto == PROTO_V2
+                    n = 0
+                    for chunk in chunks:
+                        reader.feed(chunk)
+                        for _ in reader.frames():
+                            n += 1
+                    assert n == frames
+                return op
+
+            cases.append(Case("framing_split", f"{label} {size}B", setup, ops_per_call=frames))
+    return cases
+
+
+def rate_limit_cases(sizes) -> list[Case]:
+    """Frame vượt rate limit bị bỏ sau peek_type + check (so với decode_typed ở trên)"""
+    cases = []
+    for size in sizes:
+        data = build_group("room1", "alice", _text(size))
+        for proto, label in ((PROTO_V1, "v1"), (PROTO_V2, "v2")):
+            wire = encode_frame(data, proto)
+            body = wire[4:] if proto == PROTO_V2 else wire[:-1]
+
+            def setup(body=body, proto=proto):
+                limiter = RateLimiter({"chat": (1e-9, 1.0)})
+                limiter.check("group", len(body))  # bucket hết token
+
+                def op():
+                    assert limiter.check(peek_type(body, proto), len(body)) == "chat"
+                return op
+
+            cases.append(Case("rate_limit_reject", f"{label} {size}B", setup))
+    return cases
+
+
+def room_cases(shapes) -> list[Case]:
+    cases = []
+    for rooms, members in shapes:
+        def setup(rooms=rooms, members=members):
+            rm = RoomManager()
+            for i in range(rooms):
+                rm.create_room(f"room{i}")
+                for j in range(members):
+                    rm.join(f"room{i}", f"user{(i * 7 + j) % (rooms * members // 4 + members)}")
+            return rm.snapshot
+        cases.append(Case("room_snapshot", f"{rooms}x{members}", setup))
+    return cases
+
+
+class _PairHandler:
+    """Connection giả cho fanout: hàng đợi gửi thật + 1 đầu socketpair"""
+
+    def __init__(self, server, proto: int):
+        self.sock, self.peer = socket.socketpair()
+        self.peer.setblocking(False)
+        self.proto = proto
+        self.caps = frozenset()
+        self.compress = False
+        self.closed = False
+        self.outbox = server.new_outbound_queue()
+
+    def send_frame(self, frame: bytes, key=None):
+        self.outbox.put(frame, key)
+
+    def flush(self):
+        """Việc writer của connection làm: xả hàng đợi xuống socket; đầu kia đọc bỏ"""
+        batch = self.outbox.pop_batch()
+        if batch:
+            self.sock.sendall(b"".join(batch))
+        try:
+            while self.peer.recv(RECV_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        self.sock.close()
+        self.peer.close()
+
+
+def broadcast_cases(room_sizes, msg_size: int = 256) -> list[Case]:
+    cases = []
+    for size in room_sizes:
+        work = {}
+
+        def setup(size=size, work=work):
+            raise_fd_limit(size * 2 + 64)
+            work["dir"] = tempfile.mkdtemp(prefix="bench-fanout-")
+            server = ChatServerBase(
+                log_dir=os.path.join(work["dir"], "logs"), blob_dir=os.path.join(work["dir"], "blobs"),
+                history_db=os.path.join(work["dir"], "history.db"),
+                mailbox_dir=os.path.join(work["dir"], "mailbox"),
+            )
+            server.console_log = False
+            server.room_manager.create_room("bench")
+            handlers = []
+            for i in range(size):
+                h = _PairHandler(server, PROTO_V2 if i % 2 else PROTO_V1)
+                user = f"user{i}"
+                server.user_manager.add_user(user, h)
+                server.room_manager.join("bench", user)
+                handlers.append(h)
+            server.republish_room("bench")
+            work["handlers"] = handlers
+            work["server"] = server
+            message = build_group("bench", "user0", _text(msg_size))
+
+            def op():
+                server.broadcast_room("bench", message)
+                for h in handlers:
+                    h.flush()
+            return op
+
+        def teardown(work=work):
+            for h in work.get("handlers", ()):
+                h.close()
+            work["server"].history.close()
+            work["server"].logger.close()
+            shutil.rmtree(work["dir"], ignore_errors=True)
+
+        cases.append(Case("broadcast_room", f"{size} members", setup, teardown))
+    return cases
+
+
+def _size_name(size: int) -> str:
+    if size >= 1024 * 1024:
+        return f"{size // (1024 * 1024)}MB"
+    if size >= 1024:
+        return f"{size // 1024}KB"
+    return f"{size}B"
+
+
+def raise_fd_limit(needed: int):
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+
+
+def all_cases(quick: bool) -> list[Case]:
+    if quick:
+        return (protocol_cases((64, 4096)) + file_cases((16 * 1024,)) + framing_cases((64, 4096))
+                + rate_limit_cases((64, 4096)) + room_cases(((20, 10), (200, 50))) + broadcast_cases((10, 100)))
+    return (protocol_cases((64, 1024, 16 * 1024)) + file_cases((16 * 1024, 256 * 1024, 4 * 1024 * 1024))
+            + framing_cases((64, 1024, 16 * 1024)) + rate_limit_cases((64, 16 * 1024)) + room_cases(((20, 10), (200, 50), (1000, 100)))
+            + broadcast_cases((10, 100, 1000)))
+
+
+# ===== Baseline =====
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Danh sách case tệ hơn baseline quá tolerance (chậm hơn hoặc cấp phát nhiều hơn)"""
+    problems = []
+    for key, cur in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        if cur["ops_per_sec"] < base["ops_per_sec"] * (1 - tolerance):
+            problems.append(f"{key}: {cur['ops_per_sec']:,.0f} ops/s < baseline {base['ops_per_sec']:,.0f}")
+        # chênh vài trăm byte là nhiễu của tracemalloc
+        if cur["alloc_peak_bytes"] > base["alloc_peak_bytes"] * (1 + tolerance) + 256:
+            problems.append(f"{key}: cấp phát {cur['alloc_peak_bytes']:,} B/op > baseline "
+                            f"{base['alloc_peak_bytes']:,}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark protocol / framing / fan-out")
+    parser.add_argument("--filter", default="", help="Chỉ chạy case có key chứa chuỗi này")
+    parser.add_argument("--quick", action="store_true", help="Ít kích thước hơn")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Giây cho mỗi lượt đo")
+    parser.add_argument("--repeat", type=int, default=5, help="Lấy lượt nhanh nhất")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--json", default=None, help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+
+    results = {}
+    print(f"{'case':<36} {'ops/s':>14} {'µs/op':>10} {'alloc B/op':>12} {'vs baseline':>12}")
+    for case in all_cases(args.quick):
+        if args.filter not in case.key:
+            continue
+        r = results[case.key] = measure(case, args.min_time, args.repeat)
+        base = baseline.get(case.key)
+        ratio = f"{r['ops_per_sec'] / base['ops_per_sec']:.2f}x" if base else "-"
+        print(f"{case.key:<36} {r['ops_per_sec']:>14,.0f} {r['us_per_op']:>10.2f} "
+              f"{r['alloc_peak_bytes']:>12,} {ratio:>12}", flush=True)
+
+    report = {
+        "env": {"python": platform.python_version(), "platform": platform.platform(),
+                "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nĐã lưu baseline: {args.baseline}")
+        return
+
+    problems = compare(results, baseline, args.tolerance)
+    if problems:
+        print(f"\nREGRESSION (> {args.tolerance:.0%} so với baseline):")
+        for p in problems:
+            print("  ", p)
+        sys.exit(1)
+    if baseline:
+        print(f"\nKhông có case nào tệ hơn baseline quá {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
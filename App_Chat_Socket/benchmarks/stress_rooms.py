@@ -0,0 +1,90 @@
+"""
+Stress RoomManager: nhiều thread join/leave/disconnect cùng lúc,
+sau đó kiểm tra index user -> rooms khớp với room -> members.
+Đo thêm thời gian remove_user_everywhere khi server có rất nhiều phòng.
+
+Chạy: python benchmarks/stress_rooms.py [--threads 8] [--ops 20000] [--rooms 5000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server"))
+
+from room_manager import RoomManager
+
+
+def worker(rm: RoomManager, seed: int, ops: int, rooms: list[str], users: list[str]):
+    rnd = random.Random(seed)
+    for _ in range(ops):
+        user = rnd.choice(users)
+        r = rnd.random()
+        if r < 0.5:
+            rm.join(rnd.choice(rooms), user)
+        elif r < 0.9:
+            rm.leave(rnd.choice(rooms), user)
+        elif r < 0.98:
+            rm.remove_user_everywhere(user)
+        else:
+            rm.rooms_of(user)
+
+
+def stress(threads: int, ops: int) -> RoomManager:
+    rm = RoomManager()
+    rooms = [f"room{i}" for i in range(50)]
+    users = [f"user{i}" for i in range(200)]
+    for room in rooms:
+        rm.create_room(room)
+
+    pool = [threading.Thread(target=worker, args=(rm, seed, ops, rooms, users)) for seed in range(threads)]
+    t0 = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    print(f"stress: {threads} threads x {ops} ops trong {elapsed:.2f}s")
+    return rm
+
+
+def bench_disconnect(room_count: int, repeat: int = 2000) -> float:
+    """µs cho 1 lần disconnect của user ở 3 phòng, khi server có room_count phòng"""
+    rm = RoomManager()
+    for i in range(room_count):
+        rm.create_room(f"room{i}")
+        rm.join(f"room{i}", f"bg{i % 100}")
+    t0 = time.perf_counter()
+    for n in range(repeat):
+        user = f"u{n}"
+        for i in (1, room_count // 2, room_count - 1):
+            rm.join(f"room{i}", user)
+        rm.remove_user_everywhere(user)
+    return (time.perf_counter() - t0) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--rooms", type=int, default=5000)
+    args = parser.parse_args()
+
+    rm = stress(args.threads, args.ops)
+    problems = rm.check_consistency()
+    if problems:
+        print(f"LỖI: index lệch ({len(problems)}):")
+        for p in problems[:20]:
+            print("  ", p)
+        sys.exit(1)
+    print("index user -> rooms khớp room -> members")
+
+    for count in (100, args.rooms):
+        print(f"join 3 phòng + disconnect với {count:>6} phòng: {bench_disconnect(count):.1f} µs")
+
+
+if __name__ == "__main__":
+    main()